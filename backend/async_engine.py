@@ -0,0 +1,254 @@
+"""
+ExpenseEngine with its read surface on psycopg 3's AsyncConnectionPool.
+
+ExpenseEngine holds the writes (psycopg2, sharing transaction helpers with the
+CSV importers) and the SQL and result shaping of every read (READ_QUERIES,
+_list_query, _dashboard_queries, ...); the getters themselves live only here.
+The read endpoints await them, so a slow query no longer holds a threadpool
+worker, while writes run from sync endpoints in FastAPI's threadpool. Reads
+and writes share self.cache, so write-through invalidation covers both.
+Uploaded CSVs are queued as import jobs and parsed on a dedicated executor,
+so an import never competes with request threads.
+"""
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from psycopg import AsyncClientCursor
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+from db_pool import _env_int
+from finance_engine import ExpenseEngine, LIST_TABLES, READ_QUERIES, READ_GROUPS, DASHBOARD_TABLES, IMPORT_JOB_QUERY
+from response_cache import cached
+import reconcile
+import invoice_match
+import price_history
+import search
+
+# How long GET /upload/{job_id} waits on an import it picked up before answering with its progress
+IMPORT_POLL_BUDGET = float(os.environ.get("IMPORT_POLL_BUDGET", 20))
+
+
+class AsyncExpenseEngine(ExpenseEngine):
+    def __init__(self, bootstrap_schema=None):
+        super().__init__(bootstrap_schema)
+        self._apool = None
+        self._apool_lock = asyncio.Lock()
+        self._csv_executor = ThreadPoolExecutor(
+            max_workers=_env_int("CSV_IMPORT_WORKERS", 2), thread_name_prefix="csv-import")
+
+    async def _get_apool(self):
+        # Opened on first use: the app is mounted under /api, so startup events never reach it
+        if self._apool is None:
+            async with self._apool_lock:
+                if self._apool is None:
+                    pool = AsyncConnectionPool(
+                        self.db_url,
+                        min_size=_env_int("DB_POOL_MIN_SIZE", 1),
+                        max_size=_env_int("DB_POOL_MAX_SIZE", 5),
+                        max_idle=_env_int("DB_POOL_MAX_IDLE", 300),
+                        timeout=_env_int("DB_POOL_TIMEOUT", 10),
+                        check=AsyncConnectionPool.check_connection,
+                        # Client-side binding keeps the psycopg2 SQL (and its untyped parameters) as is
+                        kwargs={"autocommit": True, "cursor_factory": AsyncClientCursor},
+                        open=False,
+                    )
+                    await pool.open()
+                    self._apool = pool
+        return self._apool
+
+    async def close(self):
+        """Shutdown hook: close both connection pools."""
+        if self._apool is not None:
+            await self._apool.close()
+            self._apool = None
+        self.pool.closeall()
+
+    async def _afetch_rows(self, sql, params=None):
+        pool = await self._get_apool()
+        async with pool.connection() as conn, conn.cursor() as cursor:
+            await cursor.execute(sql, params)
+            return self._rows_to_dicts(cursor, await cursor.fetchall())
+
+    async def _afetch_or_empty(self, name, label):
+        try:
+            return await self._afetch_rows(READ_QUERIES[name])
+        except Exception as e:
+            print(f"{label}: {e}")
+            return []
+
+    async def _afetch_group(self, name, label):
+        """READ_GROUPS[name] as {key: rows}; every key maps to [] when a query fails."""
+        group = READ_GROUPS[name]
+        try:
+            return {key: await self._afetch_rows(READ_QUERIES[query]) for key, query in group.items()}
+        except Exception as e:
+            print(f"{label}: {e}")
+            return {key: [] for key in group}
+
+    @cached(("categories",))
+    async def get_categories(self):
+        return await self._afetch_or_empty("categories", "Error fetching categories")
+
+    @cached(("payees",))
+    async def get_payees(self):
+        return await self._afetch_or_empty("payees", "Error fetching payees")
+
+    @cached(("category_rules",))
+    async def get_category_rules(self):
+        return await self._afetch_or_empty("category_rules", "Error fetching category rules")
+
+    @cached(("sales_records",))
+    async def get_sales_records(self):
+        return await self._afetch_or_empty("sales_records", "Sales DB Error")
+
+    @cached(("transactions", "sales_records"))
+    async def get_all_transactions(self):
+        return await self._afetch_or_empty("transactions", "DB Error")
+
+    @cached(("invoice_items",))
+    async def get_all_invoices(self):
+        return await self._afetch_or_empty("invoice_items", "DB Error")
+
+    @cached(("credit_card_records",))
+    async def get_all_credit_cards(self):
+        return await self._afetch_or_empty("credit_card_records", "DB Error")
+
+    @cached(("cash_records",))
+    async def get_all_cash_records(self):
+        return await self._afetch_or_empty("cash_records", "DB Error")
+
+    @cached(lambda table, *args, **kwargs: LIST_TABLES[table].get("depends", (table,)))
+    async def list_records(self, table, limit=None, cursor=None, include_total=False, **filters):
+        """
+        One page of `table` ordered by date DESC, id DESC.
+        Returns {"count", "data", "next_cursor", "total"}; pass next_cursor back to get the following page.
+        """
+        sql, params, limit, count_sql = self._list_query(table, limit, cursor, include_total, **filters)
+        pool = await self._get_apool()
+        async with pool.connection() as conn, conn.cursor() as db_cursor:
+            total = None
+            if count_sql:
+                await db_cursor.execute(count_sql, params)
+                total = (await db_cursor.fetchone())[0]
+            await db_cursor.execute(sql, params)
+            return self._list_page(db_cursor, await db_cursor.fetchall(), limit, total)
+
+    def iter_records(self, table, chunk_size=2000, **filters):
+        """
+        Async iterator over every row of `table` matching `filters`, newest first, read through a
+        server-side (named) cursor so only `chunk_size` rows are held in memory at a time.
+        Filters are validated here, before the iterator is returned.
+        """
+        sql, params = self._iter_sql(table, **filters)
+        return self._aiter_query(sql, params, chunk_size)
+
+    async def _aiter_query(self, sql, params, chunk_size):
+        pool = await self._get_apool()
+        async with pool.connection() as conn:
+            # Named cursors only live inside a transaction
+            async with conn.transaction(force_rollback=True):
+                async with conn.cursor(name="stream_rows", row_factory=dict_row) as cursor:
+                    cursor.itersize = chunk_size
+                    await cursor.execute(sql, params)
+                    async for row in cursor:
+                        yield row
+
+    @cached(reconcile.TABLES)
+    async def get_card_reconciliation(self):
+        return await self._afetch_group("card_reconciliation", "Reconciliation error")
+
+    @cached(invoice_match.TABLES)
+    async def get_invoice_matches(self):
+        return await self._afetch_or_empty("invoice_ledger_matches", "Invoice matching error")
+
+    @cached(invoice_match.TABLES)
+    async def get_unmatched_invoices(self):
+        return await self._afetch_group("unmatched_invoices", "Invoice matching error")
+
+    @cached(price_history.TABLES)
+    async def get_price_report(self, report, arg):
+        """One of price_history.REPORTS with its single parameter (a limit, product code or period kind)."""
+        try:
+            return await self._afetch_rows(price_history.REPORTS[report], (arg,))
+        except Exception as e:
+            print(f"Price history error: {e}")
+            return []
+
+    @cached(search.TABLES)
+    async def get_search_documents(self):
+        return await self._afetch_or_empty("search_documents", "Search error")
+
+    @cached(search.TABLES)
+    async def search_records(self, q, limit=50, date_from=None, date_to=None, min_amount=None, max_amount=None):
+        """Ranked hits over search.SOURCES (arguments as normalized by search.validate)."""
+        filters = (date_from, date_to, min_amount, max_amount)
+        try:
+            if self._search_trgm is None:
+                self._search_trgm = (await self._afetch_rows(search.TRGM_AVAILABLE_QUERY))[0]["available"]
+            if self._search_trgm:
+                rows = await self._afetch_rows(*search.search_sql(q, limit, *filters))
+            else:
+                documents = await self.get_search_documents.entry(self)
+                # Building (and scanning) the in-process index is CPU work: keep it off the event loop
+                rows = await asyncio.get_running_loop().run_in_executor(
+                    None, lambda: self._trigram_index(documents).search(q, limit, *filters))
+            return search.present(rows, q)
+        except Exception as e:
+            print(f"Search error: {e}")
+            return []
+
+    @cached(DASHBOARD_TABLES)
+    async def get_dashboard_summary(self, month=None):
+        """
+        Revenue / expense / cash-on-hand / breakdown aggregates for /dashboard-summary,
+        read from the monthly rollup tables (O(months), not O(rows)).
+        """
+        totals_sql, breakdown_sql, params = self._dashboard_queries(month)
+        pool = await self._get_apool()
+        async with pool.connection() as conn, conn.cursor() as cursor:
+            await cursor.execute(totals_sql, params)
+            totals = await cursor.fetchone()
+            await cursor.execute(breakdown_sql, params)
+            expense_rows = await cursor.fetchall()
+        return self._dashboard_summary(totals, expense_rows)
+
+    async def submit_import(self, source, filename: str, target_tab: str | None = None):
+        """Queue an upload (bytes or its spooled file object) as an import job and wake a local worker."""
+        loop = asyncio.get_running_loop()
+        job_id = await loop.run_in_executor(
+            None, functools.partial(self.enqueue_import, source, filename, target_tab))
+        # Each submit starts one drain loop; the executor size caps how many files parse at once
+        self._csv_executor.submit(self._drain_imports)
+        return job_id
+
+    def _drain_imports(self):
+        try:
+            self.run_pending_imports()
+        except Exception as e:
+            # Jobs left queued are picked up by the next status poll, upload or `manage.py import-worker`
+            print(f"Import worker error: {e}")
+
+    async def advance_import_job(self, job_id):
+        """
+        Run `job_id` from the polling request when nothing else is: on Vercel the instance that
+        queued it is frozen once its response is sent, drain thread included. Waits at most
+        IMPORT_POLL_BUDGET seconds; the import carries on past that and its progress is in the job row.
+        """
+        run = asyncio.get_running_loop().run_in_executor(None, self._advance_import_job, job_id)
+        try:
+            await asyncio.wait_for(asyncio.shield(run), IMPORT_POLL_BUDGET)
+        except asyncio.TimeoutError:
+            pass
+
+    def _advance_import_job(self, job_id):
+        try:
+            self.run_import_job(job_id)
+        except Exception as e:
+            print(f"Import worker error: {e}")
+
+    async def get_import_job(self, job_id):
+        rows = await self._afetch_rows(IMPORT_JOB_QUERY, (job_id,))
+        return rows[0] if rows else None
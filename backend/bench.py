@@ -0,0 +1,171 @@
+# backend/bench.py
+# Benchmarks against a real database: python backend/bench.py <benchmark> [options]
+# Uses DATABASE_URL like the app; data goes into scratch bench_* tables that are dropped afterwards.
+import argparse
+import os
+import sys
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(current_dir)
+
+
+def _timed(label, func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"  {label:<28} {best * 1000:10.1f} ms  ({len(result)} rows)")
+    return best
+
+
+def bench_read_path(args):
+    """pd.read_sql + fillna + to_dict (old read path) vs. the cursor row fetcher."""
+    import pandas as pd
+    from finance_engine import ExpenseEngine
+
+    engine = ExpenseEngine()
+    for size in args.sizes:
+        with engine.connection() as conn, conn.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS bench_transactions")
+            cursor.execute("CREATE TABLE bench_transactions (LIKE transactions INCLUDING DEFAULTS)")
+            cursor.execute('''
+                INSERT INTO bench_transactions (id, date, type, category, payee, payee_note, cash_amount,
+                    description, income, expense, net_amount, bank_balance, account_source, is_duplicate_check)
+                SELECT g, DATE '2020-01-01' + (g % 2000), 'POS', 'Food Material', 'US Foods', NULL, 0,
+                    'BENCH ROW ' || g, 0, (g % 500) / 7.0, -(g % 500) / 7.0, 0, 'Main Bank (Truist)', 'bench_' || g
+                FROM generate_series(1, %s) g
+            ''', (size,))
+            conn.commit()
+
+        sql = "SELECT * FROM bench_transactions ORDER BY date DESC, id DESC"
+
+        def pandas_path():
+            with engine.connection() as conn:
+                df = pd.read_sql(sql, conn)
+            return df.fillna("").to_dict(orient='records')
+
+        print(f"{size} rows:")
+        old = _timed("pandas read_sql", pandas_path, args.repeat)
+        new = _timed("cursor _fetch_rows", lambda: engine._fetch_rows(sql), args.repeat)
+        print(f"  speedup: {old / new:.1f}x")
+
+    with engine.connection() as conn, conn.cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS bench_transactions")
+        conn.commit()
+
+
+STARTUP_PROBE = """
+import os, sys, time
+sys.path.insert(0, {backend!r})
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+client = TestClient(main.app)
+client.cookies.set("auth-token", os.environ.get("ADMIN_PASSWORD", "1234"))
+ready = time.perf_counter()
+status = client.get("/api/dashboard-summary").status_code
+done = time.perf_counter()
+print(imported - start, done - ready, status, "pandas" in sys.modules)
+"""
+
+
+def bench_startup(args):
+    """Cold import time of main.py and latency of the first request, in fresh interpreters."""
+    import subprocess
+
+    probe = STARTUP_PROBE.format(backend=current_dir)
+    for bootstrap in ("0", "1"):
+        env = dict(os.environ, SCHEMA_BOOTSTRAP_ON_START=bootstrap)
+        imports, firsts = [], []
+        for _ in range(args.repeat):
+            out = subprocess.run([sys.executable, "-c", probe], env=env, capture_output=True, text=True, check=True)
+            import_s, first_s, status, pandas_loaded = out.stdout.split()
+            imports.append(float(import_s))
+            firsts.append(float(first_s))
+        print(f"SCHEMA_BOOTSTRAP_ON_START={bootstrap}:")
+        print(f"  import main                  {min(imports) * 1000:10.1f} ms")
+        print(f"  first /dashboard-summary     {min(firsts) * 1000:10.1f} ms  (HTTP {status})")
+        print(f"  pandas loaded at startup     {pandas_loaded}")
+
+
+def bench_parsers(args):
+    """Per-row statement parsing (scalar clean_currency / to_datetime per row) vs. the compiled registry transform."""
+    import pandas as pd
+    import statement_formats
+    from finance_engine import ExpenseEngine
+
+    engine = ExpenseEngine()
+    truist = next(f for f in statement_formats.FORMATS if f["name"] == "truist")
+    transform = statement_formats.compile_format(truist)
+    for size in args.sizes:
+        n = pd.RangeIndex(size)
+        df = pd.DataFrame({
+            "Transaction Date": (n % 28 + 1).map(lambda d: f"03/{d:02d}/2025"),
+            "Posted Date": "03/28/2025",
+            "Transaction Type": "POS",
+            "Full description": "CARD PURCHASE " + (n % 997).astype(str),
+            "Amount": (n % 500).map(lambda v: f"(${v:,.2f})" if v % 3 else f"${v * 10:,.2f}"),
+            "Daily Posted Balance": "$12,345.67",
+        })
+
+        def per_row():
+            rows = []
+            for _, row in df.iterrows():
+                amt = engine.clean_currency(row['Amount'])
+                date = pd.to_datetime(row['Transaction Date']).strftime('%Y-%m-%d')
+                income, expense = (amt, 0.0) if amt > 0 else (0.0, abs(amt))
+                rows.append({
+                    'date': date, 'type': row['Transaction Type'], 'desc': row['Full description'],
+                    'income': income, 'expense': expense,
+                    'balance': engine.clean_currency(row['Daily Posted Balance']),
+                    'source': 'Main Bank (Truist)',
+                    'dup_key': f"{date}_{row['Full description']}_{income}_{expense}",
+                })
+            return rows
+
+        print(f"{size} rows:")
+        old = _timed("per-row parse", per_row, args.repeat)
+        new = _timed("compiled registry transform", lambda: transform(df)[0], args.repeat)
+        print(f"  speedup: {old / new:.1f}x")
+
+
+def bench_currency(args):
+    """Scalar clean_currency mapped over a column vs. the vectorized normalize_currency, on --cells mixed cells."""
+    import pandas as pd
+    import statement_formats
+    from finance_engine import ExpenseEngine
+
+    engine = ExpenseEngine()
+    samples = ["$1,234.56", "(45.00)", "-$7.25", "12.30-", "", "0.5", "$ 99", "1,000,000.00", "n/a"]
+    cells = pd.Series(samples * (args.cells // len(samples) + 1)).iloc[:args.cells].reset_index(drop=True)
+
+    print(f"{len(cells)} cells:")
+    old = _timed("scalar clean_currency", lambda: cells.map(engine.clean_currency), args.repeat)
+    new = _timed("normalize_currency", lambda: statement_formats.normalize_currency(cells)[0], args.repeat)
+    print(f"  speedup: {old / new:.1f}x")
+
+
+BENCHMARKS = {
+    "currency": bench_currency,
+    "parsers": bench_parsers,
+    "read-path": bench_read_path,
+    "startup": bench_startup,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backend benchmarks")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--cells", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == "__main__":
+    main()
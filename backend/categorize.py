@@ -0,0 +1,204 @@
+"""
+Rule-based category / payee labelling of imported ledger rows.
+
+Each category_rules row says which category, payee and payee_note a description gets:
+  keyword  - the words appear in the description (case-insensitive)
+  regex    - the pattern matches somewhere in the description
+  learned  - the description equals one labelled by hand before, once digits are
+             masked; learn_rules() rebuilds these from the existing ledgers
+A rule may be limited to an amount range. Rules are tried by priority, then id.
+
+compile_rules() folds every rule into one regular expression, so labelling a row
+is one match however many rules there are: each alternative is a lookahead over
+"<description>\\n<masked description>" and alternatives are tried in priority
+order, so the first one that matches is the highest-priority matching rule.
+"""
+import re
+
+RULE_KINDS = ("keyword", "regex", "learned")
+LABEL_FIELDS = ("category", "payee", "payee_note")
+
+# Ledgers whose imported rows are labelled (invoice lines have no category)
+LABELLED_TABLES = ("transactions", "credit_card_records")
+
+# Learned rules rank below hand-written ones; a description is learned once it has been
+# labelled the same way LEARN_MIN_ROWS times and in LEARN_MIN_SHARE of its rows
+LEARNED_PRIORITY = 1000
+LEARN_MIN_ROWS = 2
+LEARN_MIN_SHARE = 0.8
+
+# SQL twin of mask()
+MASKED_DESCRIPTION = r"regexp_replace(upper(btrim(regexp_replace(COALESCE(description, ''), '\s+', ' ', 'g'))), '\d+', '#', 'g')"
+
+
+def create_rules_table(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS category_rules (
+            id SERIAL PRIMARY KEY,
+            kind TEXT NOT NULL DEFAULT 'keyword',
+            pattern TEXT NOT NULL,
+            category TEXT DEFAULT '',
+            payee TEXT DEFAULT '',
+            payee_note TEXT DEFAULT '',
+            min_amount NUMERIC(12,2),
+            max_amount NUMERIC(12,2),
+            priority INTEGER DEFAULT 100,
+            created_at TIMESTAMPTZ DEFAULT NOW()
+        )
+    ''')
+
+
+def normalize(description):
+    if not isinstance(description, str):
+        return ""
+    return " ".join(description.split()).upper()
+
+
+def mask(description):
+    """Digits masked, so 'POS 0314 COSTCO #123' and 'POS 0402 COSTCO #123' are the same description."""
+    return re.sub(r'\d+', '#', normalize(description))
+
+
+def _alternative(rule):
+    kind, pattern = rule["kind"], rule["pattern"]
+    if kind == "keyword":
+        return rf"[^\n]*?{re.escape(normalize(pattern))}"
+    if kind == "regex":
+        return rf"[^\n]*?(?:{pattern})"
+    return rf"[^\n]*\n{re.escape(mask(pattern))}$"
+
+
+def _uncombinable(pattern):
+    """
+    Why a regex rule cannot share the combined pattern, or None. Group names would clash
+    with other rules' (or compile_rules' own r<i> groups), and group numbers shift with the
+    rules before it, so named groups, backreferences and conditionals are not allowed;
+    plain (...) groups are.
+    """
+    i = 0
+    while i < len(pattern):
+        if pattern[i] == "\\":
+            if pattern[i + 1:i + 2].isdigit() and pattern[i + 1] != "0":
+                return "backreferences such as \\1 are not supported"
+            i += 2
+            continue
+        if pattern.startswith(("(?P<", "(?P=", "(?("), i):
+            return "named groups and conditionals are not supported; use (?:...)"
+        i += 1
+    return None
+
+
+def validate_rule(rule):
+    """Raises ValueError for a rule that could not be compiled or would never label anything."""
+    if rule.get("kind") not in RULE_KINDS:
+        raise ValueError(f"kind must be one of: {', '.join(RULE_KINDS)}")
+    if not (rule.get("pattern") or "").strip():
+        raise ValueError("pattern is required")
+    if not any(rule.get(field) for field in LABEL_FIELDS):
+        raise ValueError("A rule needs a category, payee or payee_note to assign")
+    low, high = rule.get("min_amount"), rule.get("max_amount")
+    if low is not None and high is not None and low > high:
+        raise ValueError("min_amount is greater than max_amount")
+    try:
+        re.compile(_alternative(rule), re.I | re.M)
+    except re.error as e:
+        raise ValueError(f"Invalid pattern: {e}")
+    problem = _uncombinable(rule["pattern"]) if rule["kind"] == "regex" else None
+    if problem:
+        raise ValueError(f"Invalid pattern: {problem}")
+
+
+def _in_range(rule, amount):
+    low, high = rule.get("min_amount"), rule.get("max_amount")
+    if low not in (None, "") and amount < float(low):
+        return False
+    if high not in (None, "") and amount > float(high):
+        return False
+    return True
+
+
+def compile_rules(rules):
+    """rules (dicts, in priority order) -> label(description, amount): the first rule that applies, or None."""
+    rules = [r for r in rules if r["kind"] in RULE_KINDS]
+    # Rules stored before validate_rule checked for this would break every other rule
+    for r in [r for r in rules if r["kind"] == "regex" and _uncombinable(r["pattern"])]:
+        print(f"Skipping category rule {r.get('id')}: {_uncombinable(r['pattern'])}")
+        rules.remove(r)
+    if not rules:
+        return lambda description, amount: None
+    combined = re.compile("|".join(f"(?={_alternative(r)})(?P<r{i}>)" for i, r in enumerate(rules)), re.I | re.M)
+    singles = [re.compile(_alternative(r), re.I | re.M) for r in rules]
+
+    def label(description, amount):
+        text = f"{normalize(description)}\n{mask(description)}"
+        found = combined.match(text)
+        if found is None:
+            return None
+        # The combined match found the first rule whose pattern matches; only an amount range
+        # that rules it out sends us on to the rules after it
+        first = int(found.lastgroup[1:])
+        for rule, pattern in zip(rules[first:], singles[first:]):
+            if _in_range(rule, amount) and pattern.match(text):
+                return rule
+        return None
+
+    return label
+
+
+def row_amount(income, expense):
+    """The amount a rule's range is checked against: the expense, or the income for deposits."""
+    expense = abs(float(expense or 0))
+    return expense if expense else abs(float(income or 0))
+
+
+def label_rows(label, rows):
+    """Fill category / payee / payee_note of import rows (desc, income, expense, ...) from the rules."""
+    matched = [label(d, row_amount(i, e)) for d, i, e in zip(rows["desc"], rows["income"], rows["expense"])]
+    for field in LABEL_FIELDS:
+        rows[field] = [(rule or {}).get(field) or "" for rule in matched]
+    return rows
+
+
+def patches(label, rows, overwrite=False):
+    """
+    (id, description, income, expense, category, payee, payee_note) rows -> patches for
+    ExpenseEngine._patch_rows. Only blank cells are filled unless `overwrite`.
+    """
+    result = []
+    for row_id, description, income, expense, *current in rows:
+        rule = label(description, row_amount(income, expense))
+        if rule is None:
+            continue
+        patch = {field: rule[field] for field, value in zip(LABEL_FIELDS, current)
+                 if rule[field] and rule[field] != value and (overwrite or not value)}
+        if patch:
+            result.append(dict(patch, id=row_id))
+    return result
+
+
+def learn_rules(cursor):
+    """Replace the learned rules from the labels already on the ledgers; returns how many were learned."""
+    labelled = " UNION ALL ".join(f'''
+        SELECT {MASKED_DESCRIPTION} AS masked, COALESCE(category, '') AS category,
+               COALESCE(payee, '') AS payee, COALESCE(payee_note, '') AS payee_note
+        FROM {table}
+        WHERE COALESCE(account_source, '') NOT IN ('Manual', 'System')
+          AND (COALESCE(category, '') <> '' OR COALESCE(payee, '') <> '')
+    ''' for table in LABELLED_TABLES)
+    cursor.execute("DELETE FROM category_rules WHERE kind = 'learned'")
+    cursor.execute(f'''
+        WITH labelled AS ({labelled}),
+        counts AS (
+            SELECT masked, category, payee, payee_note, COUNT(*) AS n,
+                   SUM(COUNT(*)) OVER (PARTITION BY masked) AS total,
+                   ROW_NUMBER() OVER (PARTITION BY masked ORDER BY COUNT(*) DESC, category, payee, payee_note) AS rank
+            FROM labelled
+            WHERE masked <> ''
+            GROUP BY masked, category, payee, payee_note
+        )
+        INSERT INTO category_rules (kind, pattern, category, payee, payee_note, priority)
+        SELECT 'learned', masked, category, payee, payee_note, %s
+        FROM counts
+        WHERE rank = 1 AND n >= %s AND n >= %s * total
+    ''', (LEARNED_PRIORITY, LEARN_MIN_ROWS, LEARN_MIN_SHARE))
+    return cursor.rowcount
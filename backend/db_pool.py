@@ -0,0 +1,237 @@
+import atexit
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+class ConnectionPool:
+    """
+    Thread-safe psycopg2 connection pool.
+
+    Idle connections are handed out LIFO so the warmest one is reused first.
+    A connection that sat idle longer than `health_check_after` seconds is
+    pinged with `SELECT 1` before being handed out, and one idle longer than
+    `max_idle` seconds is closed instead (recycled) as long as `min_size`
+    connections remain.
+
+    Nothing connects at construction. The first checkout starts a daemon thread
+    that every `maintenance_interval` seconds prunes stale idle connections and
+    opens new ones up to `min_size`.
+    """
+
+    def __init__(self, dsn, min_size=1, max_size=5, max_idle=300.0,
+                 health_check_after=30.0, timeout=10.0, maintenance_interval=60.0, **connect_kwargs):
+        self.dsn = dsn
+        self.min_size = max(0, min_size)
+        self.max_size = max(1, max_size, self.min_size)
+        self.max_idle = max_idle
+        self.health_check_after = health_check_after
+        self.timeout = timeout
+        self.maintenance_interval = maintenance_interval
+        self.connect_kwargs = connect_kwargs
+
+        self._cond = threading.Condition()
+        self._idle = deque()  # (conn, last_used)
+        self._size = 0
+        self._maintenance = None
+        self._closed = threading.Event()
+
+    def _connect(self):
+        return psycopg2.connect(self.dsn, **self.connect_kwargs)
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, conn):
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def getconn(self):
+        self._start_maintenance()
+        deadline = time.monotonic() + self.timeout
+        while True:
+            conn = None
+            idle_for = 0.0
+            with self._cond:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(f"No connection available within {self.timeout}s")
+                    self._cond.wait(remaining)
+
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    idle_for = time.monotonic() - last_used
+                else:
+                    self._size += 1
+
+            if conn is None:
+                try:
+                    return self._connect()
+                except Exception:
+                    self._release_slot()
+                    raise
+
+            # Checks run outside the lock so a slow ping never blocks other callers
+            if conn.closed or (idle_for > self.max_idle and self._size > self.min_size):
+                self._discard(conn)
+                continue
+            if idle_for > self.health_check_after and not self._is_healthy(conn):
+                self._discard(conn)
+                continue
+            return conn
+
+    def putconn(self, conn, discard=False):
+        if not discard and not conn.closed:
+            status = conn.info.transaction_status
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                discard = True
+            elif status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except Exception:
+                    discard = True
+
+        if discard or conn.closed:
+            self._discard(conn)
+            return
+
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def _discard(self, conn):
+        self._close_quietly(conn)
+        self._release_slot()
+
+    def _release_slot(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self.putconn(conn, discard=broken)
+
+    def prune(self):
+        """Close connections idle past `max_idle`, keeping at least `min_size` open."""
+        now = time.monotonic()
+        stale = []
+        with self._cond:
+            keep = deque()
+            # Oldest connections sit at the left end of the deque
+            while self._idle:
+                conn, last_used = self._idle.popleft()
+                if now - last_used > self.max_idle and self._size - len(stale) > self.min_size:
+                    stale.append(conn)
+                else:
+                    keep.append((conn, last_used))
+            self._idle = keep
+        for conn in stale:
+            self._discard(conn)
+        return len(stale)
+
+    def fill(self):
+        """Open idle connections until the pool holds `min_size`; returns how many were opened."""
+        opened = 0
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return opened
+                self._size += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                self._release_slot()
+                return opened
+            with self._cond:
+                self._idle.appendleft((conn, time.monotonic()))
+                self._cond.notify()
+            opened += 1
+
+    def _start_maintenance(self):
+        if self._maintenance is not None or self.maintenance_interval <= 0:
+            return
+        with self._cond:
+            if self._maintenance is not None:
+                return
+            self._maintenance = threading.Thread(target=self._maintain, name="db-pool-maintenance", daemon=True)
+        self._maintenance.start()
+
+    def _maintain(self):
+        while not self._closed.wait(self.maintenance_interval):
+            try:
+                self.prune()
+                self.fill()
+            except Exception as e:
+                print(f"Connection pool maintenance error: {e}")
+
+    def closeall(self):
+        self._closed.set()
+        with self._cond:
+            idle, self._idle = list(self._idle), deque()
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self._cond:
+            return {"size": self._size, "idle": len(self._idle), "max_size": self.max_size}
+
+
+# Pools live at module level so a warm serverless container (Vercel keeps the
+# imported module between invocations) reuses its open connections.
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(dsn):
+    with _pools_lock:
+        pool = _pools.get(dsn)
+        if pool is None:
+            pool = ConnectionPool(
+                dsn,
+                min_size=_env_int("DB_POOL_MIN_SIZE", 1),
+                max_size=_env_int("DB_POOL_MAX_SIZE", 5),
+                max_idle=_env_int("DB_POOL_MAX_IDLE", 300),
+                health_check_after=_env_int("DB_POOL_HEALTH_CHECK_AFTER", 30),
+                timeout=_env_int("DB_POOL_TIMEOUT", 10),
+                keepalives=1,
+                keepalives_idle=30,
+                keepalives_interval=10,
+                keepalives_count=3,
+            )
+            _pools[dsn] = pool
+            atexit.register(pool.closeall)
+        return pool
@@ -1,50 +1,209 @@
-import pandas as pd
+# pandas is imported inside the CSV ingest methods only, so serverless cold starts skip it
 import psycopg2
+from psycopg2.extras import execute_values
 import io
+import functools
+import tempfile
+import json
+import base64
 import re
 import sys
 import os
 from datetime import datetime
 from dotenv import load_dotenv
 from typing import Any
-import warnings
-
-# Suppress pandas SQLAlchemy warning for raw psycopg2 connections
-warnings.filterwarnings('ignore', category=UserWarning, module='pandas')
+from contextlib import contextmanager
+from db_pool import get_pool
+import response_cache
+import rollups
+import statement_formats
+import categorize
+import reconcile
+import invoice_match
+import price_history
+import search
+import migrations
 
 load_dotenv()
 
+# Transactions as the UI reads them: System 'Cash Sales' rows get a fixed description and read
+# their cash_income from that day's sales record
+TRANSACTIONS_SOURCE = '''(
+    SELECT t.id, t.date, t.type, t.category, t.payee, t.payee_note, t.cash_amount,
+           CASE WHEN t.type = 'Cash Sales' AND t.account_source = 'System'
+                THEN 'Daily Cash Income Record' ELSE t.description END AS description,
+           t.income, t.expense, t.net_amount, t.bank_balance, t.account_source, t.is_duplicate_check,
+           CASE WHEN t.type = 'Cash Sales' AND t.account_source = 'System'
+                THEN COALESCE(s.cash, 0) + COALESCE(s.cash_tips, 0) ELSE 0 END AS cash_income,
+           COALESCE(t.cash_amount, 0) AS cash_expense
+    FROM transactions t
+    LEFT JOIN sales_records s ON s.date = t.date AND t.type = 'Cash Sales' AND t.account_source = 'System'
+) AS transactions'''
+
+# Listing endpoints: filter name -> column, the columns searched by `q`, and for derived
+# sources the tables the rows are read from (for cache invalidation)
+LIST_TABLES = {
+    "transactions": {
+        "source": TRANSACTIONS_SOURCE,
+        "depends": ("transactions", "sales_records"),
+        "filters": {"category": "category", "payee": "payee", "source": "account_source"},
+        "search": ["description", "payee", "payee_note"],
+    },
+    "credit_card_records": {
+        "filters": {"category": "category", "payee": "payee", "source": "account_source"},
+        "search": ["description", "payee", "payee_note"],
+    },
+    "invoice_items": {
+        "filters": {"payee": "vendor"},
+        "search": ["product_name", "product_code"],
+    },
+    "cash_records": {
+        "filters": {"category": "category", "payee": "payee"},
+        "search": ["description", "payee"],
+    },
+    "sales_records": {
+        "filters": {},
+        "search": ["memo"],
+    },
+}
+
+MAX_PAGE_SIZE = 1000
+
+# Full-table reads behind the legacy (unpaginated) list endpoints
+READ_QUERIES = {
+    "categories": "SELECT * FROM categories ORDER BY name ASC",
+    "payees": "SELECT * FROM payees ORDER BY name ASC",
+    "sales_records": "SELECT * FROM sales_records ORDER BY date DESC",
+    "transactions": f"SELECT * FROM {TRANSACTIONS_SOURCE} ORDER BY date DESC, id DESC",
+    "invoice_items": "SELECT * FROM invoice_items ORDER BY date DESC, id DESC",
+    "credit_card_records": "SELECT * FROM credit_card_records ORDER BY date DESC, id DESC",
+    "cash_records": "SELECT * FROM cash_records ORDER BY date DESC, id DESC",
+    "category_rules": "SELECT * FROM category_rules ORDER BY priority, id",
+    "card_payment_matches": reconcile.MATCHES_QUERY,
+    "unmatched_card_payments": reconcile.UNMATCHED_PAYMENTS_QUERY,
+    "invoice_ledger_matches": invoice_match.MATCHES_QUERY,
+    "unmatched_invoices": invoice_match.UNMATCHED_INVOICES_QUERY,
+    "unmatched_vendor_debits": invoice_match.UNMATCHED_DEBITS_QUERY,
+    "search_documents": search.DOCUMENTS_QUERY,
+}
+
+# Reads answered with several READ_QUERIES at once: response key -> query name
+READ_GROUPS = {
+    "card_reconciliation": {"matches": "card_payment_matches", "unmatched_payments": "unmatched_card_payments"},
+    "unmatched_invoices": {"invoices": "unmatched_invoices", "payments": "unmatched_vendor_debits"},
+}
+
+# Import job status as polled by the UI
+IMPORT_JOB_QUERY = '''
+    SELECT id, filename, target_tab, status, rows_processed, inserted, skipped, message, error,
+           attempts, created_at, started_at, finished_at
+    FROM import_jobs WHERE id = %s
+'''
+
+# A running job that reported no progress for this many seconds is assumed orphaned (its worker
+# died, or its serverless instance was frozen after responding) and handed out again
+IMPORT_JOB_STALE_AFTER = int(os.environ.get("IMPORT_JOB_STALE_AFTER", 120))
+IMPORT_JOB_MAX_ATTEMPTS = 3
+
+# Uploads wait in import_job_chunks, in blocks of this size, until a worker on any host imports them
+IMPORT_BLOCK_BYTES = 1024 * 1024
+# CSVs are parsed this many rows at a time
+CSV_CHUNK_ROWS = int(os.environ.get("CSV_CHUNK_ROWS", 50000))
+
+# Rows of an import chunk whose row_hash the table does not have yet (an anti-join on its unique index)
+NEW_ROW_HASHES_QUERY = '''
+    SELECT h AS row_hash FROM unnest(%s::bigint[]) AS h
+    WHERE NOT EXISTS (SELECT 1 FROM {table} WHERE row_hash = h)
+'''
+PREVIEW_ROWS = 50
+
+# The dashboard reads the rollup tables, which every write to the tables they sum refreshes
+DASHBOARD_TABLES = ("transactions", "credit_card_records", "sales_records", "cash_records",
+                    "card_payment_matches", "monthly_totals", "monthly_expense_breakdown")
+
+# Columns a PATCH may change, with the SQL type used to cast the incoming values
+EDITABLE_COLUMNS = {
+    "transactions": {
+        "date": "date", "category": "text", "payee": "text", "payee_note": "text",
+        "cash_amount": "numeric", "income": "numeric", "expense": "numeric", "description": "text",
+    },
+    "credit_card_records": {
+        "category": "text", "payee": "text", "payee_note": "text", "cash_amount": "numeric",
+    },
+    "cash_records": {
+        "date": "date", "category": "text", "payee": "text",
+        "income": "numeric", "expense": "numeric", "balance": "numeric", "description": "text",
+    },
+    # Keyed by date, not id; total is always recomputed
+    "sales_records": {
+        "cash": "numeric", "debit": "numeric", "credit": "numeric", "svc": "numeric", "tips": "numeric",
+        "tax": "numeric", "cash_tips": "numeric", "doordash": "numeric", "stripe": "numeric", "memo": "text",
+    },
+}
+
+# Columns that feed the dashboard rollups, per table
+ROLLUP_COLUMNS = {
+    "transactions": {"date", "category", "payee", "cash_amount", "income", "expense"},
+    "cash_records": {"date", "category", "payee", "income", "expense"},
+    "credit_card_records": {"date", "category", "payee", "expense"},
+}
+
+# Table names accepted by the bulk edit API
+EDIT_TABLES = {
+    "transactions": "transactions",
+    "credit_cards": "credit_card_records",
+    "cash": "cash_records",
+    "sales": "sales_records",
+}
+
 class ExpenseEngine:
-    def __init__(self):
+    def __init__(self, bootstrap_schema=None):
         self.db_url = os.environ.get("DATABASE_URL")
         # Ensure correct prefix for SQLAlchemy/psycopg2
         if self.db_url and self.db_url.startswith("postgres://"):
             self.db_url = self.db_url.replace("postgres://", "postgresql://", 1)
-            
-        self.create_tables()
 
-    def get_conn(self):
-        return psycopg2.connect(self.db_url)
+        # No DB round trips at construction unless asked: the schema is bootstrapped once with
+        # `python backend/manage.py migrate` (or SCHEMA_BOOTSTRAP_ON_START=1 for local runs).
+        self.pool = get_pool(self.db_url)
+        self.cache = response_cache.from_env()
+        # SEARCH_INDEX=postgres|memory forces the search backend; unset, pg_trgm is used when installed
+        self._search_trgm = {"postgres": True, "memory": False}.get(os.environ.get("SEARCH_INDEX"))
+        self._search_index = (None, None)  # (documents cache entry, search.TrigramIndex over it)
+        if bootstrap_schema is None:
+            bootstrap_schema = os.environ.get("SCHEMA_BOOTSTRAP_ON_START", "0") == "1"
+        if bootstrap_schema:
+            self.create_tables()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a pooled connection; it goes back to the pool when the block exits."""
+        with self.pool.connection() as conn:
+            yield conn
 
     def create_tables(self):
-        conn = self.get_conn()
-        cursor = conn.cursor()
-        
+        """Create missing tables, seed options and apply pending migrations; returns the migration versions applied."""
+        with self.connection() as conn, conn.cursor() as cursor:
+            applied = self._create_tables(conn, cursor)
+        self.cache.clear()
+        return applied
+
+    def _create_tables(self, conn, cursor):
         # 1. Transactions Table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS transactions (
                 id SERIAL PRIMARY KEY,
-                date TEXT,
+                date DATE,
                 type TEXT,
                 category TEXT,
                 payee TEXT,
                 payee_note TEXT, 
-                cash_amount REAL,
+                cash_amount NUMERIC(12,2),
                 description TEXT,
-                income REAL,
-                expense REAL,
-                net_amount REAL,
-                bank_balance REAL,
+                income NUMERIC(12,2),
+                expense NUMERIC(12,2),
+                net_amount NUMERIC(12,2),
+                bank_balance NUMERIC(12,2),
                 account_source TEXT,
                 is_duplicate_check TEXT UNIQUE
             )
@@ -54,14 +213,14 @@ class ExpenseEngine:
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS invoice_items (
                 id SERIAL PRIMARY KEY,
-                date TEXT,
+                date DATE,
                 vendor TEXT,
                 product_code TEXT,
                 product_name TEXT,
-                quantity REAL,
+                quantity NUMERIC(12,3),
                 unit TEXT,
-                unit_price REAL,
-                total_price REAL,
+                unit_price NUMERIC(12,4),
+                total_price NUMERIC(12,2),
                 is_duplicate_check TEXT UNIQUE
             )
         ''')
@@ -70,17 +229,17 @@ class ExpenseEngine:
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS sales_records (
             id SERIAL PRIMARY KEY,
-            date TEXT UNIQUE,
-            cash REAL DEFAULT 0,
-            debit REAL DEFAULT 0,
-            credit REAL DEFAULT 0,
-            svc REAL DEFAULT 0,
-            tips REAL DEFAULT 0,
-            tax REAL DEFAULT 0,
-            cash_tips REAL DEFAULT 0,
-            doordash REAL DEFAULT 0,
-            stripe REAL DEFAULT 0,
-            total REAL DEFAULT 0,
+            date DATE UNIQUE,
+            cash NUMERIC(12,2) DEFAULT 0,
+            debit NUMERIC(12,2) DEFAULT 0,
+            credit NUMERIC(12,2) DEFAULT 0,
+            svc NUMERIC(12,2) DEFAULT 0,
+            tips NUMERIC(12,2) DEFAULT 0,
+            tax NUMERIC(12,2) DEFAULT 0,
+            cash_tips NUMERIC(12,2) DEFAULT 0,
+            doordash NUMERIC(12,2) DEFAULT 0,
+            stripe NUMERIC(12,2) DEFAULT 0,
+            total NUMERIC(12,2) DEFAULT 0,
             memo TEXT
         )
     ''')
@@ -89,17 +248,17 @@ class ExpenseEngine:
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS credit_card_records (
                 id SERIAL PRIMARY KEY,
-                date TEXT,
+                date DATE,
                 type TEXT,
                 category TEXT,
                 payee TEXT,
                 payee_note TEXT, 
-                cash_amount REAL,
+                cash_amount NUMERIC(12,2),
                 description TEXT,
-                income REAL,
-                expense REAL,
-                net_amount REAL,
-                bank_balance REAL,
+                income NUMERIC(12,2),
+                expense NUMERIC(12,2),
+                net_amount NUMERIC(12,2),
+                bank_balance NUMERIC(12,2),
                 account_source TEXT,
                 is_duplicate_check TEXT UNIQUE
             )
@@ -109,12 +268,12 @@ class ExpenseEngine:
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS cash_records (
                 id SERIAL PRIMARY KEY,
-                date TEXT,
+                date DATE,
                 category TEXT,
                 payee TEXT,
-                income REAL DEFAULT 0,
-                expense REAL DEFAULT 0,
-                balance REAL DEFAULT 0,
+                income NUMERIC(12,2) DEFAULT 0,
+                expense NUMERIC(12,2) DEFAULT 0,
+                balance NUMERIC(12,2) DEFAULT 0,
                 description TEXT
             )
         ''')
@@ -133,6 +292,9 @@ class ExpenseEngine:
                 name TEXT UNIQUE NOT NULL
             )
         ''')
+
+        # 8. Bank card payments matched to card statement credits (reconcile.py)
+        reconcile.create_matches_table(cursor)
         conn.commit()
         
         # --- Seed Initial Data if empty ---
@@ -158,149 +320,231 @@ class ExpenseEngine:
             ]
             for payee in initial_payees:
                 cursor.execute("INSERT INTO payees (name) VALUES (%s) ON CONFLICT DO NOTHING", (payee,))
-                
+
+        # DATE/NUMERIC conversion of legacy tables and ledger indexes
+        applied = migrations.migrate(cursor)
+
+        # 9. Monthly rollups for the dashboard (first boot on an existing DB backfills them)
+        rollups.create_rollup_tables(cursor)
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM monthly_totals)")
+        if not cursor.fetchone()[0]:
+            rollups.rebuild(cursor)
+
         conn.commit()
-        cursor.close()
-        conn.close()
+        return applied
 
-    # --- Dynamic Options (Categories & Payees) ---
-    def get_categories(self):
-        try:
-            conn = self.get_conn()
-            df = pd.read_sql("SELECT * FROM categories ORDER BY name ASC", conn)
-            conn.close()
-            return df.to_dict(orient='records')
-        except Exception as e:
-            print(f"Error fetching categories: {e}")
-            return []
+    # --- Row fetching (plain cursors, no DataFrame on the read path) ---
+    def _rows_to_dicts(self, cursor, rows):
+        """Column-name dicts with NULL -> "" (what the UI has always received)."""
+        columns = [d[0] for d in cursor.description]
+        return [dict(zip(columns, ["" if v is None else v for v in row])) for row in rows]
 
+    def _fetch_rows(self, sql, params=None):
+        with self.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(sql, params)
+            return self._rows_to_dicts(cursor, cursor.fetchall())
+
+    # --- Dynamic Options (Categories & Payees) ---
     def add_category(self, name):
-        conn = self.get_conn()
-        cursor = conn.cursor()
-        try:
-            cursor.execute("INSERT INTO categories (name) VALUES (%s) ON CONFLICT DO NOTHING RETURNING id", (name,))
-            added = cursor.fetchone()
-            conn.commit()
-            return {"status": "success", "id": added[0] if added else None}
-        except Exception as e:
-            conn.rollback()
-            return {"status": "error", "message": str(e)}
-        finally:
-            cursor.close()
-            conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("INSERT INTO categories (name) VALUES (%s) ON CONFLICT DO NOTHING RETURNING id", (name,))
+                added = cursor.fetchone()
+                conn.commit()
+                self.cache.invalidate("categories")
+                return {"status": "success", "id": added[0] if added else None}
+            except Exception as e:
+                conn.rollback()
+                return {"status": "error", "message": str(e)}
+            finally:
+                cursor.close()
 
     def delete_category(self, category_id):
-        conn = self.get_conn()
-        cursor = conn.cursor()
-        try:
-            cursor.execute("DELETE FROM categories WHERE id = %s", (category_id,))
-            conn.commit()
-            return True
-        except Exception as e:
-            print(f"Error deleting category: {e}")
-            return False
-        finally:
-            cursor.close()
-            conn.close()
-
-    def get_payees(self):
-        try:
-            conn = self.get_conn()
-            df = pd.read_sql("SELECT * FROM payees ORDER BY name ASC", conn)
-            conn.close()
-            return df.to_dict(orient='records')
-        except Exception as e:
-            print(f"Error fetching payees: {e}")
-            return []
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("DELETE FROM categories WHERE id = %s", (category_id,))
+                conn.commit()
+                self.cache.invalidate("categories")
+                return True
+            except Exception as e:
+                print(f"Error deleting category: {e}")
+                return False
+            finally:
+                cursor.close()
 
     def add_payee(self, name):
-        conn = self.get_conn()
-        cursor = conn.cursor()
-        try:
-            cursor.execute("INSERT INTO payees (name) VALUES (%s) ON CONFLICT DO NOTHING RETURNING id", (name,))
-            added = cursor.fetchone()
-            conn.commit()
-            return {"status": "success", "id": added[0] if added else None}
-        except Exception as e:
-            conn.rollback()
-            return {"status": "error", "message": str(e)}
-        finally:
-            cursor.close()
-            conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("INSERT INTO payees (name) VALUES (%s) ON CONFLICT DO NOTHING RETURNING id", (name,))
+                added = cursor.fetchone()
+                conn.commit()
+                self.cache.invalidate("payees")
+                return {"status": "success", "id": added[0] if added else None}
+            except Exception as e:
+                conn.rollback()
+                return {"status": "error", "message": str(e)}
+            finally:
+                cursor.close()
 
     def delete_payee(self, payee_id):
-        conn = self.get_conn()
-        cursor = conn.cursor()
-        try:
-            cursor.execute("DELETE FROM payees WHERE id = %s", (payee_id,))
-            conn.commit()
-            return True
-        except Exception as e:
-            print(f"Error deleting payee: {e}")
-            return False
-        finally:
-            cursor.close()
-            conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("DELETE FROM payees WHERE id = %s", (payee_id,))
+                conn.commit()
+                self.cache.invalidate("payees")
+                return True
+            except Exception as e:
+                print(f"Error deleting payee: {e}")
+                return False
+            finally:
+                cursor.close()
 
 
-    # --- Sales Record Logic (신규 추가) ---
-    def get_sales_records(self):
-        """저장된 매출 기록을 날짜 역순으로 가져옵니다."""
-        try:
-            conn = self.get_conn()
-            df = pd.read_sql("SELECT * FROM sales_records ORDER BY date DESC", conn)
-            conn.close()
-            df = df.fillna("")
-            return df.to_dict(orient='records')
-        except Exception as e:
-            print(f"Sales DB Error: {e}")
-            return []
+    # --- Categorization Rules ---
+    def add_category_rule(self, rule: dict):
+        """Raises ValueError for an invalid rule; returns the stored rule."""
+        categorize.validate_rule(rule)
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute('''
+                    INSERT INTO category_rules (kind, pattern, category, payee, payee_note, min_amount, max_amount, priority)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                    RETURNING *
+                ''', (
+                    rule['kind'], rule['pattern'], rule.get('category') or '', rule.get('payee') or '',
+                    rule.get('payee_note') or '', rule.get('min_amount'), rule.get('max_amount'),
+                    rule.get('priority', 100),
+                ))
+                added = self._rows_to_dicts(cursor, cursor.fetchall())[0]
+                conn.commit()
+                self.cache.invalidate("category_rules")
+                return added
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+
+    def delete_category_rule(self, rule_id):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("DELETE FROM category_rules WHERE id = %s", (rule_id,))
+                conn.commit()
+                self.cache.invalidate("category_rules")
+                return True
+            except Exception as e:
+                print(f"Error deleting category rule: {e}")
+                return False
+            finally:
+                cursor.close()
+
+    def learn_category_rules(self):
+        """Rebuild the learned rules from the labels already on the ledgers; returns how many there are."""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                learned = categorize.learn_rules(cursor)
+                conn.commit()
+                self.cache.invalidate("category_rules")
+                return learned
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+
+    def _rule_labeller(self):
+        # Read fresh rather than from the cache: imports run in workers that may not see its invalidations
+        return categorize.compile_rules(self._fetch_rows(READ_QUERIES["category_rules"]))
+
+    def apply_category_rules(self, overwrite=False):
+        """
+        Re-run the rules over the imported rows of the ledgers in one transaction. Only blank
+        category / payee / payee_note cells are filled unless `overwrite`. Returns rows updated per table.
+        """
+        label = self._rule_labeller()
+        blank_only = "" if overwrite else """
+            AND (COALESCE(category, '') = '' OR COALESCE(payee, '') = '' OR COALESCE(payee_note, '') = '')
+        """
+        result, touched = {}, []
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                for table in categorize.LABELLED_TABLES:
+                    cursor.execute(f'''
+                        SELECT id, description, income, expense, category, payee, payee_note FROM {table}
+                        WHERE COALESCE(account_source, '') NOT IN ('Manual', 'System') {blank_only}
+                    ''')
+                    patches = categorize.patches(label, cursor.fetchall(), overwrite)
+                    for start in range(0, len(patches), 5000):
+                        _, dates = self._patch_rows(cursor, table, patches[start:start + 5000])
+                        touched += dates
+                    result[table] = len(patches)
+                rollups.refresh_months(cursor, touched)
+                # Rows that just became card payments can now be matched
+                reconcile.reconcile(cursor)
+                conn.commit()
+                self.cache.invalidate(*categorize.LABELLED_TABLES, "card_payment_matches")
+                return result
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
 
+    # --- Sales Record Logic (신규 추가) ---
     def update_sales_record(self, date, field, value):
         """특정 날짜의 매출 데이터를 업데이트하고 Total을 자동 계산합니다."""
-        conn = self.get_conn()
-        cursor = conn.cursor()
-        try:
-            # 먼저 해당 날짜 데이터가 있는지 확인하고 없으면 생성(UPSERT)
-            cursor.execute(f'''
-                INSERT INTO sales_records (date, {field}) 
-                VALUES (%s, %s) 
-                ON CONFLICT(date) DO UPDATE SET {field} = EXCLUDED.{field}
-            ''', (date, value))    
-            
-            # 해당 날짜의 전체 합계(Total)를 다시 계산하여 업데이트
-            cursor.execute('''
-            UPDATE sales_records SET total = 
-                COALESCE(cash, 0) + COALESCE(debit, 0) + COALESCE(credit, 0) + 
-                COALESCE(cash_tips, 0) + COALESCE(doordash, 0) + COALESCE(stripe, 0)
-            WHERE date = %s
-        ''', (date,))
-            
-            conn.commit()
-            return True
-        except Exception as e:
-            print(f"Update Sales Error: {e}")
-            return False
-        finally:
-            cursor.close()
-            conn.close()
-            
-    # [신규] 삭제 기능 추가
-    def delete_sales_record(self, date):
-            conn = self.get_conn()
+        with self.connection() as conn:
             cursor = conn.cursor()
             try:
-                cursor.execute("DELETE FROM sales_records WHERE date = %s", (date,))
+                _, touched = self._edit_sales(cursor, {date: {field: value}})
+                rollups.refresh_months(cursor, touched)
                 conn.commit()
+                self.cache.invalidate("sales_records", "transactions")
                 return True
+            except ValueError:
+                conn.rollback()
+                raise
             except Exception as e:
-                print(f"Delete Error: {e}")
+                conn.rollback()
+                print(f"Update Sales Error: {e}")
                 return False
             finally:
                 cursor.close()
-                conn.close()
+            
+    # [신규] 삭제 기능 추가
+    def delete_sales_record(self, date):
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    cursor.execute("DELETE FROM sales_records WHERE date = %s RETURNING date", (date,))
+                    deleted = [r[0] for r in cursor.fetchall()]
+                    # The day's System 'Cash Sales' row goes too, unless someone has filled it in
+                    cursor.execute('''
+                        DELETE FROM transactions
+                        WHERE date = ANY(%s::date[]) AND type = 'Cash Sales' AND account_source = 'System'
+                          AND COALESCE(category, '') = '' AND COALESCE(payee, '') = ''
+                          AND COALESCE(payee_note, '') = '' AND COALESCE(cash_amount, 0) = 0
+                    ''', (deleted,))
+                    rollups.refresh_months(cursor, deleted)
+                    conn.commit()
+                    self.cache.invalidate("sales_records", "transactions")
+                    return True
+                except Exception as e:
+                    print(f"Delete Error: {e}")
+                    return False
+                finally:
+                    cursor.close()
     # --- 기존 코드 유지 ---
     def clean_currency(self, value):
+        import pandas as pd
         if pd.isna(value) or str(value).strip() == '': return 0.0
         str_val = str(value).replace('$', '').replace(',', '').replace(' ', '')
         if '(' in str_val:
@@ -310,315 +554,866 @@ class ExpenseEngine:
         except:
             return 0.0
 
-    def process_csv(self, file_content: bytes, filename: str, target_tab: str | None = None):
+    def process_csv(self, source, filename: str, target_tab: str | None = None, on_progress=None, dry_run=False):
+        """
+        Import a bank / card / invoice CSV. `source` is the upload's bytes, a binary file object
+        or a file path. The format is sniffed from the header (statement_formats.FORMATS), then the file is parsed
+        CSV_CHUNK_ROWS rows at a time and each chunk is written in one bulk INSERT, so memory stays
+        bounded. on_progress(inserted, skipped) runs after every chunk. A failure mid-file keeps
+        the chunks already written; re-importing the file skips them as duplicates.
+        With dry_run nothing is written: the result counts the new and already imported rows
+        and lists the first PREVIEW_ROWS new ones.
+        """
+        import pandas as pd
         try:
-            decoded_content = file_content.decode('utf-8', errors='ignore')
-            df = pd.read_csv(io.StringIO(decoded_content))
-            df.columns = [c.strip() for c in df.columns]
-            cols = df.columns.tolist()
-
-            if "ProductDescription" in cols and "ExtendedPrice" in cols:
-                if target_tab and target_tab != 'invoice':
-                    return {"status": "error", "message": "Please upload this US Foods invoice on the Expense Detail tab."}
-                return self._parse_usfoods(df, filename)
-            elif "Posted Date" in cols and "Full description" in cols:
-                if target_tab and target_tab != 'ledger':
-                    return {"status": "error", "message": "Please upload this Bank CSV on the Financial Ledger tab."}
-                self._parse_truist(df)
-                return {"status": "success", "message": "Truist Bank Processed to Financial Ledger"}
-            elif "Card" in cols or ("Transaction Date" in cols and "Post Date" in cols):
-                if target_tab and target_tab != 'credit_card':
-                    return {"status": "error", "message": "Please upload this Credit Card CSV on the Credit Card tab."}
-                self._parse_chase(df)
-                return {"status": "success", "message": "Chase Card Processed to Credit Card Ledger"}
-            elif "Status" in cols and "Debit" in cols and "Credit" in cols:
-                if target_tab and target_tab != 'credit_card':
-                    return {"status": "error", "message": "Please upload this Credit Card CSV on the Credit Card tab."}
-                self._parse_citi(df)
-                return {"status": "success", "message": "Citi Card Processed to Credit Card Ledger"}
+            with self._open_csv(source) as text:
+                cols = [c.strip() for c in pd.read_csv(text, nrows=0).columns]
+                text.seek(0)
+
+                fmt = statement_formats.detect(cols)
+                if fmt is None:
+                    return {"status": "error", "message": f"Unknown format: {filename}"}
+                if target_tab and target_tab != fmt['tab']:
+                    return {"status": "error", "message": fmt['tab_error']}
+                transform = statement_formats.compile_format(fmt, filename)
+                label = self._rule_labeller() if fmt['table'] in categorize.LABELLED_TABLES else None
+
+                inserted = skipped = 0
+                unreadable, preview = [], []
+                for chunk in pd.read_csv(text, chunksize=CSV_CHUNK_ROWS, dtype=fmt.get('dtype')):
+                    chunk.columns = [c.strip() for c in chunk.columns]
+                    rows, problems = transform(chunk)
+                    unreadable += problems
+                    if label:
+                        rows = categorize.label_rows(label, rows)
+                    if dry_run:
+                        new = self._new_rows(rows, fmt['table'])
+                        preview += self._preview_rows(new.head(PREVIEW_ROWS - len(preview)))
+                        chunk_inserted, chunk_skipped = len(new), len(rows) - len(new)
+                    else:
+                        chunk_inserted, chunk_skipped = self._save_statement_rows(rows, fmt['table'])
+                    inserted += chunk_inserted
+                    skipped += chunk_skipped
+                    if on_progress:
+                        on_progress(inserted, skipped)
+
+            if inserted and not dry_run:
+                self._match_imported(fmt['table'])
+
+            if dry_run:
+                message = f"{inserted} new rows, {skipped} already imported"
             else:
-                return {"status": "error", "message": f"Unknown format: {filename}"}
+                message = fmt['message'].format(inserted=inserted, skipped=skipped)
+            if unreadable:
+                # Rows whose amounts could not be read are not imported as 0; say which they were
+                examples = ", ".join(f"line {p['row']} {p['column']}={p['value']!r}" for p in unreadable[:5])
+                message += f"; {len(unreadable)} unreadable amount(s) not imported (e.g. {examples})"
+            if dry_run:
+                return {
+                    "status": "preview",
+                    "message": message,
+                    "format": fmt['name'],
+                    "new": inserted,
+                    "duplicates": skipped,
+                    "rows": preview,
+                    "unreadable": unreadable[:100],
+                }
+            return {
+                "status": "success",
+                "message": message,
+                "inserted": inserted,
+                "skipped": skipped,
+                "unreadable": unreadable[:100],
+            }
 
         except Exception as e:
             print(f"Error: {e}")
             return {"status": "error", "message": str(e)}
 
-    def _save_row(self, entry, table_name="transactions"):
-        conn = self.get_conn()
-        dup_key = f"{entry['date']}_{entry['desc']}_{entry['income']}_{entry['expense']}"
-        if entry.get('source') == 'System':
-            dup_key = f"system_cash_{entry['date']}_{datetime.now().timestamp()}"
-            
-        cursor = conn.cursor()
+    def _match_imported(self, table):
+        """Incremental matching after an import; a failure leaves the rows imported and the match endpoints retry it."""
+        matchers = [(reconcile.TABLES, self.reconcile_card_payments), (invoice_match.TABLES, self.match_invoices)]
+        for tables, run in matchers:
+            if table in tables:
+                try:
+                    run()
+                except Exception:
+                    pass  # Already printed
+
+    @contextmanager
+    def _open_csv(self, source):
+        """Text stream over bytes, a binary file object or a path; a caller's file object is left open."""
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            raw, owned = io.BytesIO(source), True
+        elif isinstance(source, str):
+            raw, owned = open(source, 'rb'), True
+        else:
+            raw, owned = source, False
+        text = io.TextIOWrapper(raw, encoding='utf-8', errors='ignore', newline='')
         try:
-            cursor.execute(f'''
-                INSERT INTO {table_name} (
-                    date, type, category, payee, payee_note, 
-                    cash_amount, description, income, expense, 
-                    net_amount, bank_balance, account_source, is_duplicate_check
-                )
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ''', (
-                entry['date'], 
-                entry['type'], 
-                "",      
-                "",      
-                "",      
-                0.0,     
-                entry['desc'],    
-                entry['income'], 
-                entry['expense'], 
-                entry['income'] - entry['expense'], 
-                entry['balance'], 
-                entry['source'],  
-                dup_key
-            ))
-            conn.commit()
-        except psycopg2.IntegrityError:
-            conn.rollback() 
+            yield text
         finally:
-            cursor.close()
-            conn.close()
+            text.detach()
+            if owned:
+                raw.close()
 
-    # --- Manual Financial Ledger Logic (신규) ---
-    def add_transaction(self, record: dict):
-        conn = self.get_conn()
-        cursor = conn.cursor()
+    # --- Background CSV Imports (jobs table as the queue) ---
+    def enqueue_import(self, source, filename: str, target_tab: str | None = None):
+        """
+        Record an upload as a queued import job; returns the job id. `source` (bytes or a binary
+        file object) is stored in import_job_chunks IMPORT_BLOCK_BYTES at a time, never held in
+        memory whole, so a worker on any instance or host can import it. The job and its blocks
+        commit together, so no worker sees a partial upload.
+        """
+        raw = io.BytesIO(source) if isinstance(source, (bytes, bytearray, memoryview)) else source
+        with self.connection() as conn, conn.cursor() as cursor:
+            try:
+                cursor.execute('''
+                    INSERT INTO import_jobs (filename, target_tab)
+                    VALUES (%s, %s)
+                    RETURNING id
+                ''', (filename, target_tab))
+                job_id = cursor.fetchone()[0]
+                seq = 0
+                while True:
+                    block = raw.read(IMPORT_BLOCK_BYTES)
+                    if not block:
+                        break
+                    cursor.execute(
+                        "INSERT INTO import_job_chunks (job_id, seq, data) VALUES (%s, %s, %s)",
+                        (job_id, seq, psycopg2.Binary(block)))
+                    seq += 1
+                conn.commit()
+                return job_id
+            except Exception:
+                conn.rollback()
+                raise
+
+    @contextmanager
+    def _job_upload(self, job_id):
+        """A local temporary copy of the job's upload (its path), streamed from import_job_chunks."""
+        out = tempfile.NamedTemporaryFile(suffix=".csv", delete=False)
         try:
+            with out, self.connection() as conn:
+                # A server-side cursor fetches a few blocks at a time
+                with conn.cursor(name=f"import_job_{job_id}") as cursor:
+                    cursor.itersize = 4
+                    cursor.execute("SELECT data FROM import_job_chunks WHERE job_id = %s ORDER BY seq", (job_id,))
+                    for (data,) in cursor:
+                        out.write(data)
+                conn.rollback()
+            yield out.name
+        finally:
+            os.remove(out.name)
+
+    def _claim_import_job(self, job_id=None):
+        """
+        Take the oldest queued job (or one whose worker went quiet mid-run) and mark it running;
+        with `job_id`, only that job. SKIP LOCKED lets any number of workers, in this process or
+        others, poll the same table.
+        """
+        with self.connection() as conn, conn.cursor() as cursor:
+            cursor.execute('''
+                UPDATE import_jobs SET status = 'error', error = 'Import did not finish', finished_at = NOW()
+                WHERE status = 'running' AND heartbeat_at < NOW() - %s * INTERVAL '1 second' AND attempts >= %s
+            ''', (IMPORT_JOB_STALE_AFTER, IMPORT_JOB_MAX_ATTEMPTS))
             cursor.execute('''
-                INSERT INTO transactions (
-                    date, type, category, payee, payee_note, 
-                    cash_amount, description, income, expense, 
-                    net_amount, bank_balance, account_source, is_duplicate_check
+                UPDATE import_jobs SET status = 'running', started_at = NOW(), heartbeat_at = NOW(),
+                                       attempts = attempts + 1
+                WHERE id = (
+                    SELECT id FROM import_jobs
+                    WHERE (status = 'queued'
+                           OR (status = 'running' AND heartbeat_at < NOW() - %s * INTERVAL '1 second'))
+                      AND (%s::integer IS NULL OR id = %s)
+                    ORDER BY id
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT 1
                 )
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                RETURNING id
+                RETURNING id, filename, target_tab
+            ''', (IMPORT_JOB_STALE_AFTER, job_id, job_id))
+            job = cursor.fetchone()
+            conn.commit()
+            return job
+
+    def _finish_import_job(self, job_id, result):
+        ok = result.get("status") == "success"
+        with self.connection() as conn, conn.cursor() as cursor:
+            # The upload is dropped once processed; only the outcome is kept
+            cursor.execute('''
+                UPDATE import_jobs SET
+                    status = %s, message = %s, error = %s,
+                    inserted = %s, skipped = %s, rows_processed = %s,
+                    finished_at = NOW()
+                WHERE id = %s
             ''', (
-                record.get('date', datetime.now().strftime('%Y-%m-%d')),
-                record.get('type', 'Manual Entry'),
-                record.get('category', ''),
-                record.get('payee', ''),
-                record.get('payee_note', ''),
-                0.0,
-                record.get('description', 'Manual Ledger Entry'),
-                0.0,
-                0.0,
-                0.0,
-                0.0,
-                'Manual',
-                f"manual_{datetime.now().timestamp()}" # unique dummy key
+                "done" if ok else "error",
+                result.get("message"),
+                None if ok else result.get("message"),
+                result.get("inserted", 0),
+                result.get("skipped", 0),
+                result.get("inserted", 0) + result.get("skipped", 0),
+                job_id,
             ))
-            new_id = cursor.fetchone()[0]
+            cursor.execute("DELETE FROM import_job_chunks WHERE job_id = %s", (job_id,))
             conn.commit()
-            return True, new_id
-        except Exception as e:
-            print(f"Failed to add manual transaction: {e}")
-            return False, str(e)
-        finally:
-            cursor.close()
-            conn.close()
 
-    def delete_transaction(self, tx_id: int):
-        conn = self.get_conn()
-        cursor = conn.cursor()
-        try:
-            cursor.execute("DELETE FROM transactions WHERE id = %s", (tx_id,))
-            conn.commit()
-            return True
-        except Exception as e:
-            print(f"Failed to delete transaction: {e}")
-            return False
-        finally:
-            cursor.close()
-            conn.close()
+    def run_pending_imports(self):
+        """Process queued import jobs until none are left; returns how many ran."""
+        ran = 0
+        while True:
+            job = self._claim_import_job()
+            if job is None:
+                return ran
+            self._run_import_job(job)
+            ran += 1
 
-    def get_all_transactions(self):
-        try:
-            conn = self.get_conn()
-            df = pd.read_sql("SELECT * FROM transactions ORDER BY date DESC, id DESC", conn)
-            conn.close()
-            df = df.fillna("")
-            return df.to_dict(orient='records')
-        except Exception as e:
-            print(f"DB Error: {e}")
-            return []
+    def run_import_job(self, job_id):
+        """
+        Import `job_id` here if it is queued or its worker went quiet; returns whether it ran.
+        A job a live worker is running is left to it.
+        """
+        job = self._claim_import_job(job_id)
+        if job is None:
+            return False
+        self._run_import_job(job)
+        return True
 
-    def get_all_invoices(self):
+    def _run_import_job(self, job):
+        job_id, filename, target_tab = job
+        progress = functools.partial(self._import_job_progress, job_id)
         try:
-            conn = self.get_conn()
-            df = pd.read_sql("SELECT * FROM invoice_items ORDER BY date DESC", conn)
-            conn.close()
-            df = df.fillna("")
-            return df.to_dict(orient='records')
+            with self._job_upload(job_id) as path:
+                result = self.process_csv(path, filename, target_tab, on_progress=progress)
         except Exception as e:
-            return []
-            
-    def _parse_usfoods(self, df, filename):
-        date_match = re.search(r'(\d{1,2}-\d{1,2})', filename)
-        date_str = f"2026-{date_match.group(1)}" if date_match else datetime.now().strftime('%Y-%m-%d')
-        count = 0
-        for _, row in df.iterrows():
-            if pd.isna(row.get('ProductDescription', '')): continue
-            entry = {
-                'date': date_str,
-                'vendor': 'US Foods',
-                'p_code': str(row.get('ProductNumber', '')),
-                'p_name': row.get('ProductDescription', ''),
-                'qty': float(row['QtyShip']) if pd.notnull(row.get('QtyShip')) else 0,
-                'unit': row.get('PricingUnit', ''),
-                'u_price': float(row['UnitPrice']) if pd.notnull(row.get('UnitPrice')) else 0,
-                't_price': float(row['ExtendedPrice']) if pd.notnull(row.get('ExtendedPrice')) else 0,
-            }
-            if self._save_invoice_item(entry): count += 1
-        return {"status": "success", "message": f"US Foods: {count} items saved"}
+            result = {"status": "error", "message": str(e)}
+        self._finish_import_job(job_id, result)
 
-    def _save_invoice_item(self, entry):
-        dup_key = f"{entry['date']}_{entry['p_code']}_{entry['t_price']}"
-        conn = self.get_conn()
-        cursor = conn.cursor()
-        try:
+    def _import_job_progress(self, job_id, inserted, skipped):
+        # Every chunk doubles as the job's heartbeat
+        with self.connection() as conn, conn.cursor() as cursor:
             cursor.execute('''
-                INSERT INTO invoice_items (date, vendor, product_code, product_name, quantity, unit, unit_price, total_price, is_duplicate_check)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ''', (
-                entry['date'], entry['vendor'], entry['p_code'], entry['p_name'],
-                entry['qty'], entry['unit'], entry['u_price'], entry['t_price'], dup_key
-            ))
+                UPDATE import_jobs SET inserted = %s, skipped = %s, rows_processed = %s, heartbeat_at = NOW()
+                WHERE id = %s
+            ''', (inserted, skipped, inserted + skipped, job_id))
             conn.commit()
-            return True
-        except psycopg2.IntegrityError: 
-            return False
-        finally:
-            cursor.close()
-            conn.close()
-
-    def _parse_truist(self, df):
-        for _, row in df.iterrows():
-            amt = self.clean_currency(row['Amount'])
-            entry = {
-                'date': pd.to_datetime(row['Transaction Date']).strftime('%Y-%m-%d'),
-                'type': row.get('Transaction Type', ''),
-                'desc': row.get('Full description', ''),
-                'income': amt if amt > 0 else 0,
-                'expense': abs(amt) if amt < 0 else 0,
-                'balance': self.clean_currency(row.get('Daily Posted Balance', 0)),
-                'source': 'Main Bank (Truist)'
-            }
-            self._save_row(entry, table_name="transactions")
-
-    def _parse_chase(self, df):
-        for _, row in df.iterrows():
-            amt = float(row['Amount']) if pd.notnull(row.get('Amount')) else 0.0
-            entry = {
-                'date': pd.to_datetime(row['Transaction Date']).strftime('%Y-%m-%d'),
-                'type': row.get('Type', ''),
-                'desc': row.get('Description', ''),
-                'income': amt if amt > 0 else 0,
-                'expense': abs(amt) if amt < 0 else 0,
-                'balance': 0.0,
-                'source': 'Chase CC'
-            }
-            self._save_row(entry, table_name="credit_card_records")
-
-    def _parse_citi(self, df):
-        for _, row in df.iterrows():
-            debit = self.clean_currency(row.get('Debit', 0))
-            credit = self.clean_currency(row.get('Credit', 0))
-            entry = {
-                'date': pd.to_datetime(row['Date']).strftime('%Y-%m-%d'),
-                'type': 'Credit Card',
-                'desc': row.get('Description', ''),
-                'income': credit,
-                'expense': debit,
-                'balance': 0.0,
-                'source': 'Citi CC'
-            }
-            self._save_row(entry, table_name="credit_card_records")
 
-    def get_all_credit_cards(self):
-        try:
-            conn = self.get_conn()
-            df = pd.read_sql("SELECT * FROM credit_card_records ORDER BY date DESC", conn)
-            conn.close()
-            df = df.fillna("")
-            return df.to_dict(orient='records')
-        except Exception as e:
-            print(f"DB Error: {e}")
-            return []
+    # --- Manual Financial Ledger Logic (신규) ---
+    def add_transaction(self, record: dict):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute('''
+                    INSERT INTO transactions (
+                        date, type, category, payee, payee_note, 
+                        cash_amount, description, income, expense, 
+                        net_amount, bank_balance, account_source, is_duplicate_check
+                    )
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    RETURNING id
+                ''', (
+                    record.get('date', datetime.now().strftime('%Y-%m-%d')),
+                    record.get('type', 'Manual Entry'),
+                    record.get('category', ''),
+                    record.get('payee', ''),
+                    record.get('payee_note', ''),
+                    0.0,
+                    record.get('description', 'Manual Ledger Entry'),
+                    0.0,
+                    0.0,
+                    0.0,
+                    0.0,
+                    'Manual',
+                    f"manual_{datetime.now().timestamp()}" # unique dummy key
+                ))
+                new_id = cursor.fetchone()[0]
+                conn.commit()
+                self.cache.invalidate("transactions")
+                return True, new_id
+            except Exception as e:
+                print(f"Failed to add manual transaction: {e}")
+                return False, str(e)
+            finally:
+                cursor.close()
 
-    # --- Cash Records Logic ---
-    def get_all_cash_records(self):
-        try:
-            conn = self.get_conn()
-            df = pd.read_sql("SELECT * FROM cash_records ORDER BY date DESC, id DESC", conn)
-            conn.close()
-            df = df.fillna("")
-            return df.to_dict(orient='records')
-        except Exception as e:
-            print(f"DB Error: {e}")
-            return []
+    def delete_transaction(self, tx_id: int):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("DELETE FROM transactions WHERE id = %s RETURNING date", (tx_id,))
+                rollups.refresh_months(cursor, [r[0] for r in cursor.fetchall()])
+                conn.commit()
+                self.cache.invalidate("transactions")
+                return True
+            except Exception as e:
+                print(f"Failed to delete transaction: {e}")
+                return False
+            finally:
+                cursor.close()
             
+    # --- Bulk statement ingestion ---
+    def _save_statement_rows(self, rows, table):
+        """
+        Rows from a compiled statement format -> (inserted, skipped). Rows already imported are
+        dropped by row_hash before the INSERT; ON CONFLICT then only matters for concurrent imports.
+        """
+        new = self._new_rows(rows, table)
+        if table == "invoice_items":
+            inserted, _ = self._save_invoice_rows(new)
+        else:
+            inserted, _ = self._bulk_save_rows(new, table)
+        return inserted, len(rows) - inserted
+
+    def _new_rows(self, rows, table):
+        if rows.empty:
+            return rows
+        found = self._fetch_rows(NEW_ROW_HASHES_QUERY.format(table=table), (rows['row_hash'].tolist(),))
+        return rows[rows['row_hash'].isin({r['row_hash'] for r in found})]
+
+    def _preview_rows(self, rows):
+        rows = rows.drop(columns='row_hash')
+        return rows.astype(object).where(rows.notna(), None).to_dict(orient='records')
+
+    def _save_invoice_rows(self, rows):
+        if rows.empty:
+            return 0, 0
+        values = rows.astype(object).where(rows.notna(), None)
+        inserted = self._insert_ignoring_duplicates("invoice_items", '''
+            INSERT INTO invoice_items (date, vendor, product_code, product_name, quantity, unit, unit_price, total_price, row_hash)
+            VALUES %s
+            ON CONFLICT (row_hash) DO NOTHING
+            RETURNING product_code, date
+        ''', list(values.itertuples(index=False, name=None)),
+            on_inserted=self._refresh_price_history_for_inserted)
+        return inserted, len(rows) - inserted
+
+    def _insert_ignoring_duplicates(self, table, sql, rows, template=None, on_inserted=None):
+        """
+        Run a multi-row INSERT ... ON CONFLICT DO NOTHING RETURNING ... into `table` in one transaction; returns rows inserted.
+        on_inserted(cursor, returned_rows) runs in the same transaction before the commit.
+        """
+        if not rows:
+            return 0
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                inserted = execute_values(cursor, sql, rows, template=template, page_size=1000, fetch=True)
+                if on_inserted:
+                    on_inserted(cursor, inserted)
+                conn.commit()
+                self.cache.invalidate(table)
+                return len(inserted)
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+
+    def _bulk_save_rows(self, df, table_name):
+        """
+        df columns: date, type, desc, income, expense, balance, source, row_hash.
+        Inserts every row in one transaction and returns (inserted, skipped).
+        """
+        if df.empty:
+            return 0, 0
+        columns = ['date', 'type', 'desc', 'income', 'expense', 'balance', 'source', 'row_hash']
+        # category / payee / payee_note come from the categorization rules, blank without them
+        rows = df.reindex(columns=columns + list(categorize.LABEL_FIELDS), fill_value='')
+        rows.insert(5, 'net_amount', rows['income'] - rows['expense'])
+        rows = rows.astype(object).where(rows.notna(), None)
+
+        inserted = self._insert_ignoring_duplicates(table_name, f'''
+            INSERT INTO {table_name} (
+                date, type, description, income, expense,
+                net_amount, bank_balance, account_source, row_hash,
+                category, payee, payee_note, cash_amount
+            )
+            VALUES %s
+            ON CONFLICT (row_hash) DO NOTHING
+            RETURNING date
+        ''', list(rows.itertuples(index=False, name=None)),
+            template="(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, 0.0)",
+            on_inserted=self._refresh_rollups_for_inserted)
+        return inserted, len(rows) - inserted
+
+    def _refresh_rollups_for_inserted(self, cursor, inserted):
+        rollups.refresh_months(cursor, [row[0] for row in inserted])
+
+    def _refresh_price_history_for_inserted(self, cursor, inserted):
+        price_history.refresh(cursor, inserted)
+
+    # --- Cash Records Logic ---
     def add_cash_record(self, record: dict):
-        conn = self.get_conn()
-        cursor = conn.cursor()
-        try:
-            cursor.execute('''
-                INSERT INTO cash_records (date, category, payee, income, expense, balance, description)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-                RETURNING id
-            ''', (
-                record.get('date', ''),
-                record.get('category', ''),
-                record.get('payee', ''),
-                float(record.get('income', 0) or 0),
-                float(record.get('expense', 0) or 0),
-                float(record.get('balance', 0) or 0),
-                record.get('description', '')
-            ))
-            new_id = cursor.fetchone()[0]
-            conn.commit()
-            return True, new_id
-        except Exception as e:
-            print(f"Failed to add cash record: {e}")
-            return False, str(e)
-        finally:
-            cursor.close()
-            conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute('''
+                    INSERT INTO cash_records (date, category, payee, income, expense, balance, description)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                    RETURNING id
+                ''', (
+                    record.get('date') or datetime.now().strftime('%Y-%m-%d'),
+                    record.get('category', ''),
+                    record.get('payee', ''),
+                    float(record.get('income', 0) or 0),
+                    float(record.get('expense', 0) or 0),
+                    float(record.get('balance', 0) or 0),
+                    record.get('description', '')
+                ))
+                new_id = cursor.fetchone()[0]
+                conn.commit()
+                self.cache.invalidate("cash_records")
+                return True, new_id
+            except Exception as e:
+                print(f"Failed to add cash record: {e}")
+                return False, str(e)
+            finally:
+                cursor.close()
 
     def update_cash_record(self, record_id: int, field: str, value: Any):
-        conn = self.get_conn()
-        cursor = conn.cursor()
-        try:
-            allowed_fields = ['date', 'category', 'payee', 'income', 'expense', 'balance', 'description']
-            if field not in allowed_fields:
-                return False
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                allowed_fields = ['date', 'category', 'payee', 'income', 'expense', 'balance', 'description']
+                if field not in allowed_fields:
+                    return False
 
-            if field in ['income', 'expense', 'balance']:
-                try:
-                    value = float(value)
-                except ValueError:
-                    value = 0.0
+                if field in ['income', 'expense', 'balance']:
+                    try:
+                        value = float(value)
+                    except ValueError:
+                        value = 0.0
+                elif field == 'date' and not value:
+                    value = None
 
-            cursor.execute(f"UPDATE cash_records SET {field} = %s WHERE id = %s", (value, record_id))
-            conn.commit()
-            return True
-        except Exception as e:
-            print(f"Failed to update cash record: {e}")
-            return False
-        finally:
-            cursor.close()
-            conn.close()
+                # Returns the date before and after the update so a moved row refreshes both months
+                cursor.execute(f'''
+                    UPDATE cash_records SET {field} = %s
+                    FROM (SELECT id, date AS old_date FROM cash_records WHERE id = %s FOR UPDATE) old
+                    WHERE cash_records.id = old.id
+                    RETURNING old.old_date, cash_records.date
+                ''', (value, record_id))
+                rollups.refresh_months(cursor, [d for row in cursor.fetchall() for d in row])
+                conn.commit()
+                self.cache.invalidate("cash_records")
+                return True
+            except Exception as e:
+                print(f"Failed to update cash record: {e}")
+                return False
+            finally:
+                cursor.close()
 
     def delete_cash_record(self, record_id: int):
-        conn = self.get_conn()
-        cursor = conn.cursor()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("DELETE FROM cash_records WHERE id = %s RETURNING date", (record_id,))
+                rollups.refresh_months(cursor, [r[0] for r in cursor.fetchall()])
+                conn.commit()
+                self.cache.invalidate("cash_records")
+                return True
+            except Exception as e:
+                print(f"Failed to delete cash record: {e}")
+                return False
+            finally:
+                cursor.close()
+
+    # --- Partial Updates (PATCH) & Bulk Grid Edits ---
+    def _written_tables(self, table):
+        # Sales edits also create the day's System 'Cash Sales' ledger row
+        return (table, "transactions") if table == "sales_records" else (table,)
+
+    def _coerce_value(self, table, field, value):
+        if field not in EDITABLE_COLUMNS[table]:
+            raise ValueError(f"Field '{field}' is not editable on {table}")
+        kind = EDITABLE_COLUMNS[table][field]
+        if kind == "numeric":
+            # A cleared grid cell means 0, as update_cash_record has always done
+            if value in ("", None):
+                return 0.0
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"'{value}' is not a number for {field}")
+        if kind == "date" and value == "":
+            return None
+        return value
+
+    def _masked_update(self, table, key_type, columns):
+        """
+        (VALUES template, column list, SET clause) for a batch where each row sets only some columns:
+        every column travels with a set_<column> flag, so a row can also write NULL.
+        """
+        editable = EDITABLE_COLUMNS[table]
+        template = "(" + ", ".join([f"%s::{key_type}"] + [f"%s::boolean, %s::{editable[c]}" for c in columns]) + ")"
+        names = ", ".join(f"set_{c}, {c}" for c in columns)
+        set_clause = ", ".join(f"{c} = CASE WHEN v.set_{c} THEN v.{c} ELSE t.{c} END" for c in columns)
+        return template, names, set_clause
+
+    def _masked_values(self, key, fields, columns):
+        return tuple([key] + [x for c in columns for x in (c in fields, fields.get(c))])
+
+    def _patch_rows(self, cursor, table, patches):
+        """
+        Apply partial updates in one UPDATE ... FROM (VALUES ...) RETURNING statement, in the caller's transaction.
+        `patches` is a list of {"id": ..., <column>: <value>}; columns not in a patch are left as is,
+        and a None value clears the cell (a numeric cell becomes 0, as in update_cash_record).
+        Returns (updated rows, dates whose monthly rollups need a refresh).
+        """
+        ids = [p['id'] for p in patches]
+        if len(set(ids)) != len(ids):
+            raise ValueError("Each id may appear only once per batch")
+        columns = sorted({k for p in patches for k in p if k != 'id'})
+        unknown = [c for c in columns if c not in EDITABLE_COLUMNS[table]]
+        if unknown:
+            raise ValueError(f"Fields not editable on {table}: {', '.join(unknown)}")
+        if not columns:
+            return [], []
+
+        template, names, set_clause = self._masked_update(table, "integer", columns)
+        values = [
+            self._masked_values(p['id'], {c: self._coerce_value(table, c, v) for c, v in p.items() if c != 'id'}, columns)
+            for p in patches
+        ]
+
+        # `old` is read from the pre-update snapshot, so old.date is the date before the patch
+        updated = execute_values(cursor, f'''
+            UPDATE {table} t SET {set_clause}
+            FROM (VALUES %s) AS v(id, {names}), {table} old
+            WHERE t.id = v.id AND old.id = v.id
+            RETURNING t.*, old.date AS old_date
+        ''', values, template=template, page_size=max(len(values), 1), fetch=True)
+
+        touched = []
+        if ROLLUP_COLUMNS.get(table, set()).intersection(columns):
+            names = [d[0] for d in cursor.description]
+            date_i, old_i = names.index('date'), names.index('old_date')
+            touched = [row[i] for row in updated for i in (old_i, date_i)]
+
+        rows = self._rows_to_dicts(cursor, updated)
+        for row in rows:
+            row.pop('old_date', None)
+        # An edited card payment may no longer be one, or no longer match its statement credit
+        if table == "transactions" and reconcile.MATCH_COLUMNS.intersection(columns):
+            if reconcile.unmatch(cursor, ids):
+                reconcile.reconcile(cursor)
+        return rows, touched
+
+    def _edit_sales(self, cursor, edits):
+        """
+        edits: {date: {field: value}}. Creates missing days, applies every field in one UPDATE,
+        then recomputes total and creates the System 'Cash Sales' ledger row for days that took cash.
+        Runs in the caller's transaction; returns (rows, dates).
+        """
+        if not edits:
+            return [], []
+        for day in edits:
+            try:
+                datetime.strptime(str(day), "%Y-%m-%d")
+            except ValueError:
+                raise ValueError(f"Invalid sales date '{day}', expected YYYY-MM-DD")
+        coerced = {d: {f: self._coerce_value("sales_records", f, v) for f, v in fields.items()}
+                   for d, fields in edits.items()}
+        columns = sorted({f for fields in coerced.values() for f in fields})
+        dates = list(coerced)
+
+        # 먼저 해당 날짜 데이터가 없으면 생성
+        cursor.execute("INSERT INTO sales_records (date) SELECT unnest(%s::date[]) ON CONFLICT (date) DO NOTHING", (dates,))
+
+        template, names, set_clause = self._masked_update("sales_records", "date", columns)
+        execute_values(cursor, f'''
+            UPDATE sales_records t SET {set_clause}
+            FROM (VALUES %s) AS v(date, {names})
+            WHERE t.date = v.date
+        ''', [self._masked_values(d, coerced[d], columns) for d in dates],
+            template=template, page_size=max(len(dates), 1))
+
+        # 해당 날짜의 전체 합계(Total)를 다시 계산하여 업데이트
+        cursor.execute('''
+            UPDATE sales_records SET total =
+                COALESCE(cash, 0) + COALESCE(debit, 0) + COALESCE(credit, 0) +
+                COALESCE(cash_tips, 0) + COALESCE(doordash, 0) + COALESCE(stripe, 0)
+            WHERE date = ANY(%s::date[])
+            RETURNING *
+        ''', (dates,))
+        updated = cursor.fetchall()
+        date_i = [d[0] for d in cursor.description].index('date')
+        touched = [row[date_i] for row in updated]
+        rollups.sync_cash_sales_rows(cursor, touched)
+        return self._rows_to_dicts(cursor, updated), touched
+
+    def patch_records(self, table, patches):
+        """Partial updates for many rows of `table` in one round trip; returns the updated rows."""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                rows, touched = self._patch_rows(cursor, table, patches)
+                rollups.refresh_months(cursor, touched)
+                conn.commit()
+                self.cache.invalidate(*self._written_tables(table))
+                return rows
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+
+    def patch_record(self, table, record_id, fields):
+        rows = self.patch_records(table, [dict(fields, id=record_id)])
+        return rows[0] if rows else None
+
+    def apply_edits(self, changes):
+        """
+        Bulk grid edits across tables in a single transaction.
+        changes: [{"table": "sales"|"cash"|"transactions"|"credit_cards", "key": <date or id>, "field": ..., "value": ...}]
+        Later changes to the same cell win. Returns only the changed rows, grouped by table name as given.
+        """
+        grouped = {}
+        for change in changes:
+            name = change['table']
+            if name not in EDIT_TABLES:
+                raise ValueError(f"Unknown table '{name}'")
+            table = EDIT_TABLES[name]
+            value = self._coerce_value(table, change['field'], change.get('value'))
+            grouped.setdefault(name, {}).setdefault(change['key'], {})[change['field']] = value
+
+        result = {}
+        touched = []
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                for name, rows_by_key in grouped.items():
+                    table = EDIT_TABLES[name]
+                    if table == "sales_records":
+                        rows, dates = self._edit_sales(cursor, rows_by_key)
+                    else:
+                        patches = [dict(fields, id=int(key)) for key, fields in rows_by_key.items()]
+                        rows, dates = self._patch_rows(cursor, table, patches)
+                    result[name] = rows
+                    touched += dates
+                rollups.refresh_months(cursor, touched)
+                conn.commit()
+                self.cache.invalidate(*{t for name in grouped for t in self._written_tables(EDIT_TABLES[name])})
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+        return result
+
+    # --- Paginated Listing (keyset on date DESC, id DESC) ---
+    def _encode_cursor(self, row):
+        date = row.get('date')
+        payload = json.dumps([date.isoformat() if date else None, row['id']])
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    def _decode_cursor(self, cursor):
         try:
-            cursor.execute("DELETE FROM cash_records WHERE id = %s", (record_id,))
-            conn.commit()
-            return True
-        except Exception as e:
-            print(f"Failed to delete cash record: {e}")
-            return False
-        finally:
-            cursor.close()
-            conn.close()
\ No newline at end of file
+            date, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            return date, int(row_id)
+        except Exception:
+            raise ValueError("Invalid cursor")
+
+    def _list_filters(self, table, date_from=None, date_to=None, q=None, **filters):
+        spec = LIST_TABLES[table]
+        clauses, params = [], {}
+        if date_from:
+            clauses.append("date >= %(date_from)s")
+            params['date_from'] = date_from
+        if date_to:
+            clauses.append("date <= %(date_to)s")
+            params['date_to'] = date_to
+        for name, value in filters.items():
+            if value is None:
+                continue
+            if name not in spec['filters']:
+                raise ValueError(f"Filter '{name}' is not supported for {table}")
+            clauses.append(f"{spec['filters'][name]} = %({name})s")
+            params[name] = value
+        if q:
+            pattern = '%' + q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            clauses.append('(' + ' OR '.join(f"{col} ILIKE %(q)s" for col in spec['search']) + ')')
+            params['q'] = pattern
+        return clauses, params
+
+    def _list_query(self, table, limit=None, cursor=None, include_total=False, **filters):
+        """SQL for one page of `table`: returns (sql, params, limit, count_sql or None)."""
+        clauses, params = self._list_filters(table, **filters)
+        page_clauses = list(clauses)
+        if cursor:
+            last_date, last_id = self._decode_cursor(cursor)
+            params['cursor_id'] = last_id
+            if last_date is None:
+                # NULL dates sort first under DESC, so after them come the remaining NULLs then every dated row
+                page_clauses.append("(date IS NOT NULL OR id < %(cursor_id)s)")
+            else:
+                page_clauses.append("(date, id) < (%(cursor_date)s, %(cursor_id)s)")
+                params['cursor_date'] = last_date
+
+        source = LIST_TABLES[table].get('source', table)
+        sql = f"SELECT * FROM {source}"
+        if page_clauses:
+            sql += " WHERE " + " AND ".join(page_clauses)
+        sql += " ORDER BY date DESC, id DESC"
+        if limit is not None:
+            limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+            # One extra row tells us whether another page exists
+            sql += " LIMIT %(limit)s"
+            params['limit'] = limit + 1
+
+        count_sql = None
+        if include_total:
+            count_sql = f"SELECT COUNT(*) FROM {source}"
+            if clauses:
+                count_sql += " WHERE " + " AND ".join(clauses)
+        return sql, params, limit, count_sql
+
+    def _list_page(self, cursor, rows, limit, total):
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = self._encode_cursor(dict(zip([d[0] for d in cursor.description], rows[-1])))
+        data = self._rows_to_dicts(cursor, rows)
+        return {"count": len(data), "data": data, "next_cursor": next_cursor, "total": total}
+
+    def _iter_sql(self, table, **filters):
+        clauses, params = self._list_filters(table, **filters)
+        sql = f"SELECT * FROM {LIST_TABLES[table].get('source', table)}"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY date DESC, id DESC"
+        return sql, params
+
+    # --- Dashboard Aggregates ---
+    def rebuild_monthly_rollups(self):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                rollups.rebuild(cursor)
+                conn.commit()
+                self.cache.invalidate("monthly_totals", "monthly_expense_breakdown")
+                cursor.execute("SELECT COUNT(*) FROM monthly_totals")
+                return cursor.fetchone()[0]
+            finally:
+                cursor.close()
+
+    # --- Bank-to-card reconciliation ---
+    def reconcile_card_payments(self, rebuild=False):
+        """Match bank card payments to card statement credits; returns the number of new matches."""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                matched = reconcile.reconcile(cursor, rebuild)
+                conn.commit()
+                self.cache.invalidate("card_payment_matches")
+                return matched
+            except Exception as e:
+                conn.rollback()
+                print(f"Reconciliation error: {e}")
+                raise
+            finally:
+                cursor.close()
+
+    # --- Invoice-to-ledger matching ---
+    def match_invoices(self, rebuild=False):
+        """Pair vendor invoice totals with their bank debits; returns the number of new matches."""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                matched = invoice_match.match_invoices(cursor, rebuild)
+                conn.commit()
+                self.cache.invalidate("invoice_ledger_matches")
+                return matched
+            except Exception as e:
+                conn.rollback()
+                print(f"Invoice matching error: {e}")
+                raise
+            finally:
+                cursor.close()
+
+    # --- Product price history ---
+    def rebuild_price_history(self):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                price_history.rebuild(cursor)
+                conn.commit()
+                self.cache.invalidate("product_prices")
+                cursor.execute("SELECT COUNT(*) FROM product_latest")
+                return cursor.fetchone()[0]
+            finally:
+                cursor.close()
+
+    # --- Search ---
+    def _trigram_index(self, documents):
+        """The in-process index over a search_documents cache entry, rebuilt when the entry changes."""
+        entry, index = self._search_index
+        if entry is not documents:
+            index = search.TrigramIndex(documents.value)
+            self._search_index = (documents, index)
+        return index
+
+    def _dashboard_queries(self, month):
+        """(totals_sql, breakdown_sql, params) over the rollup tables, for one month prefix or all time."""
+        in_month = "(%(month)s::text IS NULL OR month LIKE %(month_like)s)"
+        params = {"month": month, "month_like": f"{month}%" if month else None}
+        sums = ", ".join(f"SUM({c}) FILTER (WHERE {in_month})" for c in rollups.TOTAL_COLUMNS)
+        totals_sql = f'''
+            SELECT
+                SUM(ledger_income), SUM(ledger_expense - ledger_transfer + card_expense), SUM(ledger_cash_amount),
+                SUM(sales_cash + sales_cash_tips), SUM(cash_expense),
+                {sums}
+            FROM monthly_totals
+        '''
+        # 비용 추적 분석: 카테고리/지급처별 지출
+        breakdown_sql = f'''
+            SELECT kind, name, SUM(amount) FROM monthly_expense_breakdown
+            WHERE {in_month}
+            GROUP BY kind, name
+            ORDER BY 3 DESC
+        '''
+        return totals_sql, breakdown_sql, params
+
+    def _dashboard_summary(self, totals, expense_rows):
+        (lt_ledger_income, lt_ledger_expense, lt_ledger_cash_expense,
+         lt_sales_cash_income, lt_cash_records_expense,
+         ledger_income, ledger_expense, ledger_cash_expense,
+         cash, debit, credit, doordash, stripe, tips, cash_tips,
+         cash_records_income, cash_records_expense,
+         card_expense, ledger_transfer) = (float(v or 0) for v in totals)
+
+        lt_total_revenue = lt_ledger_income + lt_sales_cash_income
+        lt_total_expense = lt_ledger_expense + lt_cash_records_expense + lt_ledger_cash_expense
+
+        # 수익 합계 = Ledger income + Sales Record 현금 매출, 지출 합계 = Ledger expense + Cash expense + Ledger cash_amount
+        total_cash_sales = cash + cash_tips
+        total_revenue = ledger_income + total_cash_sales
+        # Card payments matched to a card statement are transfers; the card lines they paid count instead
+        total_expense = ledger_expense - ledger_transfer + card_expense + cash_records_expense + ledger_cash_expense
+
+        # Cash on hand = (Sales cash + cash_tips + Cash Table income) - (Ledger cash_amount + Cash Table expense)
+        current_cash = (total_cash_sales + cash_records_income) - (ledger_cash_expense + cash_records_expense)
+
+        return {
+            "totalRevenue": total_revenue,
+            "totalExpense": total_expense,
+            "netProfit": total_revenue - total_expense,
+            "balance": current_cash,
+            "cardExpense": card_expense,
+            "reconciledTransfers": ledger_transfer,
+            "salesBreakdown": {
+                "cash": cash,
+                "debit": debit,
+                "credit": credit,
+                "doordash": doordash,
+                "stripe": stripe,
+                "tips": tips,
+                "cash_tips": cash_tips,
+            },
+            "categoryExpenses": [{"name": name, "amount": amount} for kind, name, amount in expense_rows if kind == 'category'],
+            "payeeExpenses": [{"name": name, "amount": amount} for kind, name, amount in expense_rows if kind == 'payee'],
+            "lifetimeStats": {
+                "revenue": lt_total_revenue,
+                "expense": lt_total_expense,
+                "netProfit": lt_total_revenue - lt_total_expense
+            }
+        }
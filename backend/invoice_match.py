@@ -0,0 +1,152 @@
+"""
+Invoice-to-ledger matching for vendor deliveries.
+
+invoice_items holds one row per invoice line; the bank pays each delivery as one
+debit in transactions. match() totals the lines per (date, vendor) and pairs each
+invoice with a debit to that vendor inside a date window whose amount is within
+tolerance, and the pairs are stored in invoice_ledger_matches.
+
+Only invoices and debits not matched yet are read, so matching after every upload
+is incremental; rebuild=True starts over.
+"""
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import timedelta
+
+# Vendors whose invoices are imported, with the words their bank debits carry
+VENDORS = {"US Foods": ("US FOODS", "USFOODS")}
+
+# The debit may clear this many days before / after the delivery date
+DAYS_BEFORE = 2
+DAYS_AFTER = 21
+# Amount tolerance: whichever is larger (credits, fuel surcharges and rounding on the invoice)
+TOLERANCE_CENTS = 100
+TOLERANCE_SHARE = 0.01
+
+TABLES = ("invoice_ledger_matches", "invoice_items", "transactions")
+
+
+def _vendor_expr():
+    """SQL naming the vendor a transactions row (t) pays, or NULL."""
+    cases = []
+    for vendor, words in VENDORS.items():
+        tests = [f"t.payee = '{vendor}'"] + [f"t.description ILIKE '%{word}%'" for word in words]
+        cases.append(f"WHEN {' OR '.join(tests)} THEN '{vendor}'")
+    return f"CASE {' '.join(cases)} END"
+
+
+VENDOR_EXPR = _vendor_expr()
+VENDOR_LIST = ", ".join(f"'{vendor}'" for vendor in VENDORS)
+
+UNMATCHED_INVOICES = f'''
+    SELECT i.date, i.vendor, SUM(i.total_price) AS total, COUNT(*) AS line_count
+    FROM invoice_items i
+    WHERE i.date IS NOT NULL AND i.vendor IN ({VENDOR_LIST})
+      AND NOT EXISTS (
+          SELECT 1 FROM invoice_ledger_matches m WHERE m.invoice_date = i.date AND m.vendor = i.vendor
+      )
+    GROUP BY i.date, i.vendor
+'''
+UNMATCHED_DEBITS = f'''
+    SELECT * FROM (
+        SELECT t.id, t.date, t.description, t.expense, {VENDOR_EXPR} AS vendor
+        FROM transactions t
+        WHERE t.expense > 0 AND t.date IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM invoice_ledger_matches m WHERE m.transaction_id = t.id)
+    ) d
+    WHERE vendor IS NOT NULL
+'''
+
+MATCHES_QUERY = '''
+    SELECT m.invoice_date, m.vendor, m.invoice_total, m.line_count, m.transaction_id,
+           t.date AS payment_date, t.description AS payment_description, t.expense AS payment_amount,
+           m.amount_diff, m.day_gap, m.matched_at
+    FROM invoice_ledger_matches m
+    JOIN transactions t ON t.id = m.transaction_id
+    ORDER BY m.invoice_date DESC, m.vendor
+'''
+UNMATCHED_INVOICES_QUERY = f"{UNMATCHED_INVOICES} ORDER BY i.date DESC, i.vendor"
+UNMATCHED_DEBITS_QUERY = f"{UNMATCHED_DEBITS} ORDER BY date DESC, id DESC"
+
+
+def create_matches_table(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS invoice_ledger_matches (
+            invoice_date DATE NOT NULL,
+            vendor TEXT NOT NULL,
+            transaction_id INTEGER UNIQUE NOT NULL REFERENCES transactions(id) ON DELETE CASCADE,
+            invoice_total NUMERIC(12,2),
+            line_count INTEGER,
+            amount_diff NUMERIC(12,2),
+            day_gap INTEGER,
+            matched_at TIMESTAMPTZ DEFAULT NOW(),
+            PRIMARY KEY (invoice_date, vendor)
+        )
+    ''')
+
+
+def _tolerance(cents):
+    return max(TOLERANCE_CENTS, round(abs(cents) * TOLERANCE_SHARE))
+
+
+def match(invoices, debits, before=DAYS_BEFORE, after=DAYS_AFTER):
+    """
+    invoices: (date, vendor, cents, line_count); debits: (id, date, cents, vendor) -> [(invoice, debit)].
+    Debits are hashed by vendor and sorted by date; each invoice bisects to its window and takes
+    the free debit closest in amount (then in date) that is within tolerance.
+    """
+    buckets = defaultdict(list)
+    for debit in sorted(debits, key=lambda d: (d[1], d[0])):
+        buckets[debit[3]].append(debit)
+    dates = {vendor: [d[1] for d in bucket] for vendor, bucket in buckets.items()}
+
+    pairs = []
+    for invoice in sorted(invoices, key=lambda i: (i[0], i[1])):
+        inv_date, vendor, cents = invoice[0], invoice[1], invoice[2]
+        bucket = buckets.get(vendor)
+        if not bucket:
+            continue
+        best, best_key = None, None
+        i = bisect_left(dates[vendor], inv_date - timedelta(days=before))
+        while i < len(bucket) and bucket[i][1] <= inv_date + timedelta(days=after):
+            diff = abs(bucket[i][2] - cents)
+            if diff <= _tolerance(cents):
+                key = (diff, abs((bucket[i][1] - inv_date).days))
+                if best_key is None or key < best_key:
+                    best, best_key = i, key
+            i += 1
+        if best is not None:
+            pairs.append((invoice, bucket.pop(best)))
+            del dates[vendor][best]
+    return pairs
+
+
+def match_invoices(cursor, rebuild=False):
+    """Match the unmatched invoices in the caller's transaction; returns how many pairs were added."""
+    # One matcher at a time, or two could claim the same debit
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext('invoice_ledger_matches'))")
+    if rebuild:
+        cursor.execute("DELETE FROM invoice_ledger_matches")
+
+    cursor.execute(f"SELECT date, vendor, (total * 100)::bigint, line_count FROM ({UNMATCHED_INVOICES}) i")
+    invoices = cursor.fetchall()
+    cursor.execute(f"SELECT id, date, (expense * 100)::bigint, vendor FROM ({UNMATCHED_DEBITS}) d")
+    pairs = match(invoices, cursor.fetchall())
+
+    if pairs:
+        cursor.execute('''
+            INSERT INTO invoice_ledger_matches
+                (invoice_date, vendor, transaction_id, invoice_total, line_count, amount_diff, day_gap)
+            SELECT unnest(%s::date[]), unnest(%s::text[]), unnest(%s::integer[]),
+                   unnest(%s::bigint[]) / 100.0, unnest(%s::integer[]),
+                   unnest(%s::bigint[]) / 100.0, unnest(%s::integer[])
+        ''', (
+            [inv[0] for inv, d in pairs],
+            [inv[1] for inv, d in pairs],
+            [d[0] for inv, d in pairs],
+            [inv[2] for inv, d in pairs],
+            [inv[3] for inv, d in pairs],
+            [d[2] - inv[2] for inv, d in pairs],
+            [(d[1] - inv[0]).days for inv, d in pairs],
+        ))
+    return len(pairs)
@@ -1,21 +1,31 @@
 # backend/main.py
 import sys
 import os
-import psycopg2
+import json
+from contextlib import asynccontextmanager
+from decimal import Decimal
 from pydantic import BaseModel
-from typing import Optional, Any, Union
+from typing import Optional, Any, Union, List
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(current_dir)
 
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Request, Response
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Request, Response, Depends
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.base import BaseHTTPMiddleware
-from finance_engine import ExpenseEngine 
-import uvicorn
+from async_engine import AsyncExpenseEngine
+import search
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(_app):
+    yield
+    await engine.close()
+
+# Lifespan runs only for the app uvicorn serves (never for a mounted one): the outer app
+# below on Vercel, this one for the local dev server
+app = FastAPI(lifespan=lifespan)
 
 class AuthMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next):
@@ -68,114 +78,33 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-engine = ExpenseEngine()
+# Read endpoints are async and await the engine's psycopg 3 pool; write endpoints stay
+# sync (FastAPI runs them in its threadpool) on the inherited psycopg2 methods.
+engine = AsyncExpenseEngine()
+
+def cached_response(request: Request, response: Response, entry, wrap=None):
+    """
+    Serve a cached engine result with its ETag: 304 when If-None-Match already has it.
+    wrap(value) builds the response body, so the ETag of the cached value still identifies it.
+    """
+    sent = request.headers.get("if-none-match", "")
+    tags = {t.strip().removeprefix("W/") for t in sent.split(",")}
+    if entry.etag in tags or "*" in tags:
+        return Response(status_code=304, headers={"ETag": entry.etag})
+    response.headers["ETag"] = entry.etag
+    # The browser may keep the body but must revalidate before using it
+    response.headers["Cache-Control"] = "no-cache"
+    return wrap(entry.value) if wrap else entry.value
+
+def with_count(data):
+    return {"count": len(data), "data": data}
 
 @app.get("/dashboard-summary")
-def get_dashboard(month: Optional[str] = None):
-    sales = engine.get_sales_records()
-    trans = engine.get_all_transactions()
-    cash_rcds = engine.get_all_cash_records()
-    
-    # --- Lifetime Calculations (Before month filter) ---
-    lt_ledger_income = sum(float(t.get('income') or 0) for t in trans)
-    lt_sales_cash_income = sum(float(s.get('cash') or 0) + float(s.get('cash_tips') or 0) for s in sales)
-    lt_total_revenue = lt_ledger_income + lt_sales_cash_income
-
-    lt_ledger_expense = sum(float(t.get('amount') or t.get('expense') or 0) for t in trans if (float(t.get('amount') or 0) > 0 or float(t.get('expense') or 0) > 0))
-    lt_cash_records_expense = sum(float(c.get('expense') or 0) for c in cash_rcds)
-    lt_ledger_cash_expense = sum(float(t.get('cash_amount') or 0) for t in trans)
-    lt_total_expense = lt_ledger_expense + lt_cash_records_expense + lt_ledger_cash_expense
-    
-    lifetime_stats = {
-        "revenue": lt_total_revenue,
-        "expense": lt_total_expense,
-        "netProfit": lt_total_revenue - lt_total_expense
-    }
-    
-    # --- Monthly Filter ---
-    if month:
-        sales = [s for s in sales if str(s.get('date', '')).startswith(month)]
-        trans = [t for t in trans if str(t.get('date', '')).startswith(month)]
-        cash_rcds = [c for c in cash_rcds if str(c.get('date', '')).startswith(month)]
-    
-    # 수익 합계 = Financial Ledger (transactions)의 income 합계 + Sales Record의 현금 매출 (Cash Income)
-    ledger_income = sum(float(t.get('income') or 0) for t in trans)
-    sales_cash_income = sum(float(s.get('cash') or 0) + float(s.get('cash_tips') or 0) for s in sales)
-    total_revenue = ledger_income + sales_cash_income
-    
-    # 지출 합계 = Ledger(transactions)의 expense + Cash records의 expense + Ledger의 cash_amount (Cash Expense)
-    ledger_expense = sum(float(t.get('amount') or t.get('expense') or 0) for t in trans if (float(t.get('amount') or 0) > 0 or float(t.get('expense') or 0) > 0))
-    cash_records_expense = sum(float(c.get('expense') or 0) for c in cash_rcds)
-    ledger_cash_expense = sum(float(t.get('cash_amount') or 0) for t in trans)
-    total_expense = ledger_expense + cash_records_expense + ledger_cash_expense
-    
-    # Calculate cash on hand (Cash Incomes - Cash Expenses)
-    # Cash Income: Sales Record (cash + cash_tips) + Cash Table (income)
-    total_cash_sales = sum(float(s.get('cash') or 0) + float(s.get('cash_tips') or 0) for s in sales)
-    cash_records_income = sum(float(c.get('income') or 0) for c in cash_rcds)
-    total_cash_income = total_cash_sales + cash_records_income
-    
-    # Cash Expense: Ledger (cash_amount) + Cash Table (expense)
-    total_cash_paid = sum(float(t.get('cash_amount') or 0) for t in trans)
-    cash_records_exp = sum(float(c.get('expense') or 0) for c in cash_rcds)
-    total_cash_expense = total_cash_paid + cash_records_exp
-    
-    current_cash = total_cash_income - total_cash_expense
-    
-    # Calculate detailed sales breakdown
-    sales_breakdown = {
-        "cash": sum(float(s.get('cash') or 0) for s in sales),
-        "debit": sum(float(s.get('debit') or 0) for s in sales),
-        "credit": sum(float(s.get('credit') or 0) for s in sales),
-        "doordash": sum(float(s.get('doordash') or 0) for s in sales),
-        "stripe": sum(float(s.get('stripe') or 0) for s in sales),
-        "tips": sum(float(s.get('tips') or 0) for s in sales),
-        "cash_tips": sum(float(s.get('cash_tips') or 0) for s in sales),
-    }
-    
-    # ------------------
-    # 비용 추적 분석 로직
-    # ------------------
-    cat_exp_map = {}
-    payee_exp_map = {}
-    
-    # Transactions 분석 (Financial Ledger)
-    for t in trans:
-        expense_val = float(t.get('expense') or 0.0) + float(t.get('cash_amount') or 0.0)
-        c = str(t.get('category') or "").strip()
-        p = str(t.get('payee') or "").strip()
-        
-        if expense_val > 0:
-            if c: cat_exp_map[c] = cat_exp_map.get(c, 0.0) + expense_val
-            if p: payee_exp_map[p] = payee_exp_map.get(p, 0.0) + expense_val
-
-    # Cash Records 분석 (Cash Table)
-    for c_rcd in cash_rcds:
-        expense_val = float(c_rcd.get('expense') or 0.0)
-        c = str(c_rcd.get('category') or "").strip()
-        p = str(c_rcd.get('payee') or "").strip()
-        
-        if expense_val > 0:
-            if c: cat_exp_map[c] = cat_exp_map.get(c, 0.0) + expense_val
-            if p: payee_exp_map[p] = payee_exp_map.get(p, 0.0) + expense_val
-
-    # 리스트 형태로 매핑 및 정렬 (금액이 높은 순서대로)
-    category_expenses = [{"name": k, "amount": v} for k, v in cat_exp_map.items()]
-    category_expenses.sort(key=lambda x: x["amount"], reverse=True)
-    
-    payee_expenses = [{"name": k, "amount": v} for k, v in payee_exp_map.items()]
-    payee_expenses.sort(key=lambda x: x["amount"], reverse=True)
-    
-    return {
-        "totalRevenue": total_revenue,
-        "totalExpense": total_expense,
-        "netProfit": total_revenue - total_expense,
-        "balance": current_cash,
-        "salesBreakdown": sales_breakdown,
-        "categoryExpenses": category_expenses,
-        "payeeExpenses": payee_expenses,
-        "lifetimeStats": lifetime_stats
-    }
+async def get_dashboard(request: Request, response: Response, month: Optional[str] = None):
+    try:
+        return cached_response(request, response, await engine.get_dashboard_summary.entry(engine, month))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
 # --- [모델 정의] ---
 
@@ -190,6 +119,23 @@ class TransactionUpdate(BaseModel):
     expense: Optional[float] = None
     description: Optional[str] = None
 
+# 일괄 수정용 (id + 변경할 필드)
+class TransactionPatch(TransactionUpdate):
+    id: int
+
+class TransactionPatchBatch(BaseModel):
+    patches: List[TransactionPatch]
+
+# 그리드 일괄 편집용: 여러 테이블/행의 셀 변경을 한 번에
+class CellEdit(BaseModel):
+    table: str
+    key: Union[int, str]
+    field: str
+    value: Any = None
+
+class BulkEdit(BaseModel):
+    changes: List[CellEdit]
+
 # 매출 기록 업데이트용 (신규)
 class SalesUpdate(BaseModel):
     date: str
@@ -207,6 +153,24 @@ class CashUpdate(BaseModel):
     field: str
     value: Any
 
+# 자동 분류 규칙
+class CategoryRuleCreate(BaseModel):
+    pattern: str
+    kind: str = "keyword"
+    category: Optional[str] = ""
+    payee: Optional[str] = ""
+    payee_note: Optional[str] = ""
+    min_amount: Optional[float] = None
+    max_amount: Optional[float] = None
+    priority: int = 100
+
+class CategoryRuleApply(BaseModel):
+    overwrite: bool = False
+
+# 대사 / 매칭 재실행 (rebuild: 기존 매칭을 버리고 처음부터)
+class ReconcileRequest(BaseModel):
+    rebuild: bool = False
+
 class TransactionCreate(BaseModel):
     date: Optional[str] = None
     description: Optional[str] = None
@@ -221,61 +185,113 @@ def read_root():
 
 # --- [CSV 업로드 및 조회] ---
 
-@app.post("/upload")
+@app.post("/upload", status_code=202)
 async def upload_file(file: UploadFile = File(...), target_tab: Optional[str] = Form(None)):
-    content = await file.read()
-    result = engine.process_csv(content, file.filename, target_tab)
-    if result.get("status") == "error":
+    """Queues the CSV as an import job; poll GET /upload/{job_id} for its progress and result."""
+    try:
+        # Copied off the spooled upload in blocks; the CSV is never read into memory whole
+        job_id = await engine.submit_import(file.file, file.filename, target_tab)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"status": "queued", "job_id": job_id, "message": f"{file.filename} queued for import"}
+
+@app.post("/upload/preview")
+def preview_upload(file: UploadFile = File(...), target_tab: Optional[str] = Form(None)):
+    """Parses the CSV and reports which rows are new, without importing anything."""
+    result = engine.process_csv(file.file, file.filename, target_tab, dry_run=True)
+    if result["status"] == "error":
         raise HTTPException(status_code=400, detail=result["message"])
     return result
 
+@app.get("/upload/{job_id}")
+async def get_upload_job(job_id: int):
+    """
+    status: queued | running | done | error, with row counts and the importer's message.
+    A job no worker is running (still queued, or gone quiet) is imported by this request.
+    """
+    job = await engine.get_import_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    if job["status"] in ("queued", "running"):
+        await engine.advance_import_job(job_id)
+        job = await engine.get_import_job(job_id)
+    return job
+
+def list_params(limit: Optional[int] = None, cursor: Optional[str] = None,
+                date_from: Optional[str] = None, date_to: Optional[str] = None,
+                category: Optional[str] = None, payee: Optional[str] = None,
+                source: Optional[str] = None, q: Optional[str] = None,
+                include_total: bool = False):
+    """Pagination/filter query params; an empty dict means the legacy full-table response."""
+    params = {
+        "limit": limit, "cursor": cursor, "date_from": date_from, "date_to": date_to,
+        "category": category, "payee": payee, "source": source, "q": q,
+        "include_total": include_total,
+    }
+    return {k: v for k, v in params.items() if v not in (None, False)}
+
+STREAM_PAGE_KEYS = ("limit", "cursor", "include_total")
+
+def _json_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, Decimal):
+        return float(value)
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
+
+def stream_rows(table: str, params: dict, fmt: str, wrap: bool = True):
+    """
+    StreamingResponse over every matching row (pagination params are ignored).
+    fmt="ndjson": one JSON object per line. fmt="json": the same body the non-streaming endpoint returns.
+    """
+    if fmt not in ("ndjson", "json"):
+        raise HTTPException(status_code=400, detail="stream must be 'ndjson' or 'json'")
+    filters = {k: v for k, v in params.items() if k not in STREAM_PAGE_KEYS}
+    try:
+        rows = engine.iter_records(table, **filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def body():
+        count = 0
+        buffer = []
+        if fmt == "json":
+            yield b'{"data": [' if wrap else b'['
+        async for row in rows:
+            row = {k: _json_value(v) for k, v in row.items()}
+            encoded = json.dumps(row)
+            if fmt == "json" and count:
+                encoded = "," + encoded
+            buffer.append(encoded + "\n" if fmt == "ndjson" else encoded)
+            count += 1
+            if len(buffer) >= 500:
+                yield "".join(buffer).encode()
+                buffer = []
+        if buffer:
+            yield "".join(buffer).encode()
+        if fmt == "json":
+            yield f'], "count": {count}}}'.encode() if wrap else b']'
+
+    media_type = "application/x-ndjson" if fmt == "ndjson" else "application/json"
+    return StreamingResponse(body(), media_type=media_type)
+
+async def list_page(request: Request, response: Response, table: str, params: dict):
+    try:
+        return cached_response(request, response, await engine.list_records.entry(engine, table, **params))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.get("/transactions")
-def get_transactions():
-    data = engine.get_all_transactions()
-    sales = engine.get_sales_records()
-    
-    # 날짜별로 Sales Record의 현금(Cash + Cash Tips) 합계 맵 생성
-    sales_cash_map = {}
-    for s in sales:
-        date = s.get('date')
-        val = float(s.get('cash') or 0) + float(s.get('cash_tips') or 0)
-        if date and val > 0:
-            sales_cash_map[date] = val
-            
-    # 해당 날짜에 System 자동 생성된 Cash Sales 전용 행이 있는지 확인
-    existing_cash_sale_dates = set(t.get('date', '') for t in data if t.get('type') == 'Cash Sales' and t.get('account_source') == 'System')
-    missing_dates = set(sales_cash_map.keys()) - existing_cash_sale_dates
-    has_inserted = False
-    
-    for d in missing_dates:
-        entry = {
-            'date': d,
-            'type': 'Cash Sales',
-            'desc': 'Daily Cash Income Record',
-            'income': 0,
-            'expense': 0,
-            'balance': 0,
-            'source': 'System'
-        }
-        engine._save_row(entry, table_name="transactions")
-        has_inserted = True
-        
-    # 만약 새로 추가된 행이 있다면 데이터를 다시 가져옵니다
-    if has_inserted:
-        data = engine.get_all_transactions()
-        
-    # Cash Sales 전용 행에만 cash_income 값을 바인딩하도록 강제 (중복 겹침 방지)
-    for t in data:
-        t_date = t.get('date')
-        if t.get('type') == 'Cash Sales' and t.get('account_source') == 'System':
-            t['cash_income'] = sales_cash_map.get(t_date, 0.0)
-            t['description'] = 'Daily Cash Income Record'
-        else:
-            t['cash_income'] = 0.0
-            
-        t['cash_expense'] = float(t.get('cash_amount') or 0)
-        
-    return {"count": len(data), "data": data}
+async def get_transactions(request: Request, response: Response,
+                           params: dict = Depends(list_params), stream: Optional[str] = None):
+    # cash_income / cash_expense and the System Cash Sales description come from the query
+    if stream:
+        return stream_rows("transactions", params, stream)
+    if params:
+        return await list_page(request, response, "transactions", params)
+    return cached_response(request, response, await engine.get_all_transactions.entry(engine), with_count)
 
 @app.post("/transactions")
 def add_transaction(req: TransactionCreate):
@@ -300,20 +316,27 @@ def delete_transaction(transaction_id: int):
     raise HTTPException(status_code=500, detail="Failed to delete transaction")
 
 @app.get("/invoices")
-def get_invoices():
-    data = engine.get_all_invoices()
-    return {"count": len(data), "data": data}
+async def get_invoices(request: Request, response: Response,
+                       params: dict = Depends(list_params), stream: Optional[str] = None):
+    if stream:
+        return stream_rows("invoice_items", params, stream)
+    if params:
+        return await list_page(request, response, "invoice_items", params)
+    return cached_response(request, response, await engine.get_all_invoices.entry(engine), with_count)
 
 @app.get("/credit-cards")
-def get_credit_cards():
-    data = engine.get_all_credit_cards()
-    return {"count": len(data), "data": data}
+async def get_credit_cards(request: Request, response: Response,
+                           params: dict = Depends(list_params), stream: Optional[str] = None):
+    if stream:
+        return stream_rows("credit_card_records", params, stream)
+    if params:
+        return await list_page(request, response, "credit_card_records", params)
+    return cached_response(request, response, await engine.get_all_credit_cards.entry(engine), with_count)
 
 # --- [카테고리 및 지급처 (Categories & Payees)] ---
 @app.get("/categories")
-def get_categories():
-    data = engine.get_categories()
-    return {"data": data}
+async def get_categories(request: Request, response: Response):
+    return cached_response(request, response, await engine.get_categories.entry(engine), lambda data: {"data": data})
 
 @app.post("/categories")
 def add_category(cat: CategoryCreate):
@@ -329,9 +352,8 @@ def delete_category(category_id: int):
     raise HTTPException(status_code=400, detail="Failed to delete category")
 
 @app.get("/payees")
-def get_payees():
-    data = engine.get_payees()
-    return {"data": data}
+async def get_payees(request: Request, response: Response):
+    return cached_response(request, response, await engine.get_payees.entry(engine), lambda data: {"data": data})
 
 @app.post("/payees")
 def add_payee(payee: PayeeCreate):
@@ -346,79 +368,159 @@ def delete_payee(payee_id: int):
         return {"status": "success"}
     raise HTTPException(status_code=400, detail="Failed to delete payee")
 
-# --- [장부 업데이트 로직] ---
+# --- [자동 분류 규칙 (Categorization Rules)] ---
+@app.get("/rules")
+async def get_category_rules(request: Request, response: Response):
+    return cached_response(request, response, await engine.get_category_rules.entry(engine), lambda data: {"data": data})
 
-@app.put("/transactions/{transaction_id}")
-def update_transaction(transaction_id: int, update: TransactionUpdate):
-    conn = engine.get_conn()
-    cursor = conn.cursor()
-    
+@app.post("/rules")
+def add_category_rule(rule: CategoryRuleCreate):
     try:
-        if update.date is not None:
-            cursor.execute("UPDATE transactions SET date = %s WHERE id = %s", (update.date, transaction_id))
+        return {"status": "success", "data": engine.add_category_rule(rule.model_dump())}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        if update.category is not None:
-            cursor.execute("UPDATE transactions SET category = %s WHERE id = %s", (update.category, transaction_id))
-        
-        if update.payee is not None:
-            cursor.execute("UPDATE transactions SET payee = %s WHERE id = %s", (update.payee, transaction_id))
+@app.delete("/rules/{rule_id}")
+def delete_category_rule(rule_id: int):
+    if engine.delete_category_rule(rule_id):
+        return {"status": "success"}
+    raise HTTPException(status_code=400, detail="Failed to delete rule")
 
-        if update.payee_note is not None:
-            cursor.execute("UPDATE transactions SET payee_note = %s WHERE id = %s", (update.payee_note, transaction_id))
+@app.post("/rules/learn")
+def learn_category_rules():
+    """Rebuilds the learned rules from the categories / payees already assigned."""
+    try:
+        return {"status": "success", "learned": engine.learn_category_rules()}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        if update.cash_amount is not None:
-            cursor.execute("UPDATE transactions SET cash_amount = %s WHERE id = %s", (update.cash_amount, transaction_id))
-            
-        if update.income is not None:
-            cursor.execute("UPDATE transactions SET income = %s WHERE id = %s", (update.income, transaction_id))
+@app.post("/rules/apply")
+def apply_category_rules(req: CategoryRuleApply):
+    """Re-applies the rules to existing Ledger and Credit Card rows (blank cells only unless overwrite)."""
+    try:
+        return {"status": "success", "updated": engine.apply_category_rules(req.overwrite)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        if update.expense is not None:
-            cursor.execute("UPDATE transactions SET expense = %s WHERE id = %s", (update.expense, transaction_id))
+# --- [카드 대금 대사 (Bank-to-card reconciliation)] ---
+@app.get("/reconciliation")
+async def get_reconciliation(request: Request, response: Response):
+    """Matched bank card payments with their card statement credits, and the payments still unmatched."""
+    return cached_response(request, response, await engine.get_card_reconciliation.entry(engine))
 
-        if update.description is not None:
-            cursor.execute("UPDATE transactions SET description = %s WHERE id = %s", (update.description, transaction_id))
+@app.post("/reconcile")
+def reconcile_card_payments(req: ReconcileRequest):
+    """Matches new card payments (rebuild: discard the existing matches first)."""
+    try:
+        return {"status": "success", "matched": engine.reconcile_card_payments(req.rebuild)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# --- [인보이스-장부 매칭 (US Foods invoices vs. bank debits)] ---
+@app.get("/invoice-matches")
+async def get_invoice_matches(request: Request, response: Response):
+    """Invoices (lines totalled per date and vendor) paired with the bank debit that paid them."""
+    return cached_response(request, response, await engine.get_invoice_matches.entry(engine), with_count)
+
+@app.get("/invoice-matches/unmatched")
+async def get_unmatched_invoices(request: Request, response: Response):
+    """Invoices without a matching debit, and vendor debits without a matching invoice."""
+    return cached_response(request, response, await engine.get_unmatched_invoices.entry(engine))
 
-        conn.commit()
-        return {"status": "success", "message": "Updated successfully"}
+@app.post("/invoice-matches/run")
+def match_invoices(req: ReconcileRequest):
+    try:
+        return {"status": "success", "matched": engine.match_invoices(req.rebuild)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        cursor.close()
-        conn.close()
 
-@app.put("/credit-cards/{transaction_id}")
-def update_credit_card(transaction_id: int, update: TransactionUpdate):
-    conn = engine.get_conn()
-    cursor = conn.cursor()
-    
+# --- [품목 단가 이력 (Product price history)] ---
+async def price_report(request: Request, response: Response, report: str, arg):
+    return cached_response(request, response, await engine.get_price_report.entry(engine, report, arg), with_count)
+
+@app.get("/products/cost-drivers")
+async def get_cost_drivers(request: Request, response: Response, limit: int = 20):
+    """Products by lifetime invoice spend."""
+    return await price_report(request, response, "cost-drivers", max(1, min(limit, 1000)))
+
+@app.get("/products/price-jumps")
+async def get_price_jumps(request: Request, response: Response, limit: int = 20):
+    """Products whose unit price rose since their previous order, largest % increase first."""
+    return await price_report(request, response, "price-jumps", max(1, min(limit, 1000)))
+
+@app.get("/products/{product_code}/history")
+async def get_product_history(request: Request, response: Response, product_code: str):
+    return await price_report(request, response, "history", product_code)
+
+@app.get("/vendors/spend")
+async def get_vendor_spend(request: Request, response: Response, period: str = "month"):
+    if period not in ("week", "month"):
+        raise HTTPException(status_code=400, detail="period must be 'week' or 'month'")
+    return await price_report(request, response, "vendor-spend", period)
+
+# --- [통합 검색 (Search across ledgers)] ---
+@app.get("/search")
+async def search_records(request: Request, response: Response, q: str = "", limit: int = 50,
+                         date_from: Optional[str] = None, date_to: Optional[str] = None,
+                         min_amount: Optional[float] = None, max_amount: Optional[float] = None):
+    """
+    Ranked matches (exact and fuzzy) in bank and card descriptions, payees, payee notes, invoice
+    product names and cash descriptions. `highlights` are [start, end) spans of each hit's `text`.
+    """
     try:
-        if update.category is not None:
-            cursor.execute("UPDATE credit_card_records SET category = %s WHERE id = %s", (update.category, transaction_id))
-        
-        if update.payee is not None:
-            cursor.execute("UPDATE credit_card_records SET payee = %s WHERE id = %s", (update.payee, transaction_id))
+        q, limit, date_from, date_to = search.validate(q, limit, date_from, date_to)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    entry = await engine.search_records.entry(engine, q, limit, date_from, date_to, min_amount, max_amount)
+    return cached_response(request, response, entry, with_count)
 
-        if update.payee_note is not None:
-            cursor.execute("UPDATE credit_card_records SET payee_note = %s WHERE id = %s", (update.payee_note, transaction_id))
+# --- [장부 업데이트 로직] ---
 
-        if update.cash_amount is not None:
-            cursor.execute("UPDATE credit_card_records SET cash_amount = %s WHERE id = %s", (update.cash_amount, transaction_id))
-            
-        conn.commit()
-        return {"status": "success", "message": "Updated successfully"}
+def apply_patches(table: str, patches: list):
+    try:
+        # Only the fields the client sent: an explicit null clears the cell
+        return engine.patch_records(table, [p.model_dump(exclude_unset=True) for p in patches])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        cursor.close()
-        conn.close()
+
+@app.put("/transactions/{transaction_id}")
+def update_transaction(transaction_id: int, update: TransactionUpdate):
+    rows = apply_patches("transactions", [TransactionPatch(id=transaction_id, **update.model_dump(exclude_unset=True))])
+    return {"status": "success", "message": "Updated successfully", "data": rows[0] if rows else None}
+
+@app.patch("/transactions")
+def patch_transactions(batch: TransactionPatchBatch):
+    """여러 행을 한 번에 수정 (예: 일괄 카테고리 변경)."""
+    rows = apply_patches("transactions", batch.patches)
+    return {"status": "success", "count": len(rows), "data": rows}
+
+@app.put("/credit-cards/{transaction_id}")
+def update_credit_card(transaction_id: int, update: TransactionUpdate):
+    # Only category / payee / payee_note / cash_amount are editable on card rows
+    fields = update.model_dump(include={"category", "payee", "payee_note", "cash_amount"}, exclude_unset=True)
+    rows = apply_patches("credit_card_records", [TransactionPatch(id=transaction_id, **fields)])
+    return {"status": "success", "message": "Updated successfully", "data": rows[0] if rows else None}
+
+@app.patch("/credit-cards")
+def patch_credit_cards(batch: TransactionPatchBatch):
+    rows = apply_patches("credit_card_records", batch.patches)
+    return {"status": "success", "count": len(rows), "data": rows}
 
 # --- [💰 Sales Record 엔드포인트 신규 추가] ---
 
 @app.get("/sales")
-def get_sales():
-    """매출 기록 목록을 가져옵니다."""
-    data = engine.get_sales_records()
-    return data
+async def get_sales(request: Request, response: Response,
+                    params: dict = Depends(list_params), stream: Optional[str] = None):
+    """매출 기록 목록을 가져옵니다. (limit/cursor를 주면 페이지 단위 응답)"""
+    if stream:
+        return stream_rows("sales_records", params, stream, wrap=False)
+    if params:
+        return await list_page(request, response, "sales_records", params)
+    return cached_response(request, response, await engine.get_sales_records.entry(engine))
 
 # backend/main.py 하단에 추가
 
@@ -433,18 +535,36 @@ def delete_sales(date: str):
 @app.post("/update-sales")
 def update_sales(update: SalesUpdate):
     """매일의 매출 수치를 저장하거나 수정합니다."""
-    success = engine.update_sales_record(update.date, update.field, update.value)
+    try:
+        success = engine.update_sales_record(update.date, update.field, update.value)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     if success:
         return {"status": "success"}
     else:
         raise HTTPException(status_code=500, detail="Sales record update failed")
 
+@app.post("/bulk-edit")
+def bulk_edit(batch: BulkEdit):
+    """Sales / Cash / Ledger 셀 변경을 한 트랜잭션으로 저장하고 변경된 행만 돌려줍니다."""
+    try:
+        data = engine.apply_edits([c.model_dump() for c in batch.changes])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"status": "success", "data": data}
+
 # --- [💵 Cash Record 엔드포인트 신규 추가] ---
 
 @app.get("/cash")
-def get_cash_records():
-    data = engine.get_all_cash_records()
-    return {"count": len(data), "data": data}
+async def get_cash_records(request: Request, response: Response,
+                           params: dict = Depends(list_params), stream: Optional[str] = None):
+    if stream:
+        return stream_rows("cash_records", params, stream)
+    if params:
+        return await list_page(request, response, "cash_records", params)
+    return cached_response(request, response, await engine.get_all_cash_records.entry(engine), with_count)
 
 @app.post("/cash")
 def add_cash_record():
@@ -469,12 +589,25 @@ def delete_cash_record(record_id: int):
         return {"status": "success"}
     raise HTTPException(status_code=500, detail="Failed to delete cash record")
 
+@app.get("/stats")
+def get_stats():
+    """Connection pool and response cache counters."""
+    return {"pool": engine.pool.stats(), "cache": engine.cache.stats()}
+
+@app.post("/rollups/rebuild")
+def rebuild_rollups():
+    months = engine.rebuild_monthly_rollups()
+    return {"status": "success", "months": months}
+
 # --- Vercel Serverless specific routing ---
 # Since Vercel passes the raw "/api/..." path to the ASGI application,
 # we need to mount our main API to "/api" so it correctly responds to Next.js routes.
 _core_app = app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 app.mount("/api", _core_app)
 
 if __name__ == "__main__":
+    import uvicorn
+    # Local dev server: bootstrap the schema on start (the reloader's worker inherits this)
+    os.environ.setdefault("SCHEMA_BOOTSTRAP_ON_START", "1")
     uvicorn.run("main:_core_app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
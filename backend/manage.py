@@ -0,0 +1,58 @@
+# backend/manage.py
+# Maintenance commands: python backend/manage.py <command>
+import argparse
+import os
+import sys
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(current_dir)
+
+from finance_engine import ExpenseEngine
+
+
+def migrate(args):
+    applied = ExpenseEngine().create_tables()
+    print(f"Schema ready; applied migrations: {applied or 'none'}")
+
+
+def rebuild_rollups(args):
+    months = ExpenseEngine().rebuild_monthly_rollups()
+    print(f"Rebuilt monthly rollups for {months} months")
+
+
+def rebuild_price_history(args):
+    products = ExpenseEngine().rebuild_price_history()
+    print(f"Rebuilt price history for {products} products")
+
+
+def import_worker(args):
+    engine = ExpenseEngine()
+    print("Import worker running (Ctrl+C to stop)")
+    while True:
+        ran = engine.run_pending_imports()
+        if ran:
+            print(f"Processed {ran} import job(s)")
+        if args.once:
+            return
+        time.sleep(args.interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Collegiate Grill ERP maintenance commands")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("migrate", help="Create tables, seed options and apply pending migrations").set_defaults(func=migrate)
+    sub.add_parser("rebuild-rollups", help="Recompute the dashboard monthly rollup tables").set_defaults(func=rebuild_rollups)
+    sub.add_parser("rebuild-price-history", help="Recompute the product price history tables").set_defaults(func=rebuild_price_history)
+    worker = sub.add_parser("import-worker", help="Process queued CSV import jobs")
+    worker.add_argument("--interval", type=float, default=2.0, help="Seconds between polls of the jobs table")
+    worker.add_argument("--once", action="store_true", help="Drain the queue once and exit")
+    worker.set_defaults(func=import_worker)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
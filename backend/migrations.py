@@ -0,0 +1,232 @@
+"""
+Versioned schema migrations.
+
+Each migration runs once, in order, inside the caller's transaction and is
+recorded in schema_migrations. Migrations must be safe on a database created
+fresh by ExpenseEngine.create_tables (which already uses the current types).
+"""
+import categorize
+import invoice_match
+import price_history
+import search
+import reconcile
+import rollups
+
+MONEY = "NUMERIC(12,2)"
+
+# Target types for columns that were originally created as TEXT / REAL
+TYPED_COLUMNS = {
+    "transactions": {
+        "date": "DATE",
+        "cash_amount": MONEY, "income": MONEY, "expense": MONEY,
+        "net_amount": MONEY, "bank_balance": MONEY,
+    },
+    "credit_card_records": {
+        "date": "DATE",
+        "cash_amount": MONEY, "income": MONEY, "expense": MONEY,
+        "net_amount": MONEY, "bank_balance": MONEY,
+    },
+    "invoice_items": {
+        "date": "DATE",
+        "quantity": "NUMERIC(12,3)", "unit_price": "NUMERIC(12,4)", "total_price": MONEY,
+    },
+    "sales_records": {
+        "date": "DATE",
+        "cash": MONEY, "debit": MONEY, "credit": MONEY, "svc": MONEY, "tips": MONEY,
+        "tax": MONEY, "cash_tips": MONEY, "doordash": MONEY, "stripe": MONEY, "total": MONEY,
+    },
+    "cash_records": {
+        "date": "DATE",
+        "income": MONEY, "expense": MONEY, "balance": MONEY,
+    },
+}
+
+INDEXES = {
+    "transactions": ["date, id", "category", "payee", "account_source"],
+    "credit_card_records": ["date, id", "category", "payee", "account_source"],
+    "cash_records": ["date, id", "category", "payee"],
+    "invoice_items": ["date, id"],
+}
+
+
+def _convert_column_types(cursor):
+    cursor.execute('''
+        SELECT table_name, column_name, data_type
+        FROM information_schema.columns
+        WHERE table_schema = current_schema()
+    ''')
+    current = {(table, column): data_type for table, column, data_type in cursor.fetchall()}
+
+    for table, columns in TYPED_COLUMNS.items():
+        alters = []
+        for column, target in columns.items():
+            if current.get((table, column)) not in ("text", "real", "double precision"):
+                continue
+            if target == "DATE":
+                # Fails (and rolls back) on a date string Postgres cannot read instead of dropping it
+                using = f"NULLIF(TRIM({column}), '')::date"
+            else:
+                scale = target.rstrip(")").split(",")[1]
+                using = f"ROUND({column}::numeric, {scale})"
+            alters.append(f"ALTER COLUMN {column} TYPE {target} USING {using}")
+        if alters:
+            cursor.execute(f"ALTER TABLE {table} {', '.join(alters)}")
+
+    # The rollups are derived data: recreate them with NUMERIC columns, they are backfilled on boot
+    cursor.execute("DROP TABLE IF EXISTS monthly_totals, monthly_expense_breakdown")
+    rollups.create_rollup_tables(cursor)
+    rollups.rebuild(cursor)
+
+
+def _create_ledger_indexes(cursor):
+    for table, index_columns in INDEXES.items():
+        for columns in index_columns:
+            name = f"idx_{table}_{columns.replace(', ', '_')}"
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+
+
+def _backfill_cash_sales_rows(cursor):
+    # GET /transactions used to create these on read; now the sales write paths do
+    rollups.sync_cash_sales_rows(cursor)
+
+
+def _create_import_jobs(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS import_jobs (
+            id SERIAL PRIMARY KEY,
+            filename TEXT,
+            target_tab TEXT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            rows_processed INTEGER DEFAULT 0,
+            inserted INTEGER DEFAULT 0,
+            skipped INTEGER DEFAULT 0,
+            message TEXT,
+            error TEXT,
+            attempts INTEGER DEFAULT 0,
+            created_at TIMESTAMPTZ DEFAULT NOW(),
+            started_at TIMESTAMPTZ,
+            heartbeat_at TIMESTAMPTZ,
+            finished_at TIMESTAMPTZ
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_import_jobs_pending ON import_jobs (id) WHERE status IN ('queued', 'running')")
+    # The upload waits here in blocks, so a worker on any instance or host can import it
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS import_job_chunks (
+            job_id INTEGER REFERENCES import_jobs(id) ON DELETE CASCADE,
+            seq INTEGER,
+            data BYTEA NOT NULL,
+            PRIMARY KEY (job_id, seq)
+        )
+    ''')
+
+
+# Normalized key fields per imported table, as statement_formats.row_hashes builds them
+ROW_HASH_KEYS = {
+    "transactions": [
+        "COALESCE(account_source, '')", "COALESCE(to_char(date, 'YYYY-MM-DD'), '')",
+        r"upper(btrim(regexp_replace(COALESCE(description, ''), '\s+', ' ', 'g')))",
+        "(COALESCE(income, 0) * 100)::bigint", "(COALESCE(expense, 0) * 100)::bigint",
+    ],
+    "invoice_items": [
+        "COALESCE(vendor, '')", "COALESCE(to_char(date, 'YYYY-MM-DD'), '')", "COALESCE(product_code, '')",
+        "(COALESCE(total_price, 0) * 100)::bigint",
+    ],
+}
+ROW_HASH_KEYS["credit_card_records"] = ROW_HASH_KEYS["transactions"]
+
+
+def _hash_rows(cursor, table):
+    # Imported rows get their row_hash computed here; Manual and System rows keep only their text key
+    imported = "" if table == "invoice_items" else "WHERE COALESCE(account_source, '') NOT IN ('Manual', 'System')"
+    cursor.execute(f'''
+        WITH keyed AS (
+            SELECT id, concat_ws('|', {", ".join(ROW_HASH_KEYS[table])}) AS key FROM {table} {imported}
+        ), numbered AS (
+            SELECT id, key || '|' || (ROW_NUMBER() OVER (PARTITION BY key ORDER BY id) - 1) AS key FROM keyed
+        )
+        UPDATE {table} t SET row_hash = ('x' || left(md5(n.key), 16))::bit(64)::bigint
+        FROM numbered n WHERE t.id = n.id
+    ''')
+
+
+def _normalize_product_codes(cursor):
+    # Stored product numbers took whatever form pandas inferred ('123', '123.0', 'nan'): rewrite
+    # them as statement_formats.product_codes() reads them, so their keys match a re-import
+    cursor.execute("UPDATE invoice_items SET product_code = NULL WHERE btrim(product_code) IN ('', 'nan')")
+    cursor.execute(r'''
+        UPDATE invoice_items
+        SET product_code = COALESCE(NULLIF(ltrim(substring(btrim(product_code) from '^(\d+)'), '0'), ''), '0')
+        WHERE btrim(product_code) ~ '^\d+(\.0+)?$'
+    ''')
+    cursor.execute("UPDATE invoice_items SET product_code = btrim(product_code) WHERE product_code <> btrim(product_code)")
+
+
+def _add_row_hashes(cursor):
+    # Imports deduplicate on a BIGINT row_hash instead of the is_duplicate_check text
+    _normalize_product_codes(cursor)
+    for table in ROW_HASH_KEYS:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS row_hash BIGINT")
+        _hash_rows(cursor, table)
+        cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{table}_row_hash ON {table} (row_hash)")
+
+
+def _reconcile_card_payments(cursor):
+    # The rollups gained card_expense / ledger_transfer: recreate them, then match the history
+    reconcile.create_matches_table(cursor)
+    cursor.execute("DROP TABLE IF EXISTS monthly_totals, monthly_expense_breakdown")
+    rollups.create_rollup_tables(cursor)
+    rollups.rebuild(cursor)
+    reconcile.reconcile(cursor)
+
+
+def _match_invoices(cursor):
+    invoice_match.create_matches_table(cursor)
+    invoice_match.match_invoices(cursor)
+
+
+def _build_price_history(cursor):
+    price_history.create_tables(cursor)
+    price_history.rebuild(cursor)
+
+
+MIGRATIONS = [
+    (1, "date_and_numeric_columns", _convert_column_types),
+    (2, "ledger_indexes", _create_ledger_indexes),
+    (3, "cash_sales_rows", _backfill_cash_sales_rows),
+    (4, "import_jobs", _create_import_jobs),
+    (5, "row_hash_keys", _add_row_hashes),
+    (6, "category_rules", categorize.create_rules_table),
+    (7, "card_payment_reconciliation", _reconcile_card_payments),
+    (8, "invoice_ledger_matches", _match_invoices),
+    (9, "price_history", _build_price_history),
+    (10, "search_indexes", search.create_indexes),
+]
+
+
+def migrate(cursor):
+    """
+    Apply pending migrations; returns the list of versions applied. A migration that returns
+    False could not be applied on this server yet: it is not recorded and runs again next time.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT,
+            applied_at TIMESTAMPTZ DEFAULT NOW()
+        )
+    ''')
+    # Two cold starts booting at once must not run the same migration twice
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext('schema_migrations'))")
+    cursor.execute("SELECT version FROM schema_migrations")
+    done = {row[0] for row in cursor.fetchall()}
+
+    applied = []
+    for version, name, func in MIGRATIONS:
+        if version in done:
+            continue
+        if func(cursor) is False:
+            continue
+        cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+        applied.append(version)
+    return applied
@@ -0,0 +1,171 @@
+"""
+Product price history over invoice_items.
+
+product_prices holds one row per product, delivery date and vendor: quantity and
+spend summed, unit price averaged over that day's lines. product_latest holds one
+row per product with its last two prices and lifetime spend, so "top cost drivers"
+and "price jumps since the last order" are index reads. vendor_spend holds spend
+per vendor per week and per month.
+
+The invoice import calls refresh() in its own transaction with the rows it inserted,
+which recomputes only the products and periods those rows touched.
+"""
+from datetime import timedelta
+
+PERIOD_KINDS = ("week", "month")
+
+# Reads behind the /products and /vendors endpoints; each takes one parameter
+REPORTS = {
+    "cost-drivers": "SELECT * FROM product_latest ORDER BY total_spend DESC, product_code LIMIT %s",
+    "price-jumps": '''
+        SELECT * FROM product_latest WHERE price_change > 0
+        ORDER BY change_pct DESC NULLS LAST, product_code LIMIT %s
+    ''',
+    "history": "SELECT * FROM product_prices WHERE product_code = %s ORDER BY date, vendor",
+    "vendor-spend": "SELECT * FROM vendor_spend WHERE period_kind = %s ORDER BY period_start DESC, vendor",
+}
+
+TABLES = ("invoice_items", "product_prices")
+
+
+def create_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS product_prices (
+            product_code TEXT,
+            date DATE,
+            vendor TEXT,
+            product_name TEXT,
+            unit TEXT,
+            quantity NUMERIC(14,3) DEFAULT 0,
+            unit_price NUMERIC(12,4),
+            total NUMERIC(14,2) DEFAULT 0,
+            PRIMARY KEY (product_code, date, vendor)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS product_latest (
+            product_code TEXT PRIMARY KEY,
+            vendor TEXT,
+            product_name TEXT,
+            unit TEXT,
+            last_date DATE,
+            last_price NUMERIC(12,4),
+            prev_date DATE,
+            prev_price NUMERIC(12,4),
+            price_change NUMERIC(12,4),
+            change_pct NUMERIC(10,2),
+            total_spend NUMERIC(14,2) DEFAULT 0,
+            total_quantity NUMERIC(14,3) DEFAULT 0,
+            orders INTEGER DEFAULT 0
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_product_latest_total_spend ON product_latest (total_spend DESC)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_product_latest_change_pct ON product_latest (change_pct DESC) WHERE price_change > 0")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS vendor_spend (
+            vendor TEXT,
+            period_kind TEXT,
+            period_start DATE,
+            amount NUMERIC(14,2) DEFAULT 0,
+            line_count INTEGER DEFAULT 0,
+            PRIMARY KEY (period_kind, period_start, vendor)
+        )
+    ''')
+
+
+def _recompute_products(cursor, codes=None):
+    where, params = "", {}
+    if codes is not None:
+        where, params = "AND product_code = ANY(%(codes)s)", {"codes": codes}
+    cursor.execute(f'''
+        INSERT INTO product_prices (product_code, date, vendor, product_name, unit, quantity, unit_price, total)
+        SELECT product_code, date, COALESCE(vendor, ''), MAX(product_name), MAX(unit),
+               SUM(COALESCE(quantity, 0)), AVG(unit_price), SUM(COALESCE(total_price, 0))
+        FROM invoice_items
+        WHERE date IS NOT NULL AND product_code IS NOT NULL {where}
+        GROUP BY product_code, date, COALESCE(vendor, '')
+    ''', params)
+    cursor.execute(f'''
+        WITH ranked AS (
+            SELECT p.*,
+                   ROW_NUMBER() OVER (PARTITION BY product_code ORDER BY date DESC, vendor) AS rn,
+                   SUM(total) OVER (PARTITION BY product_code) AS total_spend,
+                   SUM(quantity) OVER (PARTITION BY product_code) AS total_quantity,
+                   COUNT(*) OVER (PARTITION BY product_code) AS orders
+            FROM product_prices p
+            WHERE TRUE {where}
+        )
+        INSERT INTO product_latest (
+            product_code, vendor, product_name, unit, last_date, last_price, prev_date, prev_price,
+            price_change, change_pct, total_spend, total_quantity, orders
+        )
+        SELECT l.product_code, l.vendor, l.product_name, l.unit, l.date, l.unit_price, p.date, p.unit_price,
+               l.unit_price - p.unit_price,
+               CASE WHEN p.unit_price > 0 THEN ROUND((l.unit_price - p.unit_price) / p.unit_price * 100, 2) END,
+               l.total_spend, l.total_quantity, l.orders
+        FROM ranked l
+        LEFT JOIN ranked p ON p.product_code = l.product_code AND p.rn = 2
+        WHERE l.rn = 1
+    ''', params)
+
+
+def _periods(dates):
+    weeks = sorted({d - timedelta(days=d.weekday()) for d in dates})
+    months = sorted({d.replace(day=1) for d in dates})
+    return weeks, months
+
+
+def _recompute_vendor_spend(cursor, dates=None):
+    where, params = "", {}
+    if dates is not None:
+        weeks, months = _periods(dates)
+        last_month = months[-1]
+        end = max(weeks[-1] + timedelta(days=7), (last_month + timedelta(days=32)).replace(day=1))
+        # The outer bounds keep the scan on the date index; the period lists pick the exact periods
+        where = "AND date >= %(start)s AND date < %(end)s"
+        params = {"weeks": weeks, "months": months, "start": min(weeks[0], months[0]), "end": end}
+    for kind in PERIOD_KINDS:
+        in_periods = f"AND date_trunc('{kind}', date)::date = ANY(%({kind}s)s::date[])" if dates is not None else ""
+        cursor.execute(f'''
+            INSERT INTO vendor_spend (vendor, period_kind, period_start, amount, line_count)
+            SELECT COALESCE(vendor, ''), '{kind}', date_trunc('{kind}', date)::date,
+                   SUM(COALESCE(total_price, 0)), COUNT(*)
+            FROM invoice_items
+            WHERE date IS NOT NULL {where} {in_periods}
+            GROUP BY 1, 3
+        ''', params)
+
+
+def _lock(cursor):
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext('price_history'))")
+
+
+def refresh(cursor, rows):
+    """Recompute the history of the products and periods of `rows` ((product_code, date) pairs)."""
+    codes = sorted({code for code, date in rows if code is not None})
+    dates = sorted({date for code, date in rows if date is not None})
+    if not codes and not dates:
+        return
+    _lock(cursor)
+    if codes:
+        cursor.execute("DELETE FROM product_prices WHERE product_code = ANY(%s)", (codes,))
+        cursor.execute("DELETE FROM product_latest WHERE product_code = ANY(%s)", (codes,))
+        _recompute_products(cursor, codes)
+    if dates:
+        weeks, months = _periods(dates)
+        cursor.execute('''
+            DELETE FROM vendor_spend
+            WHERE (period_kind = 'week' AND period_start = ANY(%s::date[]))
+               OR (period_kind = 'month' AND period_start = ANY(%s::date[]))
+        ''', (weeks, months))
+        _recompute_vendor_spend(cursor, dates)
+
+
+def rebuild(cursor):
+    """Recompute the whole price history from invoice_items."""
+    _lock(cursor)
+    cursor.execute("DELETE FROM product_prices")
+    cursor.execute("DELETE FROM product_latest")
+    cursor.execute("DELETE FROM vendor_spend")
+    _recompute_products(cursor)
+    _recompute_vendor_spend(cursor)
@@ -0,0 +1,169 @@
+"""
+Bank-to-card reconciliation.
+
+A card bill is paid from the bank ledger ("Card Payment" rows in transactions) and
+shows up again on the card statement as a payment credit in credit_card_records.
+reconcile() pairs the two by exact amount within a date window and records the pair
+in card_payment_matches. The dashboard rollups count a matched bank payment as a
+transfer rather than an expense, since the card lines it paid for are counted. An
+unmatched one stays an expense: its card's statement may never be imported.
+
+Matching only looks at rows not matched yet, so running it after every import is
+cheap; rebuild=True starts over. Editing a matched payment drops its match (unmatch()).
+"""
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import timedelta
+
+import rollups
+
+# Bank rows that pay a card: by category, or by a payee that names the card. The payee also
+# narrows the match to that card's statement (account_source of its credit_card_records).
+# No Amex statement format exists yet, so Amex payments stay unmatched until one does.
+PAYMENT_CATEGORIES = ("Card Payment",)
+CARD_ACCOUNTS = {"Chase Card": "Chase CC", "Citi Card": "Citi CC", "Amex": "Amex CC"}
+
+# The card credit may post this many days before / after the bank debit
+DAYS_BEFORE = 3
+DAYS_AFTER = 7
+
+TABLES = ("card_payment_matches", "transactions", "credit_card_records")
+
+
+def _quoted(values):
+    return ", ".join(f"'{v}'" for v in values)
+
+
+PAYMENT_FILTER = f'''
+    t.expense > 0 AND t.date IS NOT NULL
+    AND (t.category IN ({_quoted(PAYMENT_CATEGORIES)}) OR t.payee IN ({_quoted(CARD_ACCOUNTS)}))
+'''
+# transactions columns a match depends on: patching one of them drops the row's match
+MATCH_COLUMNS = {"date", "category", "payee", "expense"}
+CREDIT_FILTER = '''
+    c.income > 0 AND c.date IS NOT NULL
+    AND (c.type ILIKE 'payment%' OR c.description ILIKE '%payment%')
+'''
+
+MATCHES_QUERY = '''
+    SELECT m.payment_id, m.card_record_id, m.amount, m.day_gap, m.matched_at,
+           t.date AS payment_date, t.description AS payment_description, t.payee,
+           c.date AS card_date, c.description AS card_description, c.account_source AS card_account
+    FROM card_payment_matches m
+    JOIN transactions t ON t.id = m.payment_id
+    JOIN credit_card_records c ON c.id = m.card_record_id
+    ORDER BY t.date DESC, t.id DESC
+'''
+UNMATCHED_PAYMENTS_QUERY = f'''
+    SELECT t.id, t.date, t.description, t.payee, t.category, t.expense
+    FROM transactions t
+    WHERE {PAYMENT_FILTER}
+      AND NOT EXISTS (SELECT 1 FROM card_payment_matches m WHERE m.payment_id = t.id)
+    ORDER BY t.date DESC, t.id DESC
+'''
+
+
+def create_matches_table(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS card_payment_matches (
+            payment_id INTEGER PRIMARY KEY REFERENCES transactions(id) ON DELETE CASCADE,
+            card_record_id INTEGER UNIQUE NOT NULL REFERENCES credit_card_records(id) ON DELETE CASCADE,
+            amount NUMERIC(12,2),
+            day_gap INTEGER,
+            matched_at TIMESTAMPTZ DEFAULT NOW()
+        )
+    ''')
+
+
+def match(payments, credits, before=DAYS_BEFORE, after=DAYS_AFTER):
+    """
+    payments / credits: (id, date, cents, account) tuples -> [(payment, credit)].
+    Each payment takes the closest-dated free credit of the same amount (and card, when the
+    payment names one) inside the window. Credits are bucketed by amount and kept sorted by
+    date, so each payment is a dict lookup plus a bisect instead of a scan over every credit.
+    """
+    buckets = defaultdict(list)
+    for credit in sorted(credits, key=lambda c: (c[1], c[0])):
+        buckets[credit[2]].append(credit)
+    dates = {cents: [c[1] for c in bucket] for cents, bucket in buckets.items()}
+
+    pairs = []
+    for payment in sorted(payments, key=lambda p: (p[1], p[0])):
+        bucket = buckets.get(payment[2])
+        if not bucket:
+            continue
+        account = CARD_ACCOUNTS.get(payment[3])
+        best = None
+        i = bisect_left(dates[payment[2]], payment[1] - timedelta(days=before))
+        while i < len(bucket) and bucket[i][1] <= payment[1] + timedelta(days=after):
+            if account is None or bucket[i][3] == account:
+                if best is None or abs(bucket[i][1] - payment[1]) < abs(bucket[best][1] - payment[1]):
+                    best = i
+            i += 1
+        if best is not None:
+            pairs.append((payment, bucket.pop(best)))
+            del dates[payment[2]][best]
+    return pairs
+
+
+def _lock(cursor):
+    # One reconciler at a time, or two could claim the same card credit
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext('card_payment_matches'))")
+
+
+def _drop_matches(cursor, where="", params=None):
+    """Delete matches and return the dates of their payments, whose months' rollups change."""
+    cursor.execute(f'''
+        DELETE FROM card_payment_matches m USING transactions t
+        WHERE t.id = m.payment_id {where}
+        RETURNING t.date
+    ''', params)
+    return [row[0] for row in cursor.fetchall()]
+
+
+def unmatch(cursor, payment_ids):
+    """
+    Drop the matches of these transactions rows (edited since they were matched) and refresh
+    the rollups of their months, in the caller's transaction. Returns how many were dropped.
+    """
+    _lock(cursor)
+    touched = _drop_matches(cursor, "AND m.payment_id = ANY(%s)", (list(payment_ids),))
+    rollups.refresh_months(cursor, touched)
+    return len(touched)
+
+
+def reconcile(cursor, rebuild=False):
+    """
+    Match the unmatched card payments and refresh the rollups of the months that changed,
+    in the caller's transaction. Returns how many pairs were added.
+    """
+    _lock(cursor)
+    touched = _drop_matches(cursor) if rebuild else []
+
+    cursor.execute(f'''
+        SELECT t.id, t.date, (t.expense * 100)::bigint, COALESCE(t.payee, '')
+        FROM transactions t
+        WHERE {PAYMENT_FILTER}
+          AND NOT EXISTS (SELECT 1 FROM card_payment_matches m WHERE m.payment_id = t.id)
+    ''')
+    payments = cursor.fetchall()
+    cursor.execute(f'''
+        SELECT c.id, c.date, (c.income * 100)::bigint, COALESCE(c.account_source, '')
+        FROM credit_card_records c
+        WHERE {CREDIT_FILTER}
+          AND NOT EXISTS (SELECT 1 FROM card_payment_matches m WHERE m.card_record_id = c.id)
+    ''')
+    pairs = match(payments, cursor.fetchall())
+
+    if pairs:
+        cursor.execute('''
+            INSERT INTO card_payment_matches (payment_id, card_record_id, amount, day_gap)
+            SELECT unnest(%s::integer[]), unnest(%s::integer[]), unnest(%s::bigint[]) / 100.0, unnest(%s::integer[])
+        ''', (
+            [p[0] for p, c in pairs],
+            [c[0] for p, c in pairs],
+            [p[2] for p, c in pairs],
+            [(c[1] - p[1]).days for p, c in pairs],
+        ))
+    rollups.refresh_months(cursor, touched + [p[1] for p, c in pairs])
+    return len(pairs)
@@ -0,0 +1,126 @@
+"""
+In-process cache for ExpenseEngine read results.
+
+Entries are keyed by getter name and arguments, expire after a TTL and are
+evicted least-recently-used past `max_entries`. Each entry records the tables
+it was read from; write paths call invalidate(table) after they commit. Every
+entry also carries an ETag (a digest of its JSON form) so endpoints can answer
+If-None-Match with 304.
+
+The cache is per process: on Vercel each warm instance has its own, so a write
+served by another instance shows up here after at most `ttl` seconds.
+"""
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def _env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+class CacheEntry:
+    __slots__ = ("value", "etag", "tables", "expires")
+
+    def __init__(self, value, tables, expires):
+        self.value = value
+        self.tables = tables
+        self.expires = expires
+        digest = hashlib.blake2b(json.dumps(value, default=str, sort_keys=True).encode(), digest_size=16)
+        self.etag = f'"{digest.hexdigest()}"'
+
+
+class ResponseCache:
+    def __init__(self, max_entries=256, ttl=30.0):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._generations = {}  # table -> bumped on every invalidate
+        self.hits = 0
+        self.misses = 0
+
+    async def aget(self, key, tables, loader):
+        """The cached entry for `key`, awaiting `loader()` to fill it on a miss."""
+        entry, generations = self._lookup(key, tables)
+        if entry is None:
+            entry = self._store(key, tables, generations, await loader())
+        return entry
+
+    def _lookup(self, key, tables):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry, None
+            self.misses += 1
+            return None, [self._generations.get(t, 0) for t in tables]
+
+    def _store(self, key, tables, generations, value):
+        entry = CacheEntry(value, tables, time.monotonic() + self.ttl)
+        # Empty results are not kept: getters return [] (or a dict of []) when they swallow a DB error
+        if self.ttl <= 0 or not entry.value or (isinstance(value, dict) and not any(value.values())):
+            return entry
+
+        with self._lock:
+            # A write that committed while we were reading makes this result stale already
+            if generations != [self._generations.get(t, 0) for t in tables]:
+                return entry
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, *tables):
+        with self._lock:
+            for table in tables:
+                self._generations[table] = self._generations.get(table, 0) + 1
+            stale = [key for key, entry in self._entries.items() if set(entry.tables) & set(tables)]
+            for key in stale:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "max_entries": self.max_entries,
+                    "ttl": self.ttl, "hits": self.hits, "misses": self.misses}
+
+
+def from_env():
+    return ResponseCache(
+        max_entries=int(_env_float("RESPONSE_CACHE_SIZE", 256)),
+        ttl=_env_float("RESPONSE_CACHE_TTL", 30),
+    )
+
+
+def cached(tables):
+    """
+    Cache an (async) AsyncExpenseEngine getter in `self.cache`. `tables` is the tuple of tables
+    the result is read from, or a function of the call's arguments returning it.
+    The wrapped getter returns the value as before; `await getter.entry(...)` returns the CacheEntry.
+    """
+    def decorate(func):
+        async def entry(self, *args, **kwargs):
+            depends = tables(*args, **kwargs) if callable(tables) else tables
+            key = (func.__name__, args, tuple(sorted(kwargs.items())))
+            return await self.cache.aget(key, tuple(depends), lambda: func(self, *args, **kwargs))
+
+        @functools.wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            return (await entry(self, *args, **kwargs)).value
+
+        wrapper.entry = entry
+        return wrapper
+    return decorate
@@ -0,0 +1,178 @@
+"""
+Per-month rollups behind /dashboard-summary.
+
+monthly_totals holds one row per month (YYYY-MM, '' for undated rows) with the
+ledger / sales / cash sums the dashboard needs, and monthly_expense_breakdown
+holds the per-category and per-payee expense sums. Write paths call
+refresh_months() inside their own transaction for every month they touched,
+so the dashboard only ever reads O(months) rows.
+
+Card statement lines count as expenses too. A bank payment that reconcile.py
+matched to a card statement credit is a transfer: it is summed as
+ledger_transfer and left out of the expense breakdown.
+
+The daily System 'Cash Sales' ledger rows are derived from sales_records the
+same way: sync_cash_sales_rows() creates them from the sales write paths.
+"""
+
+MONTH_EXPR = "COALESCE(to_char(date, 'YYYY-MM'), '')"
+
+TOTAL_COLUMNS = [
+    "ledger_income", "ledger_expense", "ledger_cash_amount",
+    "sales_cash", "sales_debit", "sales_credit", "sales_doordash", "sales_stripe",
+    "sales_tips", "sales_cash_tips",
+    "cash_income", "cash_expense",
+    "card_expense", "ledger_transfer",
+]
+
+MATCHED_PAYMENT = "id IN (SELECT payment_id FROM card_payment_matches)"
+
+
+def create_rollup_tables(cursor):
+    columns = ",\n".join(f"{c} NUMERIC(14,2) DEFAULT 0" for c in TOTAL_COLUMNS)
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS monthly_totals (
+            month TEXT PRIMARY KEY,
+            {columns}
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS monthly_expense_breakdown (
+            month TEXT,
+            kind TEXT,
+            name TEXT,
+            amount NUMERIC(14,2) DEFAULT 0,
+            PRIMARY KEY (month, kind, name)
+        )
+    ''')
+
+
+def month_key(date):
+    return str(date or "")[:7]
+
+
+def _source_filter(months):
+    """WHERE clause selecting the rows of `months` as date ranges, so the (date, id) indexes apply."""
+    if months is None:
+        return "", {}
+    clauses, params = [], {}
+    for i, month in enumerate(months):
+        if month:
+            clauses.append(f"(date >= %(m{i})s::date AND date < %(m{i})s::date + INTERVAL '1 month')")
+            params[f"m{i}"] = f"{month}-01"
+        else:
+            clauses.append("date IS NULL")
+    return f"WHERE {' OR '.join(clauses)}", params
+
+
+def _recompute(cursor, months=None):
+    where, params = _source_filter(months)
+    zero = "0::numeric"
+
+    def select(table, **exprs):
+        values = ", ".join(f"{exprs.get(c, zero)} AS {c}" for c in TOTAL_COLUMNS)
+        return f"SELECT {MONTH_EXPR} AS month, {values} FROM {table} {where}"
+
+    cursor.execute(f'''
+        INSERT INTO monthly_totals (month, {", ".join(TOTAL_COLUMNS)})
+        SELECT month, {", ".join(f"SUM({c})" for c in TOTAL_COLUMNS)}
+        FROM (
+            {select("transactions",
+                    ledger_income="COALESCE(income, 0)",
+                    ledger_expense="CASE WHEN expense > 0 THEN expense ELSE 0 END",
+                    ledger_cash_amount="COALESCE(cash_amount, 0)",
+                    ledger_transfer=f"CASE WHEN expense > 0 AND {MATCHED_PAYMENT} THEN expense ELSE 0 END")}
+            UNION ALL
+            {select("credit_card_records",
+                    card_expense="CASE WHEN expense > 0 THEN expense ELSE 0 END")}
+            UNION ALL
+            {select("sales_records",
+                    sales_cash="COALESCE(cash, 0)",
+                    sales_debit="COALESCE(debit, 0)",
+                    sales_credit="COALESCE(credit, 0)",
+                    sales_doordash="COALESCE(doordash, 0)",
+                    sales_stripe="COALESCE(stripe, 0)",
+                    sales_tips="COALESCE(tips, 0)",
+                    sales_cash_tips="COALESCE(cash_tips, 0)")}
+            UNION ALL
+            {select("cash_records",
+                    cash_income="COALESCE(income, 0)",
+                    cash_expense="COALESCE(expense, 0)")}
+        ) x
+        GROUP BY month
+    ''', params)
+
+    # Ledger expense counts expense (unless it is a matched card payment) + cash_amount; Cash Table
+    # and card lines count expense. Only positive rows count.
+    cursor.execute(f'''
+        WITH expenses AS (
+            SELECT {MONTH_EXPR} AS month, TRIM(category) AS category, TRIM(payee) AS payee,
+                   CASE WHEN {MATCHED_PAYMENT} THEN 0 ELSE COALESCE(expense, 0) END + COALESCE(cash_amount, 0) AS amount
+            FROM transactions {where}
+            UNION ALL
+            SELECT {MONTH_EXPR}, TRIM(category), TRIM(payee), COALESCE(expense, 0)
+            FROM cash_records {where}
+            UNION ALL
+            SELECT {MONTH_EXPR}, TRIM(category), TRIM(payee), COALESCE(expense, 0)
+            FROM credit_card_records {where}
+        )
+        INSERT INTO monthly_expense_breakdown (month, kind, name, amount)
+        SELECT month, 'category', category, SUM(amount) FROM expenses
+        WHERE amount > 0 AND category <> '' GROUP BY month, category
+        UNION ALL
+        SELECT month, 'payee', payee, SUM(amount) FROM expenses
+        WHERE amount > 0 AND payee <> '' GROUP BY month, payee
+    ''', params)
+
+
+def _lock(cursor):
+    # Serializes concurrent refreshes so each recompute sees the previous writer's commit
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext('monthly_rollups'))")
+
+
+def refresh_months(cursor, dates):
+    """Recompute the rollups for the months of `dates`. Runs in the caller's transaction."""
+    months = sorted({month_key(d) for d in dates})
+    if not months:
+        return
+    _lock(cursor)
+    cursor.execute("DELETE FROM monthly_totals WHERE month = ANY(%s)", (months,))
+    cursor.execute("DELETE FROM monthly_expense_breakdown WHERE month = ANY(%s)", (months,))
+    _recompute(cursor, months)
+
+
+def rebuild(cursor):
+    """Recompute every month from the raw ledger tables."""
+    _lock(cursor)
+    cursor.execute("DELETE FROM monthly_totals")
+    cursor.execute("DELETE FROM monthly_expense_breakdown")
+    _recompute(cursor)
+
+
+def sync_cash_sales_rows(cursor, dates=None):
+    """
+    Create the System 'Cash Sales' ledger row for every sales day of `dates` (all days when None)
+    that took cash. The row carries no amounts; reads join sales_records for its cash_income.
+    The dup key is one per day, so concurrent writers cannot create the same row twice.
+    """
+    where, params = "", {}
+    if dates is not None:
+        dates = [d for d in dates if d]
+        if not dates:
+            return
+        where, params = "AND s.date = ANY(%(dates)s::date[])", {"dates": dates}
+    cursor.execute(f'''
+        INSERT INTO transactions (
+            date, type, category, payee, payee_note, cash_amount, description,
+            income, expense, net_amount, bank_balance, account_source, is_duplicate_check
+        )
+        SELECT s.date, 'Cash Sales', '', '', '', 0, 'Daily Cash Income Record',
+               0, 0, 0, 0, 'System', 'system_cash_' || s.date
+        FROM sales_records s
+        WHERE COALESCE(s.cash, 0) + COALESCE(s.cash_tips, 0) > 0 {where}
+          AND NOT EXISTS (
+              SELECT 1 FROM transactions t
+              WHERE t.date = s.date AND t.type = 'Cash Sales' AND t.account_source = 'System'
+          )
+        ON CONFLICT (is_duplicate_check) DO NOTHING
+    ''', params)
@@ -0,0 +1,213 @@
+"""
+Search across the ledgers, card statements, invoices and cash records.
+
+With the pg_trgm extension every searched text has a GIN trigram index, and a query
+is one UNION over the four tables: rows whose text contains the query, or whose
+words are close to it (word_similarity, so typos still match), ranked by similarity.
+Without pg_trgm (a local Postgres without contrib) TrigramIndex does the same in
+process over the rows read once into memory.
+
+Results carry `highlights`, [start, end) spans of `text` that matched a query word.
+"""
+import re
+from collections import defaultdict
+from datetime import date as Date
+
+# Searched text and the amount / date filters apply to, per table
+SOURCES = {
+    "transactions": {
+        "fields": ["description", "payee", "payee_note"],
+        "amount": "GREATEST(COALESCE(expense, 0), COALESCE(income, 0))",
+    },
+    "credit_card_records": {
+        "fields": ["description", "payee", "payee_note"],
+        "amount": "GREATEST(COALESCE(expense, 0), COALESCE(income, 0))",
+    },
+    "invoice_items": {
+        "fields": ["product_name"],
+        "amount": "COALESCE(total_price, 0)",
+    },
+    "cash_records": {
+        "fields": ["description"],
+        "amount": "GREATEST(COALESCE(expense, 0), COALESCE(income, 0))",
+    },
+}
+TABLES = tuple(SOURCES)
+
+# pg_trgm's default word_similarity_threshold; the in-process index uses the same cut-off
+MIN_SCORE = 0.6
+MIN_QUERY_LENGTH = 2
+MAX_RESULTS = 200
+
+_WORD = re.compile(r'[^\W_]+')
+
+
+def text_expr(table):
+    """The indexed expression (text || text is immutable, which an expression index needs)."""
+    return " || ' ' || ".join(f"COALESCE({field}, '')" for field in SOURCES[table]["fields"])
+
+
+def create_indexes(cursor):
+    """
+    Install pg_trgm and index each searched text. Returns False when the extension cannot be
+    installed (no contrib / no privilege): search falls back to TrigramIndex, and the migration
+    stays pending so the indexes are created once the extension is available.
+    """
+    cursor.execute("SAVEPOINT search_trgm")
+    try:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    except Exception as e:
+        cursor.execute("ROLLBACK TO SAVEPOINT search_trgm")
+        print(f"pg_trgm unavailable, search uses the in-process index: {e}")
+        return False
+    cursor.execute("RELEASE SAVEPOINT search_trgm")
+    for table in SOURCES:
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_search ON {table} USING gin (({text_expr(table)}) gin_trgm_ops)")
+    return True
+
+
+TRGM_AVAILABLE_QUERY = "SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') AS available"
+
+DOCUMENTS_QUERY = " UNION ALL ".join(
+    f"SELECT '{table}' AS source, id, date, {spec['amount']} AS amount, {text_expr(table)} AS text FROM {table}"
+    for table, spec in SOURCES.items()
+)
+
+
+def validate(q, limit, date_from=None, date_to=None):
+    """Normalized (q, limit, date_from, date_to); ValueError for a short query or a malformed date."""
+    q = " ".join((q or "").split())
+    if len(q) < MIN_QUERY_LENGTH:
+        raise ValueError(f"Search for at least {MIN_QUERY_LENGTH} characters")
+    dates = []
+    for value in (date_from, date_to):
+        try:
+            dates.append(Date.fromisoformat(value).isoformat() if value else None)
+        except ValueError:
+            raise ValueError(f"Invalid date '{value}', expected YYYY-MM-DD")
+    return (q, max(1, min(int(limit or 50), MAX_RESULTS)), *dates)
+
+
+def search_sql(q, limit, date_from=None, date_to=None, min_amount=None, max_amount=None):
+    """(sql, params) for the pg_trgm search; each table contributes at most `limit` rows."""
+    params = {
+        "q": q, "like": "%" + re.sub(r'([%_\\])', r'\\\1', q) + "%", "limit": limit,
+        "date_from": date_from, "date_to": date_to, "min_amount": min_amount, "max_amount": max_amount,
+    }
+    branches = []
+    for table, spec in SOURCES.items():
+        text, amount = text_expr(table), spec["amount"]
+        filters = [f"({text} ILIKE %(like)s OR %(q)s <%% ({text}))"]
+        if date_from:
+            filters.append("date >= %(date_from)s::date")
+        if date_to:
+            filters.append("date <= %(date_to)s::date")
+        if min_amount is not None:
+            filters.append(f"{amount} >= %(min_amount)s")
+        if max_amount is not None:
+            filters.append(f"{amount} <= %(max_amount)s")
+        branches.append(f'''(
+            SELECT '{table}' AS source, id, date, {amount} AS amount, {text} AS text,
+                   word_similarity(%(q)s, {text}) AS score
+            FROM {table}
+            WHERE {" AND ".join(filters)}
+            ORDER BY score DESC, date DESC NULLS LAST
+            LIMIT %(limit)s
+        )''')
+    sql = f'''
+        SELECT * FROM ({" UNION ALL ".join(branches)}) hits
+        ORDER BY score DESC, date DESC NULLS LAST, source, id
+        LIMIT %(limit)s
+    '''
+    return sql, params
+
+
+def trigrams(word):
+    """pg_trgm's trigrams of one word: lower-cased, two spaces before and one after."""
+    padded = f"  {word.lower()} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _text_trigrams(text):
+    grams = set()
+    for word in _WORD.findall(text):
+        grams |= trigrams(word)
+    return grams
+
+
+def highlights(text, q):
+    """[start, end) spans of the words of `text` that contain, or are close to, a query word."""
+    terms = [t.lower() for t in _WORD.findall(q)]
+    term_grams = [trigrams(t) for t in terms]
+    spans = []
+    for found in _WORD.finditer(text):
+        word = found.group().lower()
+        grams = trigrams(word)
+        if any(t in word or len(g & grams) / len(g | grams) >= 0.5 for t, g in zip(terms, term_grams)):
+            spans.append([found.start(), found.end()])
+    return spans
+
+
+def present(rows, q):
+    """Final result rows: whitespace-normalized text with its highlight spans, score as a float."""
+    for row in rows:
+        row["text"] = " ".join(str(row["text"]).split())
+        row["score"] = round(float(row["score"] or 0), 3)
+        row["highlights"] = highlights(row["text"], q)
+    return rows
+
+
+class TrigramIndex:
+    """In-process stand-in for the pg_trgm indexes: trigram -> documents that contain it."""
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.lowered = [" ".join(str(doc["text"]).split()).lower() for doc in documents]
+        self.postings = defaultdict(list)
+        for i, text in enumerate(self.lowered):
+            for gram in _text_trigrams(text):
+                self.postings[gram].append(i)
+
+    def search(self, q, limit, date_from=None, date_to=None, min_amount=None, max_amount=None):
+        query_grams = _text_trigrams(q)
+        if not query_grams:
+            return []
+        # Share of the query's trigrams a document has: pg_trgm's word_similarity, up to word order
+        shared = defaultdict(int)
+        for gram in query_grams:
+            for i in self.postings.get(gram, ()):
+                shared[i] += 1
+        needle = q.lower()
+        hits = []
+        for i, count in shared.items():
+            doc = self.documents[i]
+            score = 1.0 if needle in self.lowered[i] else count / len(query_grams)
+            if score < MIN_SCORE or not _in_filters(doc, date_from, date_to, min_amount, max_amount):
+                continue
+            hits.append((score, doc))
+        hits.sort(key=lambda hit: (-hit[0], _date_key(hit[1]["date"])))
+        return [
+            {"source": doc["source"], "id": doc["id"], "date": doc["date"], "amount": doc["amount"],
+             "text": doc["text"], "score": score}
+            for score, doc in hits[:limit]
+        ]
+
+
+def _date_key(date):
+    # Newest first among equal scores; undated rows last
+    return -date.toordinal() if hasattr(date, "toordinal") else 0
+
+
+def _in_filters(doc, date_from, date_to, min_amount, max_amount):
+    date, amount = doc["date"], float(doc["amount"] or 0)
+    if (date_from or date_to) and not hasattr(date, "isoformat"):
+        return False
+    if date_from and date.isoformat() < date_from:
+        return False
+    if date_to and date.isoformat() > date_to:
+        return False
+    if min_amount is not None and amount < min_amount:
+        return False
+    if max_amount is not None and amount > max_amount:
+        return False
+    return True
@@ -0,0 +1,347 @@
+"""
+Declarative CSV statement formats for ExpenseEngine.process_csv.
+
+Each entry of FORMATS describes one bank / vendor export: the header columns
+that identify it, the upload tab it belongs on, the target table, and how its
+columns map onto rows of that table (date column and format, text columns,
+amount sign rules). compile_format() turns an entry into a transform applied to
+each parsed chunk with whole-column operations only: one to_datetime with the
+entry's explicit format and one vectorized currency parse per amount column.
+Amounts are parsed to exact integer cents; cells that are not amounts are
+reported back (and their rows skipped) rather than imported as 0. Each row gets
+a 64-bit row_hash over its normalized fields and its occurrence ordinal in the
+file, which is what re-imports are deduplicated on.
+
+Supporting another bank means adding an entry here; process_csv needs no change.
+"""
+import hashlib
+import re
+from datetime import datetime
+
+FORMATS = [
+    {
+        "name": "usfoods",
+        # Any one of these column sets identifies the format; entries are tried in order
+        "detect": [["ProductDescription", "ExtendedPrice"]],
+        "tab": "invoice",
+        "tab_error": "Please upload this US Foods invoice on the Expense Detail tab.",
+        "table": "invoice_items",
+        "message": "US Foods: {inserted} items saved",
+        # Invoices carry no date column: it comes from the file name (e.g. 'invoice 3-14.csv')
+        "date": {"filename_pattern": r'(\d{1,2}-\d{1,2})', "template": "2026-{}"},
+        "required": "ProductDescription",
+        "text": {"p_code": "ProductNumber", "p_name": "ProductDescription", "unit": "PricingUnit"},
+        "numbers": {"qty": "QtyShip", "u_price": "UnitPrice", "t_price": "ExtendedPrice"},
+        "constants": {"vendor": "US Foods"},
+        # Product numbers are key material: read them as text so every chunk formats them alike
+        # (product_codes() then strips the leading zeros the importer has always dropped)
+        "dtype": {"ProductNumber": str},
+    },
+    {
+        "name": "truist",
+        "detect": [["Posted Date", "Full description"]],
+        "tab": "ledger",
+        "tab_error": "Please upload this Bank CSV on the Financial Ledger tab.",
+        "table": "transactions",
+        "message": "Truist Bank Processed to Financial Ledger ({inserted} new, {skipped} duplicates skipped)",
+        "date": {"column": "Transaction Date", "format": "%m/%d/%Y"},
+        "text": {"type": "Transaction Type", "desc": "Full description"},
+        # One signed column: positive is income, negative is expense
+        "amount": {"signed": "Amount"},
+        "balance": "Daily Posted Balance",
+        "constants": {"source": "Main Bank (Truist)"},
+    },
+    {
+        "name": "chase",
+        "detect": [["Card"], ["Transaction Date", "Post Date"]],
+        "tab": "credit_card",
+        "tab_error": "Please upload this Credit Card CSV on the Credit Card tab.",
+        "table": "credit_card_records",
+        "message": "Chase Card Processed to Credit Card Ledger ({inserted} new, {skipped} duplicates skipped)",
+        "date": {"column": "Transaction Date", "format": "%m/%d/%Y"},
+        "text": {"type": "Type", "desc": "Description"},
+        "amount": {"signed": "Amount"},
+        "constants": {"source": "Chase CC"},
+    },
+    {
+        "name": "citi",
+        "detect": [["Status", "Debit", "Credit"]],
+        "tab": "credit_card",
+        "tab_error": "Please upload this Credit Card CSV on the Credit Card tab.",
+        "table": "credit_card_records",
+        "message": "Citi Card Processed to Credit Card Ledger ({inserted} new, {skipped} duplicates skipped)",
+        "date": {"column": "Date", "format": "%m/%d/%Y"},
+        "text": {"desc": "Description"},
+        # Separate unsigned columns
+        "amount": {"income": "Credit", "expense": "Debit"},
+        "constants": {"type": "Credit Card", "source": "Citi CC"},
+    },
+]
+
+# Ledger rows as _bulk_save_rows expects them
+LEDGER_COLUMNS = ["date", "type", "desc", "income", "expense", "balance", "source", "row_hash"]
+INVOICE_COLUMNS = ["date", "vendor", "p_code", "p_name", "qty", "unit", "u_price", "t_price", "row_hash"]
+
+
+def detect(columns):
+    """The first format whose signature the (stripped) header columns satisfy, or None."""
+    present = set(columns)
+    for fmt in FORMATS:
+        if any(present.issuperset(signature) for signature in fmt["detect"]):
+            return fmt
+    return None
+
+
+def column(df, name, default=""):
+    import pandas as pd
+    if name in df.columns:
+        return df[name]
+    return pd.Series(default, index=df.index)
+
+
+# Longest amount cell parsed; longer cells are invalid
+AMOUNT_WIDTH = 32
+
+
+def normalize_currency(series):
+    """
+    Amount cells -> (cents, invalid). cents is an Int64 Series of exact integer cents:
+    '$1,234.50' -> 123450, '(12.00)' / '-$12' / '12.00-' -> -1200, blank -> 0.
+    invalid marks non-blank cells that are not amounts; their cents are <NA>.
+
+    The cells are read as a code-point matrix and scanned one character position at a time,
+    each step a few array operations over the whole column (a regex extract, or pandas' .str
+    methods without pyarrow, cost more than the scalar cleaner they replaced).
+    """
+    import numpy as np
+    import pandas as pd
+    if pd.api.types.is_numeric_dtype(series):
+        cents = (series.astype(float) * 100).round().astype('Int64').fillna(0)
+        return cents, pd.Series(False, index=series.index)
+
+    text = series.to_numpy(dtype=object, na_value='').astype(str)
+    # One character past AMOUNT_WIDTH is enough to tell a cell is too long
+    width = min(max(text.dtype.itemsize // 4, 1), AMOUNT_WIDTH + 1)
+    chars = text.astype(f'U{width}').view(np.uint32).reshape(len(text), width).T.copy()
+
+    n = len(text)
+    cents, digits, decimals, run = (np.zeros(n, dtype=np.int64) for _ in range(4))
+    opened, closed, minus, plus, dollar = (np.zeros(n, dtype=np.int64) for _ in range(5))
+    started, ended, point, grouped, bad = (np.zeros(n, dtype=bool) for _ in range(5))
+    blank = np.ones(n, dtype=bool)
+    for position, char in enumerate(chars):
+        if position == AMOUNT_WIDTH:
+            bad |= char != 0
+            break
+        digit = char - 48 <= 9  # unsigned: code points below '0' wrap around
+        is_point, is_comma = char == 46, char == 44
+        is_open, is_close, is_minus, is_plus, is_dollar = (char == 40, char == 41, char == 45,
+                                                           char == 43, char == 36)
+        space = (char == 0) | (char == 32) | (char == 9)
+        number = digit | is_point | is_comma
+        mark = is_open | is_close | is_minus | is_plus | is_dollar
+        # '(' / sign / '$' before the number, '-' / ')' after it, spaces only between the parts
+        bad |= ~(number | mark | space) | (number & ended) | (is_point & point)
+        bad |= ((is_open | is_plus | is_dollar) & started) | (is_close & ~started)
+        # Thousands commas group exactly three digits, before the point
+        bad |= is_comma & (point | (run == 0) | (run > 3) | (grouped & (run != 3)))
+        grouped |= is_comma
+        run = np.where(is_comma, 0, run + (digit & ~point))
+        ended |= started & (mark | space)
+        started |= number
+        blank &= space
+        point |= is_point
+        cents = np.where(digit, cents * 10 + (char.astype(np.int64) - 48), cents)
+        digits += digit
+        decimals += digit & point
+        opened += is_open
+        closed += is_close
+        minus += is_minus
+        plus += is_plus
+        dollar += is_dollar
+    # At most one way of saying "negative"; 15 unit digits keep the cents exact in int64
+    valid = (~bad & (digits > 0) & (digits - decimals <= 15) & (decimals <= 2) & ~(grouped & (run != 3))
+             & (opened == closed) & (opened + minus <= 1) & (plus <= 1) & (dollar <= 1))
+    cents = cents * 10 ** np.clip(2 - decimals, 0, 2)
+    cents = pd.Series(np.where(opened + minus > 0, -cents, cents), index=series.index).astype('Int64')
+    invalid = ~blank & ~valid
+    return cents.mask(invalid).mask(blank, 0), pd.Series(invalid, index=series.index)
+
+
+def cents_to_float(cents):
+    """Correctly rounded, so each value prints (and binds) as its exact 2-decimal amount."""
+    return cents.astype('float64') / 100
+
+
+def problems(df, mask, source):
+    """[{row, column, value}] for the cells of `source` flagged in `mask`; row is the 1-based file line."""
+    return [{"row": int(index) + 2, "column": source, "value": str(df.at[index, source])}
+            for index in mask[mask].index]
+
+
+def parse_dates(series, fmt=None):
+    """ISO date strings. Values that miss the explicit format fall back to pandas' own parsing."""
+    import pandas as pd
+    parsed = pd.to_datetime(series, format=fmt, errors='coerce') if fmt else pd.to_datetime(series)
+    missed = parsed.isna() & series.notna()
+    if missed.any():
+        parsed[missed] = pd.to_datetime(series[missed])
+    return parsed.dt.strftime('%Y-%m-%d')
+
+
+def normalize_text(series):
+    """Key form of a text column: blanks as '', runs of whitespace collapsed, upper case."""
+    return series.fillna('').astype(str).str.replace(r'\s+', ' ', regex=True).str.strip().str.upper()
+
+
+def product_codes(series):
+    """
+    Stored form of product numbers: digit-only codes without leading zeros ('00123' -> '123'),
+    as the importer stored them when pandas read the column as integers; other codes stripped;
+    blanks missing (NaN).
+    """
+    codes = series.astype('string').str.strip()
+    digits = codes.str.fullmatch(r'\d+').fillna(False).astype(bool)
+    stripped = codes.str.lstrip('0')
+    codes = codes.mask(digits, stripped.mask(stripped == '', '0'))
+    codes = codes.mask((codes == '').fillna(False).astype(bool))
+    return codes.astype(object).where(codes.notna())
+
+
+def row_hash(key):
+    """Signed 64-bit head of md5(key), the same value as SQL's ('x' || left(md5(key), 16))::bit(64)::bigint."""
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big', signed=True)
+
+
+def row_hashes(parts, seen):
+    """
+    row_hash per row for the key fields `parts` (Series of strings) joined with '|', plus
+    '|<n>' where n counts earlier rows of the file with the same fields, so two identical
+    charges on one day keep distinct hashes. `seen` carries those counts across chunks.
+    """
+    import pandas as pd
+    keys = parts[0]
+    for part in parts[1:]:
+        keys = keys + '|' + part
+    ordinal = keys.groupby(keys).cumcount() + keys.map(seen).fillna(0).astype('int64')
+    for key, count in keys.value_counts().items():
+        seen[key] = seen.get(key, 0) + count
+    return pd.Series([row_hash(f"{key}|{n}") for key, n in zip(keys, ordinal)], index=keys.index, dtype='int64')
+
+
+def cents_text(cents):
+    return cents.astype('int64').astype(str)
+
+
+def price_cents(values):
+    """
+    Float amounts -> int64 cents, rounded half away from zero (1.005 -> 101) as Postgres rounds
+    them into a NUMERIC(12,2) column; (values * 100).round() would give 100.
+    """
+    from decimal import ROUND_HALF_UP, Decimal
+    return values.map(lambda v: int(Decimal(str(v)).scaleb(2).quantize(Decimal(1), ROUND_HALF_UP)))
+
+
+def _file_date(spec, filename):
+    """
+    ISO date from the file name ('invoice 3-4.csv' -> '2026-03-04'), today's when it has none.
+    Zero-padded, as to_char(date, 'YYYY-MM-DD') renders it in the SQL row_hash keys.
+    """
+    match = re.search(spec["filename_pattern"], filename or "")
+    if match:
+        try:
+            return datetime.strptime(spec["template"].format(match.group(1)), '%Y-%m-%d').strftime('%Y-%m-%d')
+        except ValueError:
+            pass
+    return datetime.now().strftime('%Y-%m-%d')
+
+
+def compile_format(fmt, filename=""):
+    """
+    chunk DataFrame -> (rows for fmt['table'] as LEDGER_COLUMNS or INVOICE_COLUMNS, problems),
+    all column-wise. problems lists the cells that could not be read as numbers.
+    """
+    if fmt["table"] == "invoice_items":
+        return _compile_invoice(fmt, filename)
+    return _compile_ledger(fmt)
+
+
+def _compile_ledger(fmt):
+    import pandas as pd
+    date_spec, amount, constants = fmt["date"], fmt["amount"], fmt.get("constants", {})
+    seen = {}
+
+    def amount_cents(df, source, bad):
+        cents, invalid = normalize_currency(column(df, source, 0))
+        if source in df.columns:
+            bad += problems(df, invalid, source)
+        return cents, invalid
+
+    def transform(df):
+        """-> (rows, problems); rows with an unreadable amount are left out and listed in problems."""
+        bad = []
+        rows = pd.DataFrame(index=df.index)
+        rows["date"] = parse_dates(df[date_spec["column"]], date_spec.get("format"))
+        for field, source in fmt["text"].items():
+            rows[field] = column(df, source)
+        if "signed" in amount:
+            signed, skip = amount_cents(df, amount["signed"], bad)
+            income, expense = signed.clip(lower=0), (-signed).clip(lower=0)
+        else:
+            income, skip_income = amount_cents(df, amount["income"], bad)
+            expense, skip_expense = amount_cents(df, amount["expense"], bad)
+            skip = skip_income | skip_expense
+        rows["income"], rows["expense"] = cents_to_float(income), cents_to_float(expense)
+        if fmt.get("balance"):
+            balance, skip_balance = amount_cents(df, fmt["balance"], bad)
+            rows["balance"] = cents_to_float(balance)
+            skip |= skip_balance
+        else:
+            rows["balance"] = 0.0
+        for field, value in constants.items():
+            rows[field] = value
+        rows = rows[~skip].copy()
+        rows["row_hash"] = row_hashes([
+            rows["source"].fillna('').astype(str), rows["date"].fillna(''), normalize_text(rows["desc"]),
+            cents_text(income[~skip]), cents_text(expense[~skip]),
+        ], seen)
+        return rows[LEDGER_COLUMNS], bad
+
+    return transform
+
+
+def _compile_invoice(fmt, filename):
+    import pandas as pd
+    date_str = _file_date(fmt["date"], filename)
+    seen = {}
+
+    def transform(df):
+        """-> (rows, problems); rows with an unreadable number are left out and listed in problems."""
+        df = df[df[fmt["required"]].notna()]
+        bad = []
+        skip = pd.Series(False, index=df.index)
+        rows = pd.DataFrame(index=df.index)
+        rows["date"] = date_str
+        for field, source in fmt["text"].items():
+            rows[field] = column(df, source)
+        for field, source in fmt["numbers"].items():
+            raw = column(df, source, 0.0)
+            # Quantities and unit prices carry more than 2 decimals, so these stay plain numbers
+            values = pd.to_numeric(raw, errors='coerce')
+            invalid = values.isna() & raw.notna()
+            if source in df.columns:
+                bad += problems(df, invalid, source)
+            skip |= invalid
+            rows[field] = values.fillna(0.0).astype(float)
+        for field, value in fmt.get("constants", {}).items():
+            rows[field] = value
+        # A missing product number is stored as NULL and keyed as '' (SQL's COALESCE(product_code, ''))
+        rows["p_code"] = product_codes(rows["p_code"])
+        rows = rows[~skip].copy()
+        rows["row_hash"] = row_hashes([
+            rows["vendor"].astype(str), rows["date"], rows["p_code"].fillna(''),
+            cents_text(price_cents(rows["t_price"])),
+        ], seen)
+        return rows[INVOICE_COLUMNS], bad
+
+    return transform
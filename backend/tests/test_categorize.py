@@ -0,0 +1,38 @@
+"""The combined rule pattern must label exactly as trying each rule in order would."""
+import pytest
+
+from categorize import compile_rules, validate_rule
+
+
+def rule(id, kind, pattern, category, **extra):
+    return {"id": id, "kind": kind, "pattern": pattern, "category": category, **extra}
+
+
+def test_first_applicable_rule_wins():
+    label = compile_rules([
+        rule(1, "keyword", "costco", "Groceries", max_amount=100),
+        rule(2, "regex", r"COST(CO|LESS)", "Wholesale"),
+        rule(3, "learned", "POS 0314 AMAZON #123", "Supplies"),
+    ])
+    assert label("costco whse", 40)["id"] == 1
+    # Out of the first rule's amount range: the next matching rule applies
+    assert label("COSTCO WHSE", 400)["id"] == 2
+    assert label("POS 0402 AMAZON #123", 5)["id"] == 3
+    assert label("POS 0402 AMAZON #1234 MORE", 5) is None
+    assert label(None, 0) is None
+
+
+def test_no_rules_labels_nothing():
+    assert compile_rules([])("COSTCO", 1) is None
+
+
+@pytest.mark.parametrize("pattern", [r"(?P<store>COSTCO)", r"(A)\1", r"(?P=x)", r"(A)?(?(1)B|C)"])
+def test_regex_rules_that_cannot_be_combined_are_rejected(pattern):
+    with pytest.raises(ValueError, match="Invalid pattern"):
+        validate_rule(rule(None, "regex", pattern, "X"))
+
+
+def test_stored_uncombinable_rule_is_skipped():
+    label = compile_rules([rule(1, "regex", r"(?P<r0>A)", "Bad"), rule(2, "regex", r"(A)\1", "Bad"),
+                           rule(3, "regex", r"\\1 (A|B)", "Good")])
+    assert label(r"\1 A", 1)["id"] == 3
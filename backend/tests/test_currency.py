@@ -0,0 +1,27 @@
+"""normalize_currency turns statement amount cells into exact integer cents."""
+import pytest
+
+pd = pytest.importorskip("pandas")
+
+from statement_formats import normalize_currency
+
+
+def test_amount_spellings():
+    cells = ["$1,234.50", "(12.00)", "-$12", "12.00-", "+3.5", ".07", "0.10", "1234", "( 12 )", " $ -1,000,000.5 "]
+    cents, invalid = normalize_currency(pd.Series(cells, dtype=object))
+    assert cents.tolist() == [123450, -1200, -1200, -1200, 350, 7, 10, 123400, -1200, -100000050]
+    assert not invalid.any()
+
+
+def test_blank_is_zero_and_garbage_is_invalid():
+    cents, invalid = normalize_currency(pd.Series(["", None, "  ", "abc", "(5.00", "-(5)", "1.234", "12,34",
+                                                 "1 2", "1.2.3", "5$", "1" * 40], dtype=object))
+    assert cents[:3].tolist() == [0, 0, 0]
+    assert cents[3:].isna().all()
+    assert invalid.tolist() == [False] * 3 + [True] * 9
+
+
+def test_numeric_column_is_rounded_to_cents():
+    cents, invalid = normalize_currency(pd.Series([0.1 + 0.2, -19.999, None]))
+    assert cents.tolist() == [30, -2000, 0]
+    assert not invalid.any()
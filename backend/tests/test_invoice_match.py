@@ -0,0 +1,23 @@
+"""Invoice matching pairs each invoice total with the closest free bank debit."""
+from datetime import date
+
+import invoice_match
+
+
+def test_invoice_takes_debit_closest_in_amount_within_tolerance():
+    invoices = [(date(2026, 3, 4), "US Foods", 100000, 12)]
+    debits = [
+        (1, date(2026, 3, 5), 100500, "US Foods"),
+        (2, date(2026, 3, 20), 100050, "US Foods"),
+        (3, date(2026, 3, 5), 100000, "Sysco"),
+    ]
+    assert [d[0] for _, d in invoice_match.match(invoices, debits)] == [2]
+    # Beyond 1% (and $1) of the invoice total nothing matches
+    assert invoice_match.match(invoices, [(4, date(2026, 3, 5), 101001, "US Foods")]) == []
+
+
+def test_invoice_window():
+    invoices = [(date(2026, 3, 4), "US Foods", 5000, 1)]
+    assert invoice_match.match(invoices, [(1, date(2026, 3, 1), 5000, "US Foods")]) == []
+    assert invoice_match.match(invoices, [(1, date(2026, 3, 26), 5000, "US Foods")]) == []
+    assert len(invoice_match.match(invoices, [(1, date(2026, 3, 25), 5000, "US Foods")])) == 1
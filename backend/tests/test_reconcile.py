@@ -0,0 +1,95 @@
+"""Card payment matching pairs each bank payment with the closest free statement credit."""
+import os
+from datetime import date
+
+import pytest
+
+import reconcile
+import rollups
+
+
+def test_payment_takes_closest_credit_of_same_amount_and_card():
+    payments = [(1, date(2026, 3, 10), 50000, "Chase Card"), (2, date(2026, 3, 10), 50000, "Card Payment")]
+    credits = [
+        (10, date(2026, 3, 12), 50000, "Citi CC"),
+        (11, date(2026, 3, 16), 50000, "Chase CC"),
+        (12, date(2026, 3, 11), 49999, "Chase CC"),
+        (13, date(2026, 3, 30), 50000, "Citi CC"),
+    ]
+    pairs = {p[0]: c[0] for p, c in reconcile.match(payments, credits)}
+    # Payment 1 names the Chase card; payment 2 names none and takes the closest free credit
+    assert pairs == {1: 11, 2: 10}
+
+
+def test_payment_outside_window_is_unmatched():
+    payments = [(1, date(2026, 3, 10), 100, "Card Payment")]
+    assert reconcile.match(payments, [(10, date(2026, 3, 6), 100, "Chase CC")]) == []
+    assert reconcile.match(payments, [(10, date(2026, 3, 7), 100, "Chase CC")]) != []
+
+
+def test_each_credit_matches_once():
+    payments = [(1, date(2026, 3, 10), 100, "Card Payment"), (2, date(2026, 3, 11), 100, "Card Payment")]
+    pairs = reconcile.match(payments, [(10, date(2026, 3, 10), 100, "Chase CC")])
+    assert [(p[0], c[0]) for p, c in pairs] == [(1, 10)]
+
+
+@pytest.fixture
+def db_cursor():
+    """A cursor on an empty schema with just the columns the rollups read, dropped again by the rollback."""
+    url = os.environ.get("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    psycopg2 = pytest.importorskip("psycopg2")
+    conn = psycopg2.connect(url)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("CREATE SCHEMA reconcile_test; SET LOCAL search_path TO reconcile_test")
+        cursor.execute('''
+            CREATE TABLE transactions (
+                id SERIAL PRIMARY KEY, date DATE, category TEXT, payee TEXT, description TEXT,
+                income NUMERIC(12,2), expense NUMERIC(12,2), cash_amount NUMERIC(12,2)
+            );
+            CREATE TABLE credit_card_records (
+                id SERIAL PRIMARY KEY, date DATE, type TEXT, category TEXT, payee TEXT, description TEXT,
+                income NUMERIC(12,2), expense NUMERIC(12,2), account_source TEXT
+            );
+            CREATE TABLE sales_records (
+                date DATE, cash NUMERIC, debit NUMERIC, credit NUMERIC, doordash NUMERIC,
+                stripe NUMERIC, tips NUMERIC, cash_tips NUMERIC
+            );
+            CREATE TABLE cash_records (date DATE, category TEXT, payee TEXT, income NUMERIC, expense NUMERIC);
+        ''')
+        reconcile.create_matches_table(cursor)
+        rollups.create_rollup_tables(cursor)
+        yield cursor
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def month_totals(cursor):
+    cursor.execute("SELECT ledger_expense, ledger_transfer, card_expense FROM monthly_totals WHERE month = '2026-03'")
+    return tuple(float(v) for v in cursor.fetchone())
+
+
+def test_only_matched_payments_are_transfers(db_cursor):
+    db_cursor.execute('''
+        INSERT INTO transactions (date, category, payee, description, income, expense) VALUES
+            ('2026-03-10', '', 'Chase Card', 'CHASE CREDIT CRD AUTOPAY', 0, 500),
+            ('2026-03-12', 'Card Payment', 'Amex', 'AMEX EPAYMENT', 0, 300);
+        INSERT INTO credit_card_records (date, type, description, income, expense, account_source) VALUES
+            ('2026-03-11', 'Payment', 'AUTOMATIC PAYMENT - THANK', 500, 0, 'Chase CC'),
+            ('2026-03-05', 'Sale', 'US FOODS', 0, 500, 'Chase CC');
+    ''')
+    rollups.rebuild(db_cursor)
+    assert month_totals(db_cursor) == (800, 0, 500)
+
+    assert reconcile.reconcile(db_cursor) == 1
+    # The Amex payment has no statement to match, so it stays an expense
+    assert month_totals(db_cursor) == (800, 500, 500)
+    db_cursor.execute(reconcile.UNMATCHED_PAYMENTS_QUERY)
+    assert [row[3] for row in db_cursor.fetchall()] == ["Amex"]
+
+    db_cursor.execute("SELECT id FROM transactions WHERE payee = 'Chase Card'")
+    assert reconcile.unmatch(db_cursor, [db_cursor.fetchone()[0]]) == 1
+    assert month_totals(db_cursor) == (800, 0, 500)
@@ -0,0 +1,129 @@
+"""Import row hashes must equal the ones the row_hash_keys migration backfilled for the rows already stored."""
+import hashlib
+import io
+import os
+
+import pytest
+
+pd = pytest.importorskip("pandas")
+
+import statement_formats
+from migrations import ROW_HASH_KEYS
+
+INVOICE_CSV = (
+    "ProductNumber,ProductDescription,PricingUnit,QtyShip,UnitPrice,ExtendedPrice\n"
+    "00123,CHICKEN BREAST,CS,2,25.00,50.00\n"
+    ",NO CODE,EA,1,1.00,1.00\n"
+)
+HALF_CENT_CSV = (
+    "ProductNumber,ProductDescription,PricingUnit,QtyShip,UnitPrice,ExtendedPrice\n"
+    "7,LEMONS,EA,1,1.005,1.005\n"
+    "8,LIMES,EA,1,2.675,-2.675\n"
+)
+TRUIST_CSV = (
+    "Posted Date,Transaction Date,Transaction Type,Full description,Amount,Daily Posted Balance\n"
+    '03/05/2026,03/04/2026,DEBIT,"SYSCO   foods 123","-$1,234.50","$5,000.00"\n'
+)
+
+
+def transform(text, filename=""):
+    """rows as process_csv builds them from a one-chunk file."""
+    fmt = statement_formats.detect([c.strip() for c in pd.read_csv(io.StringIO(text), nrows=0).columns])
+    df = pd.read_csv(io.StringIO(text), dtype=fmt.get("dtype"))
+    df.columns = df.columns.str.strip()
+    rows, problems = statement_formats.compile_format(fmt, filename)(df)
+    assert problems == []
+    return rows
+
+
+def sql_row_hash(key):
+    """('x' || left(md5(key), 16))::bit(64)::bigint, spelled out."""
+    value = int(hashlib.md5(key.encode()).hexdigest()[:16], 16)
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def test_row_hash_matches_sql_cast():
+    for key in ["", "US Foods|2026-03-04|123|5000|0", "Main Bank (Truist)|2026-03-04|X|0|123450|1"]:
+        assert statement_formats.row_hash(key) == sql_row_hash(key)
+
+
+def test_invoice_key_uses_padded_date_and_blank_code():
+    rows = transform(INVOICE_CSV, "invoice 3-4.csv")
+    assert list(rows["date"]) == ["2026-03-04", "2026-03-04"]
+    assert rows["p_code"].isna().iloc[1]
+    assert list(rows["row_hash"]) == [
+        sql_row_hash("US Foods|2026-03-04|123|5000|0"),
+        sql_row_hash("US Foods|2026-03-04||100|0"),
+    ]
+
+
+def test_invoice_key_rounds_half_cents_away_from_zero():
+    rows = transform(HALF_CENT_CSV, "invoice 3-4.csv")
+    assert list(rows["row_hash"]) == [
+        sql_row_hash("US Foods|2026-03-04|7|101|0"),
+        sql_row_hash("US Foods|2026-03-04|8|-268|0"),
+    ]
+
+
+def test_repeated_rows_get_distinct_ordinals_across_chunks():
+    seen = {}
+    first = statement_formats.row_hashes([pd.Series(["A", "A"]), pd.Series(["1", "1"])], seen)
+    second = statement_formats.row_hashes([pd.Series(["A"]), pd.Series(["1"])], seen)
+    assert list(first) + list(second) == [sql_row_hash(f"A|1|{n}") for n in range(3)]
+
+
+@pytest.fixture
+def db_cursor():
+    url = os.environ.get("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    psycopg2 = pytest.importorskip("psycopg2")
+    conn = psycopg2.connect(url)
+    try:
+        yield conn.cursor()
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def backfilled_hash(cursor, table, row):
+    """The row_hash that the row_hash_keys migration gives a stored row ({column: (sql type, value)}) that is first of its key."""
+    columns = ", ".join(row)
+    values = ", ".join(f"%s::{kind}" for kind, _ in row.values())
+    cursor.execute(f'''
+        SELECT ('x' || left(md5(concat_ws('|', {", ".join(ROW_HASH_KEYS[table])}) || '|0'), 16))::bit(64)::bigint
+        FROM (VALUES ({values})) AS v({columns})
+    ''', [value for _, value in row.values()])
+    return cursor.fetchone()[0]
+
+
+def test_invoice_hash_matches_backfill(db_cursor):
+    rows = transform(INVOICE_CSV, "invoice 3-4.csv")
+    stored = {
+        "vendor": ("text", "US Foods"), "date": ("date", "2026-3-4"),
+        "product_code": ("text", "123"), "total_price": ("numeric(12,2)", "50.00"),
+    }
+    assert rows["row_hash"].iloc[0] == backfilled_hash(db_cursor, "invoice_items", stored)
+    stored.update(product_code=("text", None), total_price=("numeric(12,2)", "1.00"))
+    assert rows["row_hash"].iloc[1] == backfilled_hash(db_cursor, "invoice_items", stored)
+
+
+def test_half_cent_invoice_hash_matches_backfill(db_cursor):
+    rows = transform(HALF_CENT_CSV, "invoice 3-4.csv")
+    for (_, row), code in zip(rows.iterrows(), ["7", "8"]):
+        # Stored as the import binds it; the NUMERIC(12,2) column does the rounding
+        stored = {
+            "vendor": ("text", "US Foods"), "date": ("date", "2026-03-04"),
+            "product_code": ("text", code), "total_price": ("numeric(12,2)", row["t_price"]),
+        }
+        assert row["row_hash"] == backfilled_hash(db_cursor, "invoice_items", stored)
+
+
+def test_ledger_hash_matches_backfill(db_cursor):
+    rows = transform(TRUIST_CSV)
+    stored = {
+        "account_source": ("text", "Main Bank (Truist)"), "date": ("date", "2026-03-04"),
+        "description": ("text", "SYSCO   foods 123"),
+        "income": ("numeric(12,2)", "0"), "expense": ("numeric(12,2)", "1234.50"),
+    }
+    assert rows["row_hash"].iloc[0] == backfilled_hash(db_cursor, "transactions", stored)
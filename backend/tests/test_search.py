@@ -0,0 +1,52 @@
+"""The in-process TrigramIndex stands in for the pg_trgm search."""
+from datetime import date
+
+import pytest
+
+import search
+
+
+def doc(id, text, day=None, amount=0, source="transactions"):
+    return {"source": source, "id": id, "date": day, "amount": amount, "text": text}
+
+
+DOCUMENTS = [
+    doc(1, "US FOODS  DELIVERY", date(2026, 3, 4), 120),
+    doc(2, "US FOODS", date(2026, 3, 9), 80),
+    doc(3, "CHICKEN BREAST", date(2026, 3, 5), 50, "invoice_items"),
+    doc(4, "COSTCO WHSE", None, 10),
+]
+
+
+def test_substring_hits_rank_first_newest_first():
+    hits = search.TrigramIndex(DOCUMENTS).search("us foods", 10)
+    assert [(h["id"], h["score"]) for h in hits] == [(2, 1.0), (1, 1.0)]
+
+
+def test_typo_still_matches():
+    hits = search.TrigramIndex(DOCUMENTS).search("chiken", 10)
+    assert [h["id"] for h in hits] == [3]
+    assert search.TrigramIndex(DOCUMENTS).search("zzz", 10) == []
+
+
+def test_filters_and_limit():
+    index = search.TrigramIndex(DOCUMENTS)
+    assert [h["id"] for h in index.search("foods", 10, "2026-03-05")] == [2]
+    assert [h["id"] for h in index.search("foods", 10, None, None, 100)] == [1]
+    assert len(index.search("foods", 1)) == 1
+    # An undated row never passes a date filter
+    assert index.search("costco", 10, None, "2026-12-31") == []
+
+
+def test_present_normalizes_text_and_highlights_words():
+    rows = search.present(search.TrigramIndex(DOCUMENTS).search("food", 1), "food")
+    assert rows[0]["text"] == "US FOODS"
+    assert rows[0]["highlights"] == [[3, 8]]
+
+
+def test_validate():
+    assert search.validate("  us   foods ", 1000, "2026-03-04") == ("us foods", search.MAX_RESULTS, "2026-03-04", None)
+    with pytest.raises(ValueError):
+        search.validate("u", 10)
+    with pytest.raises(ValueError):
+        search.validate("us", 10, "2026-3-4x")
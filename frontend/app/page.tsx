@@ -10,6 +10,9 @@ import CreditCardTable from "@/components/CreditCardTable";
 import CashTable from "@/components/CashTable";
 import SettingsModal from "@/components/SettingsModal";
 
+// Stop polling an import job after this long; the import itself keeps running on the server
+const UPLOAD_POLL_LIMIT_MS = 10 * 60 * 1000;
+
 export default function Home() {
   const [showSettings, setShowSettings] = useState(false);
   // 탭 상태에 'sales' 추가
@@ -71,6 +74,7 @@ export default function Home() {
   const [creditCards, setCreditCards] = useState([]);
   const [cashRecords, setCashRecords] = useState([]);
   const [loading, setLoading] = useState(false);
+  const [uploadError, setUploadError] = useState<string | null>(null);
 
   useEffect(() => {
     if (selectedMonth) {
@@ -262,20 +266,41 @@ export default function Home() {
     formData.append("target_tab", activeTab);
 
     setLoading(true);
+    setUploadError(null);
     try {
       const res = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/upload`, {
         method: "POST",
         body: formData,
       });
-      const result = await res.json();
+      const queued = await res.json();
       if (!res.ok) {
-        alert(result.detail || "Upload failed");
-      } else {
-        alert(result.message);
+        setUploadError(queued.detail || "Upload failed");
+        return;
+      }
+      // 서버에서 백그라운드로 처리되므로 작업 상태를 폴링 (최대 UPLOAD_POLL_LIMIT_MS)
+      let job = queued;
+      const deadline = Date.now() + UPLOAD_POLL_LIMIT_MS;
+      while (job.status === "queued" || job.status === "running") {
+        if (Date.now() > deadline) {
+          setUploadError(`${file.name} is still importing (${job.rows_processed || 0} rows so far). Check the ledger again in a few minutes.`);
+          return;
+        }
+        await new Promise((resolve) => setTimeout(resolve, 1000));
+        const poll = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/upload/${queued.job_id}`);
+        job = await poll.json();
+        if (!poll.ok) {
+          setUploadError(job.detail || "Upload failed");
+          return;
+        }
+      }
+      if (job.status === "done") {
+        alert(job.message);
         fetchData();
+      } else {
+        setUploadError(job.error || job.message || "Upload failed");
       }
     } catch (error) {
-      alert("Upload failed.");
+      setUploadError("Upload failed.");
     } finally {
       setLoading(false);
     }
@@ -300,7 +325,7 @@ export default function Home() {
     <main className="min-h-screen p-4 sm:p-6 bg-gray-900 w-full overflow-hidden">
       <div className="w-full mx-auto space-y-6">
 
-        <Header onUpload={handleFileUpload} loading={loading} showUpload={activeTab !== 'cash'} />
+        <Header onUpload={handleFileUpload} loading={loading} error={uploadError} showUpload={activeTab !== 'cash'} />
 
         {/* 탭 네비게이션 */}
         <div className="bg-gray-800/60 rounded-2xl p-3 border border-gray-700/50 backdrop-blur-sm">
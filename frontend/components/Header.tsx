@@ -6,10 +6,11 @@ import { LogOut } from 'lucide-react';
 interface Props {
   onUpload: (e: React.ChangeEvent<HTMLInputElement>) => void;
   loading: boolean;
+  error?: string | null;
   showUpload?: boolean;
 }
 
-export default function Header({ onUpload, loading, showUpload = true }: Props) {
+export default function Header({ onUpload, loading, error, showUpload = true }: Props) {
   const router = useRouter();
 
   const handleLogout = async () => {
@@ -49,6 +50,9 @@ export default function Header({ onUpload, loading, showUpload = true }: Props)
                 hover:file:bg-indigo-500
                 cursor-pointer"
             />
+            {error && (
+              <p className="mt-2 max-w-xs text-xs text-rose-400">{error}</p>
+            )}
           </div>
         )}
 